@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+from pose_utils import LABELS, MISSING_VALUE
+
+TORSO = ['Rhip', 'Lhip', 'Lsho', 'Rsho']
+HEAD = ['nose', 'neck']
+
+DEFAULT_RULES = 'torso,not_distractor'
+
+
+def parse_keypoints(annotations):
+    """
+        Keypoints of a whole annotation dataframe as (N, 18, 2) int array in [y, x] order, -1 if missing.
+    """
+    def parse(column):
+        values = annotations[column].str.strip(' []')
+        return np.array(','.join(values).split(','), dtype=int).reshape((len(values), -1))
+    if len(annotations) == 0:
+        return np.zeros((0, len(LABELS), 2), dtype=int)
+    return np.stack([parse('keypoints_y'), parse('keypoints_x')], axis=-1)
+
+
+def visible(keypoints):
+    return np.all(keypoints != MISSING_VALUE, axis=-1)
+
+
+def joints_present(joint_names):
+    """
+        Rule: all of the joints are visible.
+    """
+    index = [LABELS.index(name) for name in joint_names]
+    return lambda names, keypoints: np.all(visible(keypoints[:, index]), axis=1)
+
+
+def min_visible_joints(number_of_joints):
+    """
+        Rule: at least number_of_joints joints are visible.
+    """
+    return lambda names, keypoints: visible(keypoints).sum(axis=1) >= number_of_joints
+
+
+def min_bbox_size(height, width):
+    """
+        Rule: bounding box of the visible joints is at least height x width.
+    """
+    def rule(names, keypoints):
+        mask = visible(keypoints)[..., np.newaxis]
+        extent = np.max(np.where(mask, keypoints, -np.inf), axis=1) - np.min(np.where(mask, keypoints, np.inf), axis=1)
+        return (extent[:, 0] >= height) & (extent[:, 1] >= width)
+    return rule
+
+
+def not_distractor():
+    """
+        Rule: not a Market-1501 junk (-1) or distractor (0000) image.
+    """
+    return lambda names, keypoints: ~(pd.Series(names).str.startswith('-1') |
+                                      pd.Series(names).str.startswith('0000')).values
+
+
+def parse_rules(spec):
+    """
+        Rules from a comma separated spec: torso, head, not_distractor, joints:Rhip+Lhip, min_visible:N,
+        min_bbox:HxW. Returns list of (spec, rule).
+    """
+    rules = []
+    for item in [item for item in spec.split(',') if item]:
+        name, _, param = item.partition(':')
+        if name == 'torso':
+            rule = joints_present(TORSO)
+        elif name == 'head':
+            rule = joints_present(HEAD)
+        elif name == 'joints':
+            rule = joints_present(param.split('+'))
+        elif name == 'min_visible':
+            rule = min_visible_joints(int(param))
+        elif name == 'min_bbox':
+            rule = min_bbox_size(*[int(v) for v in param.split('x')])
+        elif name == 'not_distractor':
+            rule = not_distractor()
+        else:
+            assert False, "Unknown validity rule %s" % item
+        rules.append((item, rule))
+    return rules
+
+
+def apply_rules(names, keypoints, rules):
+    """
+        Mask of rows passing all rules and a report with, for every rule, the number of rows failing it and
+        the number of rows it removed after the previous rules.
+    """
+    valid = np.ones(len(names), dtype=bool)
+    report = []
+    for spec, rule in rules:
+        passed = rule(names, keypoints)
+        report.append((spec, np.sum(~passed), np.sum(valid & ~passed)))
+        valid &= passed
+    return valid, report
+
+
+def print_report(report, number_of_rows):
+    print ("%-24s %10s %10s" % ('rule', 'failed', 'removed'))
+    for spec, failed, removed in report:
+        print ("%-24s %10s %10s" % (spec, failed, removed))
+    print ("Kept %s of %s annotations" % (number_of_rows - sum(removed for _, _, removed in report), number_of_rows))
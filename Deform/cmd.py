@@ -33,7 +33,8 @@ def args():
     parser.add_argument("--display_ratio", default=1, type=int,  help='Number of epochs between ploting')
     parser.add_argument("--start_epoch", default=0, type=int, help='Start epoch for starting from checkpoint')
     parser.add_argument("--pose_estimator", default='pose_estimator.h5',
-                            help='Pretrained model for cao pose estimator')
+                            help='Pretrained model for cao pose estimator, '
+                                 'stub for a tiny random weight model (pose_consistency.py)')
 
     parser.add_argument("--images_for_test", default=12000, type=int, help="Number of images for testing")
 
@@ -55,6 +56,55 @@ def args():
     parser.add_argument('--use_dropout_test', default=0, type=int,
                         help='To use dropout when generate images')
 
+    parser.add_argument('--per_sample_file', default='',
+                        help='File (.npz or .parquet) to save per pair metrics to, empty to not save them')
+
+    parser.add_argument('--eval_subset_size', default=1200, type=int,
+                        help='Number of test pairs in stratified subset evaluation and in sweep.py, 0 for all pairs')
+    parser.add_argument('--bootstrap_samples', default=1000, type=int,
+                        help='Number of bootstrap samples for confidence intervals')
+    parser.add_argument('--ci_confidence', default=0.95, type=float, help='Confidence level of confidence intervals')
+    parser.add_argument('--ci_width', default=0.01, type=float,
+                        help='Target confidence interval width, relative to the metric value')
+
+    parser.add_argument('--sweep_checkpoints', default=None,
+                        help='Glob of generator checkpoints to evaluate in sweep.py, '
+                             'default is all epoch_*_generator.h5 in checkpoints_dir')
+    parser.add_argument('--sweep_table', default='output/sweep.csv',
+                        help='Table with metrics of every checkpoint evaluated in sweep.py')
+
+    parser.add_argument('--pose_map_downscale', default=1, type=int,
+                        help='Average heatmaps and PAFs of compute_coordinates.py at image size / pose_map_downscale '
+                             'with sub-pixel peaks, 1 for full resolution, 8 for the network stride')
+    parser.add_argument('--pose_map_compare', default=0, type=int,
+                        help='Number of test images to compare full resolution and pose_map_downscale keypoints '
+                             'against the annotations in compute_coordinates.py, 0 to compute annotations')
+
+    parser.add_argument('--annotation_shards', default=1, type=int,
+                        help='Number of shards the images are split into by compute_coordinates.py')
+    parser.add_argument('--annotation_shard_ids', default='',
+                        help='Comma separated shards to annotate on this machine, empty for all shards')
+    parser.add_argument('--annotation_workers', default=1, type=int,
+                        help='Number of processes of compute_coordinates.py, each with its own model')
+    parser.add_argument('--annotation_chunk_size', default=256, type=int,
+                        help='Number of images written at once to a part file by compute_coordinates.py')
+
+    parser.add_argument('--max_pairs_per_person', default=0, type=int,
+                        help='Maximal number of pairs of one person in create_pairs_dataset.py, '
+                             'sampled with a fixed seed, 0 for all pairs')
+
+    parser.add_argument('--validity_rules', default='torso,not_distractor',
+                        help='Comma separated rules annotations must pass in create_pairs_dataset.py: torso, head, '
+                             'not_distractor, joints:Rhip+Lhip, min_visible:N, min_bbox:HxW')
+
+    parser.add_argument('--pair_sampling', default='file', choices=['file', 'online'],
+                        help='Train on the pairs of pairs_file_train or on pairs of the valid train images drawn '
+                             'for every epoch')
+    parser.add_argument('--min_pair_pose_distance', default=0, type=float,
+                        help='Minimal mean distance in pixels of the joints of online sampled pairs')
+    parser.add_argument('--max_pair_pose_distance', default=0, type=float,
+                        help='Maximal mean distance in pixels of the joints of online sampled pairs, 0 for no limit')
+
     # parser.add_argument("--input_folder", default = "", type = str, help = "path to training or testing data index")
     # parser.add_argument("--output_path", default = "", type = str, help = "path to training or testing data index")
 
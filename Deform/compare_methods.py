@@ -0,0 +1,146 @@
+import argparse
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from skimage.io import imread
+from skimage.transform import resize
+
+import pose_utils
+from pair_metrics import l1_scores, ssim_scores, save_per_sample
+
+
+def split_strip(image, number_of_tiles, target_tile, generated_tile):
+    w = image.shape[1] // number_of_tiles
+    return image[:, target_tile * w:(target_tile + 1) * w], image[:, generated_tile * w:(generated_tile + 1) * w]
+
+
+def deform_outputs(folder):
+    """
+        Outputs of Deform test.py: from_to.png strips of input | target | generated.
+    """
+    outputs = {}
+    for img_name in os.listdir(folder):
+        m = re.match(r'([A-Za-z0-9_]*.jpg)_([A-Za-z0-9_]*.jpg).png', img_name)
+        if m is not None:
+            outputs[m.groups()] = os.path.join(folder, img_name)
+    return outputs, lambda path: split_strip(imread(path), 3, 1, 2)
+
+
+def vunet_outputs(folder):
+    """
+        Outputs of VUNet transfer mode: from___to_vis.jpg strips of input | target | generated.
+    """
+    outputs = {}
+    for img_name in os.listdir(folder):
+        m = re.match(r'(.*)___(.*)_vis.jpg', img_name)
+        if m is not None:
+            outputs[m.groups()] = os.path.join(folder, img_name)
+    return outputs, lambda path: split_strip(imread(path), 3, 1, 2)
+
+
+def pg2_outputs(folder):
+    """
+        Outputs of PG2 trainer.test: test_result folder with x_target/%05d.png, G/%05d.png (or G2/ for stage 2)
+        and pairs.csv with the names of every index.
+    """
+    generated_folder = os.path.join(folder, 'G2') if os.path.exists(os.path.join(folder, 'G2')) else os.path.join(folder, 'G')
+    pairs = pd.read_csv(os.path.join(folder, 'pairs.csv'), dtype={'idx': str})
+    outputs = {}
+    for idx, fr, to in zip(pairs['idx'], pairs['from'], pairs['to']):
+        outputs[(fr, to)] = (os.path.join(folder, 'x_target', idx + '.png'), os.path.join(generated_folder, idx + '.png'))
+    return outputs, lambda paths: (imread(paths[0]), imread(paths[1]))
+
+
+ADAPTERS = {'deform': deform_outputs, 'pg2': pg2_outputs, 'vunet': vunet_outputs}
+
+
+def load_reference(images_dir, name, shape):
+    image = imread(os.path.join(images_dir, name))
+    if image.shape[:2] != shape[:2]:
+        image = resize(image, shape[:2], order=3, preserve_range=True, mode='reflect').astype(np.uint8)
+    return image
+
+
+def mask_images(names, images, annotations):
+    masked_images = []
+    for name, image in zip(names, images):
+        row = annotations.loc[name[1]]
+        kp_to = pose_utils.load_pose_cords_from_strings(row['keypoints_y'], row['keypoints_x'])
+        mask = pose_utils.produce_ma_mask(kp_to, image.shape[:2])
+        masked_images.append(image * mask[..., np.newaxis])
+    return masked_images
+
+
+def compare(methods, pairs_file, annotations_file, images_dir=None, per_sample_dir=None):
+    """
+        Score every method on the pairs of pairs_file that are present in the outputs of all methods.
+        methods is a list of (name, layout, folder), layout is one of ADAPTERS.
+    """
+    from gan.inception_score import get_inception_score
+
+    pairs = pd.read_csv(pairs_file)
+    canonical = list(zip(pairs['from'], pairs['to']))
+    annotations = pd.read_csv(annotations_file, sep=':').set_index('name')
+
+    outputs = {}
+    for name, layout, folder in methods:
+        outputs[name] = ADAPTERS[layout](folder)
+        print ("%s: %s outputs, %s of %s test pairs" % (name, len(outputs[name][0]),
+                                                         sum(pair in outputs[name][0] for pair in canonical), len(pairs)))
+    common = [pair for pair in canonical if all(pair in outputs[name][0] for name, _, _ in methods)]
+    print ("Number of pairs common to all methods: %s" % len(common))
+
+    table = []
+    for name, _, _ in methods:
+        paths, reader = outputs[name]
+        target_images = []
+        generated_images = []
+        for pair in common:
+            target, generated = reader(paths[pair])
+            if images_dir is not None:
+                target = load_reference(images_dir, pair[1], generated.shape)
+            target_images.append(target)
+            generated_images.append(generated)
+
+        ssim = ssim_scores(generated_images, target_images)
+        l1 = l1_scores(generated_images, target_images)
+        ssim_masked = ssim_scores(mask_images(common, generated_images, annotations),
+                                  mask_images(common, target_images, annotations))
+        inception_score = get_inception_score(generated_images)[0]
+        row = {'method': name, 'pairs': len(common), 'ssim': np.mean(ssim), 'ssim_masked': np.mean(ssim_masked),
+               'l1': np.mean(l1), 'inception_score': inception_score}
+        print (row)
+        table.append(row)
+
+        if per_sample_dir is not None:
+            if not os.path.exists(per_sample_dir):
+                os.makedirs(per_sample_dir)
+            save_per_sample(os.path.join(per_sample_dir, name + '.npz'), common, ssim=ssim, ssim_masked=ssim_masked, l1=l1)
+
+    return pd.DataFrame(table, columns=['method', 'pairs', 'ssim', 'ssim_masked', 'l1', 'inception_score'])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare outputs of Deform, PG2 and VUNet on a common set of pairs")
+    parser.add_argument("--method", action='append', required=True,
+                        help="name:layout:folder, layout is one of %s. Can be given several times" % sorted(ADAPTERS))
+    parser.add_argument("--pairs_file", default='../DATA/market-pairs-test.csv', help="Canonical list of test pairs")
+    parser.add_argument("--annotations_file", default='../DATA/market-annotation-test.csv',
+                        help="Annotations of the test images, used for masked metrics")
+    parser.add_argument("--images_dir", default=None,
+                        help="Folder with real test images, used as reference instead of the target tile of every method")
+    parser.add_argument("--per_sample_dir", default=None, help="Folder to save per pair metrics of every method")
+    parser.add_argument("--output_table", default='output/comparison.csv', help="Combined table of metrics")
+    args = parser.parse_args()
+
+    methods = [tuple(method.split(':', 2)) for method in args.method]
+    for _, layout, _ in methods:
+        assert layout in ADAPTERS, "Unknown layout %s" % layout
+
+    table = compare(methods, args.pairs_file, args.annotations_file, args.images_dir, args.per_sample_dir)
+    print (table.to_string(index=False))
+    if os.path.dirname(args.output_table) and not os.path.exists(os.path.dirname(args.output_table)):
+        os.makedirs(os.path.dirname(args.output_table))
+    table.to_csv(args.output_table, index=False)
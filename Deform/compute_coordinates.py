@@ -1,20 +1,17 @@
 import pose_utils
 import os
+import zlib
 import numpy as np
 
-from keras.models import load_model
 import skimage.transform as st
 import pandas as pd
-from tqdm import tqdm
 from skimage.io import imread
 from skimage.transform import resize
 from scipy.ndimage import gaussian_filter
+from glob import glob
+from multiprocessing import Process
 
-from cmd import args
-
-args = args()
-
-model = load_model(args.pose_estimator)
+import cmd
 
 
 mapIdx = [[31,32], [39,40], [33,34], [35,36], [41,42], [43,44], [19,20], [21,22],
@@ -25,78 +22,182 @@ limbSeq = [[2,3], [2,6], [3,4], [4,5], [6,7], [7,8], [2,9], [9,10],
            [10,11], [2,12], [12,13], [13,14], [2,1], [1,15], [15,17],
            [1,16], [16,18], [3,17], [6,18]]
 
-
-def compute_cordinates(heatmap_avg, paf_avg, th1=0.1, th2=0.05):
-    all_peaks = []
-    peak_counter = 0
-
-    for part in range(18):
-        map_ori = heatmap_avg[:,:,part]
-        map = gaussian_filter(map_ori, sigma=3)
-
-        map_left = np.zeros(map.shape)
-        map_left[1:,:] = map[:-1,:]
-        map_right = np.zeros(map.shape)
-        map_right[:-1,:] = map[1:,:]
-        map_up = np.zeros(map.shape)
-        map_up[:,1:] = map[:,:-1]
-        map_down = np.zeros(map.shape)
-        map_down[:,:-1] = map[:,1:]
-
-        peaks_binary = np.logical_and.reduce((map>=map_left, map>=map_right, map>=map_up, map>=map_down, map > th1))
-        peaks = zip(np.nonzero(peaks_binary)[1], np.nonzero(peaks_binary)[0]) # note reverse
-
-        peaks_with_score = [x + (map_ori[x[1],x[0]],) for x in peaks]
-        id = range(peak_counter, peak_counter + len(peaks))
-        peaks_with_score_and_id = [peaks_with_score[i] + (id[i],) for i in range(len(id))]
-
-        all_peaks.append(peaks_with_score_and_id)
-        peak_counter += len(peaks)
+boxsize = 368
+scale_search = [0.5, 1, 1.5, 2]
+
+
+def load_estimator(pose_estimator):
+    from keras.models import load_model
+    return load_model(pose_estimator)
+
+
+def build_stub_estimator():
+    """
+        Tiny estimator with random weights and the outputs of the pose estimator (38 PAF and 19 heatmap
+        channels at stride 8). Only for running the pipeline without pose_estimator.h5.
+    """
+    from keras.models import Model
+    from keras.layers import Input, Conv2D
+    x = inp = Input((None, None, 3))
+    for _ in range(3):
+        x = Conv2D(8, (3, 3), strides=(2, 2), padding='same', activation='relu')(x)
+    paf = Conv2D(38, (1, 1), activation='tanh')(x)
+    heatmap = Conv2D(19, (1, 1), activation='sigmoid')(x)
+    return Model(inputs=[inp], outputs=[paf, heatmap])
+
+
+def estimate_maps(model, images, downscale=1):
+    """
+        Heatmaps and PAFs averaged over scales for a list of images in B,G,R order. For every scale the resized
+        images of the same size are run as one batch, so every image gets the outputs it gets alone. Outputs
+        are resized to image size, or to image size / downscale.
+    """
+    map_sizes = [tuple((np.array(image.shape[:2]) + downscale - 1) // downscale) for image in images]
+    heatmap_avg = [np.zeros(map_size + (19,)) for map_size in map_sizes]
+    paf_avg = [np.zeros(map_size + (38,)) for map_size in map_sizes]
+
+    for m in range(len(scale_search)):
+        imageToTest = []
+        for image in images:
+            scale = scale_search[m] * boxsize / image.shape[0]
+            new_size = (np.array(image.shape[:2]) * scale).astype(np.int32)
+            imageToTest.append(resize(image, new_size, order=3, preserve_range=True)/255 - 0.5)
+
+        groups = {}
+        for i, img in enumerate(imageToTest):
+            groups.setdefault(img.shape[:2], []).append(i)
+
+        for indices in groups.values():
+            output1, output2 = model.predict(np.array([imageToTest[i] for i in indices]))
+            for i, heatmap, paf in zip(indices, output2, output1):
+                heatmap_avg[i] += st.resize(heatmap, map_sizes[i], preserve_range=True, order=1)
+                paf_avg[i] += st.resize(paf, map_sizes[i], preserve_range=True, order=1)
+
+    for heatmap in heatmap_avg:
+        heatmap /= len(scale_search)
+    return heatmap_avg, paf_avg
+
+
+def estimate_poses(model, images, batch_size=16, downscale=1):
+    """
+        Keypoints ([y, x], -1 if missing) of a list of R,G,B images.
+    """
+    poses = []
+    for start in range(0, len(images), batch_size):
+        batch = [image[:, :, ::-1] for image in images[start:start + batch_size]]
+        heatmap_avg, paf_avg = estimate_maps(model, batch, downscale)
+        for heatmap, paf in zip(heatmap_avg, paf_avg):
+            poses.append(compute_cordinates(heatmap, paf, downscale=downscale))
+    return np.array(poses).reshape((-1, 18, 2))
+
+
+def refine_peaks(maps, part, x, y):
+    """
+        Sub-pixel position of peaks, vertex of the parabola through the peak and its neighbours along each axis.
+    """
+    center = maps[y, x, part]
+
+    def offset(lower, upper, interior):
+        denominator = lower - 2 * center + upper
+        valid = interior & (denominator < 0)
+        delta = 0.5 * (lower - upper) / np.where(valid, denominator, -1)
+        return np.where(valid, np.clip(delta, -0.5, 0.5), 0.)
+
+    h, w = maps.shape[:2]
+    dx = offset(maps[y, np.maximum(x-1, 0), part], maps[y, np.minimum(x+1, w-1), part], (x > 0) & (x < w-1))
+    dy = offset(maps[np.maximum(y-1, 0), x, part], maps[np.minimum(y+1, h-1), x, part], (y > 0) & (y < h-1))
+    return x + dx, y + dy
+
+
+def find_peaks(heatmap_avg, th1=0.1, downscale=1):
+    """
+        Local maxima of the 18 smoothed heatmaps at once. Rows of (x, y, score, id) ordered by joint and then
+        by position, and the joint of every row.
+    """
+    heatmap = heatmap_avg[:, :, :18]
+    maps = gaussian_filter(heatmap, sigma=(3.0/downscale, 3.0/downscale, 0))
+
+    map_left = np.zeros(maps.shape)
+    map_left[1:,:] = maps[:-1,:]
+    map_right = np.zeros(maps.shape)
+    map_right[:-1,:] = maps[1:,:]
+    map_up = np.zeros(maps.shape)
+    map_up[:,1:] = maps[:,:-1]
+    map_down = np.zeros(maps.shape)
+    map_down[:,:-1] = maps[:,1:]
+
+    peaks_binary = np.logical_and.reduce((maps>=map_left, maps>=map_right, maps>=map_up, maps>=map_down, maps > th1))
+    part, y, x = np.nonzero(peaks_binary.transpose(2, 0, 1))
+    score = heatmap[y, x, part]
+    if downscale != 1:
+        x, y = refine_peaks(maps, part, x, y)
+
+    return np.stack([x, y, score, np.arange(len(part))], axis=1).astype('float64'), part
+
+
+def score_limb(candA, candB, score_mid, height, th2=0.05, mid_num=10):
+    """
+        Indices (i, j) and scores of the candA x candB pairs accepted as limbs. The PAF is sampled at mid_num
+        points along all segments at once and integrated against the segment direction.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vec = candB[np.newaxis, :, :2] - candA[:, np.newaxis, :2]
+        norm = np.sqrt(vec[..., 0]*vec[..., 0] + vec[..., 1]*vec[..., 1])
+        vec = vec / norm[..., np.newaxis]
+
+        start = np.broadcast_to(candA[:, np.newaxis, :2], vec.shape)
+        end = np.broadcast_to(candB[np.newaxis, :, :2], vec.shape)
+        startend = np.floor(np.linspace(start, end, num=mid_num, axis=-1) + 0.5).astype(int)
+        samples = score_mid[startend[..., 1, :], startend[..., 0, :]]
+
+        score_midpts = samples[..., 0] * vec[..., 0:1] + samples[..., 1] * vec[..., 1:2]
+        score_sum = 0
+        for I in range(mid_num):
+            score_sum = score_sum + score_midpts[..., I]
+        score_with_dist_prior = score_sum / mid_num + np.minimum(0.5*height/norm-1, 0)
+
+    criterion1 = np.count_nonzero(score_midpts > th2, axis=-1) > 0.8 * mid_num
+    criterion2 = score_with_dist_prior > 0
+    i, j = np.nonzero(criterion1 & criterion2)
+    return i, j, score_with_dist_prior[i, j]
+
+
+def connect_limb(candA, candB, i, j, score):
+    """
+        Greedy assignment, pairs in decreasing order of score while both ends are free.
+        Rows of (id A, id B, score, i, j).
+    """
+    nA, nB = len(candA), len(candB)
+    used_A = np.zeros(nA, dtype=bool)
+    used_B = np.zeros(nB, dtype=bool)
+    selected = []
+    for c in np.argsort(-score, kind='mergesort'):
+        if not used_A[i[c]] and not used_B[j[c]]:
+            used_A[i[c]] = used_B[j[c]] = True
+            selected.append(c)
+            if len(selected) >= min(nA, nB):
+                break
+    selected = np.array(selected, dtype=int)
+    return np.stack([candA[i[selected], 3], candB[j[selected], 3], score[selected], i[selected], j[selected]], axis=1)
+
+
+def compute_cordinates(heatmap_avg, paf_avg, th1=0.1, th2=0.05, downscale=1):
+    """
+        Keypoints of the best person. Maps of size image size / downscale are parsed with gaussian smoothing
+        scaled accordingly and sub-pixel peaks, the keypoints are returned in image coordinates.
+    """
+    candidate, candidate_part = find_peaks(heatmap_avg, th1, downscale)
 
     connection_all = []
     special_k = []
-    mid_num = 10
 
     for k in range(len(mapIdx)):
         score_mid = paf_avg[:,:,[x-19 for x in mapIdx[k]]]
-        candA = all_peaks[limbSeq[k][0]-1]
-        candB = all_peaks[limbSeq[k][1]-1]
-        nA = len(candA)
-        nB = len(candB)
-        indexA, indexB = limbSeq[k]
-        if(nA != 0 and nB != 0):
-            connection_candidate = []
-            for i in range(nA):
-                for j in range(nB):
-                    vec = np.subtract(candB[j][:2], candA[i][:2])
-                    norm = np.sqrt(vec[0]*vec[0] + vec[1]*vec[1])
-                    vec = np.divide(vec, norm)
-
-                    startend = zip(np.linspace(candA[i][0], candB[j][0], num=mid_num),
-                                   np.linspace(candA[i][1], candB[j][1], num=mid_num))
-
-                    vec_x = np.array([score_mid[int(round(startend[I][1])), int(round(startend[I][0])), 0]
-                                      for I in range(len(startend))])
-                    vec_y = np.array([score_mid[int(round(startend[I][1])), int(round(startend[I][0])), 1]
-                                      for I in range(len(startend))])
-
-                    score_midpts = np.multiply(vec_x, vec[0]) + np.multiply(vec_y, vec[1])
-                    score_with_dist_prior = sum(score_midpts)/len(score_midpts) + min(0.5*oriImg.shape[0]/norm-1, 0)
-                    criterion1 = len(np.nonzero(score_midpts > th2)[0]) > 0.8 * len(score_midpts)
-                    criterion2 = score_with_dist_prior > 0
-                    if criterion1 and criterion2:
-                        connection_candidate.append([i, j, score_with_dist_prior, score_with_dist_prior+candA[i][2]+candB[j][2]])
-
-            connection_candidate = sorted(connection_candidate, key=lambda x: x[2], reverse=True)
-            connection = np.zeros((0,5))
-            for c in range(len(connection_candidate)):
-                i,j,s = connection_candidate[c][0:3]
-                if(i not in connection[:,3] and j not in connection[:,4]):
-                    connection = np.vstack([connection, [candA[i][3], candB[j][3], s, i, j]])
-                    if(len(connection) >= min(nA, nB)):
-                        break
-
-            connection_all.append(connection)
+        candA = candidate[candidate_part == limbSeq[k][0]-1]
+        candB = candidate[candidate_part == limbSeq[k][1]-1]
+        if(len(candA) != 0 and len(candB) != 0):
+            i, j, score = score_limb(candA, candB, score_mid, paf_avg.shape[0], th2)
+            connection_all.append(connect_limb(candA, candB, i, j, score))
         else:
             special_k.append(k)
             connection_all.append([])
@@ -104,7 +205,6 @@ def compute_cordinates(heatmap_avg, paf_avg, th1=0.1, th2=0.05):
     # last number in each row is the total parts number of that person
     # the second last number in each row is the score of the overall configuration
     subset = -1 * np.ones((0, 20))
-    candidate = np.array([item for sublist in all_peaks for item in sublist])
 
     for k in range(len(mapIdx)):
         if k not in special_k:
@@ -113,12 +213,8 @@ def compute_cordinates(heatmap_avg, paf_avg, th1=0.1, th2=0.05):
             indexA, indexB = np.array(limbSeq[k]) - 1
 
             for i in range(len(connection_all[k])): #= 1:size(temp,1)
-                found = 0
-                subset_idx = [-1, -1]
-                for j in range(len(subset)): #1:size(subset,1):
-                    if subset[j][indexA] == partAs[i] or subset[j][indexB] == partBs[i]:
-                        subset_idx[found] = j
-                        found += 1
+                subset_idx = np.nonzero((subset[:, indexA] == partAs[i]) | (subset[:, indexB] == partBs[i]))[0]
+                found = len(subset_idx)
 
                 if found == 1:
                     j = subset_idx[0]
@@ -168,53 +264,174 @@ def compute_cordinates(heatmap_avg, paf_avg, th1=0.1, th2=0.05):
         else:
             Y = candidate[part.astype(int), 0]
             X = candidate[part.astype(int), 1]
+            if downscale != 1:
+                X, Y = [np.round((c + 0.5) * downscale - 0.5) for c in (X, Y)]
             cordinates.append([X, Y])
     return np.array(cordinates).astype(int)
 
-for dataset in ['train', 'test']:
-    input_folder = vars(args)['images_dir_' + dataset]
-    output_path = vars(args)['annotations_file_' + dataset]
 
-    threshold = 0.1
-    boxsize = 368
-    scale_search = [0.5, 1, 1.5, 2]
-
-    if os.path.exists(output_path):
-        processed_names = set(pd.read_csv(output_path, sep=':')['name'])
-        result_file = open(output_path, 'a')
+def compare_map_resolution(model, images_dir, annotations_file, number_of_images, downscale, batch_size=16):
+    """
+        Keypoints from full resolution maps and from maps of image size / downscale against the annotations of
+        a random sample of images. Prints detection rate, mean distance to annotated keypoints and time per image.
+    """
+    import time
+    annotations = pd.read_csv(annotations_file, sep=':')
+    annotations = annotations.sample(n=min(number_of_images, len(annotations)), random_state=0)
+    target = np.array([pose_utils.load_pose_cords_from_strings(row['keypoints_y'], row['keypoints_x'])
+                       for _, row in annotations.iterrows()])
+    images = [imread(os.path.join(images_dir, name)) for name in annotations['name']]
+    visible_target = np.all(target != pose_utils.MISSING_VALUE, axis=-1)
+
+    print ("%-9s %10s %10s %10s %10s" % ('downscale', 'detected', 'missed', 'distance', 'sec/image'))
+    for factor in [1, downscale]:
+        start = time.time()
+        predicted = estimate_poses(model, images, batch_size, downscale=factor)
+        elapsed = (time.time() - start) / len(images)
+
+        visible_predicted = np.all(predicted != pose_utils.MISSING_VALUE, axis=-1)
+        both = visible_target & visible_predicted
+        distance = np.sqrt(np.sum((predicted - target).astype('float32') ** 2, axis=-1))
+        print ("%-9s %10.4f %10.4f %10.4f %10.4f" % (factor, np.mean(visible_predicted[visible_target]),
+                                                     np.mean(~visible_predicted[visible_target]),
+                                                     np.mean(distance[both]) if np.any(both) else np.nan, elapsed))
+
+
+def annotation_line(image_name, pose_cords):
+    return "%s: %s: %s" % (image_name, str(list(pose_cords[:, 0])), str(list(pose_cords[:, 1])))
+
+
+def shard_of(image_name, number_of_shards):
+    """
+        Shard of an image, from a hash of its name. Does not depend on listing order or on other images.
+    """
+    return (zlib.crc32(image_name.encode('utf-8')) & 0xffffffff) % number_of_shards
+
+
+def part_files(parts_dir, shard='*'):
+    return sorted(glob(os.path.join(parts_dir, 'shard_%s_part_*.csv' % (shard if shard == '*' else '%05d' % shard))))
+
+
+def read_names(file_name):
+    with open(file_name) as f:
+        return [line.split(':', 1)[0] for line in f.read().splitlines()[1:]]
+
+
+def annotate_shard(model, input_folder, image_names, parts_dir, shard, batch_size, chunk_size, downscale=1):
+    """
+        Annotate the images of one shard. Every chunk of chunk_size images is written to a temporary file and
+        renamed to a part file, so a part file is either complete or absent. Images in part files are skipped.
+    """
+    existing = part_files(parts_dir, shard)
+    processed_names = set()
+    for part_file in existing:
+        processed_names.update(read_names(part_file))
+    image_names = [name for name in image_names if name not in processed_names]
+
+    for part_index, chunk_start in enumerate(range(0, len(image_names), chunk_size), len(existing)):
+        chunk_names = image_names[chunk_start:chunk_start + chunk_size]
+        lines = ['name:keypoints_y:keypoints_x']
+        for start in range(0, len(chunk_names), batch_size):
+            batch_names = chunk_names[start:start + batch_size]
+            oriImgs = [imread(os.path.join(input_folder, image_name))[:, :, ::-1] for image_name in batch_names]  # B,G,R order
+
+            heatmap_avg, paf_avg = estimate_maps(model, oriImgs, downscale)
+
+            for image_name, heatmap, paf in zip(batch_names, heatmap_avg, paf_avg):
+                pose_cords = compute_cordinates(heatmap, paf, downscale=downscale)
+                lines.append(annotation_line(image_name, pose_cords))
+
+        part_file = os.path.join(parts_dir, 'shard_%05d_part_%06d.csv' % (shard, part_index))
+        with open(part_file + '.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.rename(part_file + '.tmp', part_file)
+        print ("Shard %s: %s of %s images" % (shard, chunk_start + len(chunk_names), len(image_names)))
+
+
+def annotation_worker(pose_estimator, jobs, batch_size, chunk_size, downscale):
+    model = load_estimator(pose_estimator)
+    for input_folder, image_names, parts_dir, shard in jobs:
+        annotate_shard(model, input_folder, image_names, parts_dir, shard, batch_size, chunk_size, downscale)
+
+
+def merge_parts(parts_dir, output_path):
+    """
+        Annotation file from the existing output_path and all part files, one line per image sorted by name.
+    """
+    lines = {}
+    for file_name in ([output_path] if os.path.exists(output_path) else []) + part_files(parts_dir):
+        with open(file_name) as f:
+            for line in f.read().splitlines()[1:]:
+                lines.setdefault(line.split(':', 1)[0], line)
+
+    with open(output_path + '.tmp', 'w') as f:
+        f.write('name:keypoints_y:keypoints_x\n')
+        for name in sorted(lines):
+            f.write(lines[name] + '\n')
+    os.rename(output_path + '.tmp', output_path)
+
+
+def main():
+    """
+        Annotate train and test images. Images are split into annotation_shards shards, the selected shards are
+        processed by annotation_workers processes with a model each. Part files of every dataset are merged
+        into the annotation file once all its images are annotated.
+    """
+    args = cmd.args()
+
+    if args.pose_map_compare > 0:
+        model = load_estimator(args.pose_estimator)
+        compare_map_resolution(model, args.images_dir_test, args.annotations_file_test,
+                               args.pose_map_compare, args.pose_map_downscale, args.batch_size)
+        return
+
+    if args.annotation_shard_ids:
+        shard_ids = [int(shard) for shard in args.annotation_shard_ids.split(',')]
     else:
-        result_file = open(output_path, 'w')
-        processed_names = set()
-        print >> result_file, 'name:keypoints_y:keypoints_x'
-
-    for image_name in tqdm(os.listdir(input_folder)):
-        if image_name in processed_names:
-            continue
-
-        oriImg = imread(os.path.join(input_folder, image_name))[:, :, ::-1]  # B,G,R order
-
-        multiplier = [x * boxsize / oriImg.shape[0] for x in scale_search]
-
-        heatmap_avg = np.zeros((oriImg.shape[0], oriImg.shape[1], 19))
-        paf_avg = np.zeros((oriImg.shape[0], oriImg.shape[1], 38))
-
-        for m in range(len(multiplier)):
-            scale = multiplier[m]
-
-            new_size = (np.array(oriImg.shape[:2]) * scale).astype(np.int32)
-            imageToTest = resize(oriImg, new_size, order=3, preserve_range=True)
-            imageToTest_padded = imageToTest[np.newaxis, :, :, :]/255 - 0.5
-
-            output1, output2 = model.predict(imageToTest_padded)
-
-            heatmap = st.resize(output2[0], oriImg.shape[:2], preserve_range=True, order=1)
-            paf = st.resize(output1[0], oriImg.shape[:2], preserve_range=True, order=1)
-            heatmap_avg += heatmap
-            paf_avg += paf
-
-        heatmap_avg /= len(multiplier)
+        shard_ids = range(args.annotation_shards)
+
+    datasets = []
+    jobs = []
+    for dataset in ['train', 'test']:
+        input_folder = vars(args)['images_dir_' + dataset]
+        output_path = vars(args)['annotations_file_' + dataset]
+        parts_dir = output_path + '.parts'
+        if not os.path.exists(parts_dir):
+            os.makedirs(parts_dir)
+
+        processed_names = set(read_names(output_path)) if os.path.exists(output_path) else set()
+        image_names = sorted(name for name in os.listdir(input_folder) if name not in processed_names)
+        shards = [shard_of(name, args.annotation_shards) for name in image_names]
+        for shard in shard_ids:
+            jobs.append((input_folder, [name for name, s in zip(image_names, shards) if s == shard], parts_dir, shard))
+        datasets.append((parts_dir, output_path, image_names))
+
+    if args.annotation_workers == 1:
+        annotation_worker(args.pose_estimator, jobs, args.batch_size, args.annotation_chunk_size, args.pose_map_downscale)
+    else:
+        workers = [Process(target=annotation_worker, args=(args.pose_estimator, jobs[worker::args.annotation_workers],
+                                                           args.batch_size, args.annotation_chunk_size,
+                                                           args.pose_map_downscale))
+                   for worker in range(args.annotation_workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        assert all(worker.exitcode == 0 for worker in workers), "Annotation worker failed, rerun to resume"
+
+    for parts_dir, output_path, image_names in datasets:
+        annotated_names = set()
+        for part_file in part_files(parts_dir):
+            annotated_names.update(read_names(part_file))
+        missing = sum(name not in annotated_names for name in image_names)
+        if missing == 0:
+            merge_parts(parts_dir, output_path)
+            for part_file in part_files(parts_dir):
+                os.remove(part_file)
+            print ("Merged annotations to %s" % output_path)
+        else:
+            print ("%s images of %s are not annotated yet, not merging" % (missing, output_path))
 
-        pose_cords = compute_cordinates(heatmap_avg, paf_avg)
 
-        print >> result_file, "%s: %s: %s" % (image_name, str(list(pose_cords[:, 0])), str(list(pose_cords[:, 1])))
-        result_file.flush()
+if __name__ == "__main__":
+    main()
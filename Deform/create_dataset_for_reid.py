@@ -18,7 +18,7 @@ def generate_images(dataset, generator, use_input_pose, out_dir):
     if not os.path.exists(out_dir):
         os.makedirs(out_dir)
 
-    for _ in tqdm(range(dataset._pairs_file_test.shape[0])):
+    for _ in tqdm(range(dataset._pairs_test.shape[0])):
         number += 1
         batch, name = dataset.next_generator_sample_test(with_names=True)
         out = generator.predict(batch)
@@ -27,7 +27,7 @@ def generate_images(dataset, generator, use_input_pose, out_dir):
         #to_image = deprocess_image(batch[out_index])
         generated_image = deprocess_image(out[out_index])
         out = np.squeeze(generated_image)# np.concatenate([from_image, to_image, generated_image], axis=1))
-        name = name.iloc[0]['from'].replace('.jpg', 'g' + str(number) + '.jpg')
+        name = name[0, 0].replace('.jpg', 'g' + str(number) + '.jpg')
         imsave(os.path.join(out_dir, name), out)
 
 
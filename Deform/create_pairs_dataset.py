@@ -1,18 +1,19 @@
+import numpy as np
 import pandas as pd
 from cmd import args
-import pose_transform
-import pose_utils
+import annotation_filters
+from pair_sampler import person_of
 from itertools import permutations
 
 args = args()
 
 
-def filter_not_valid(df_keypoints):
-    def check_valid(x):
-        kp_array = pose_utils.load_pose_cords_from_strings(x['keypoints_y'], x['keypoints_x'])
-        distractor = x['name'].startswith('-1') or x['name'].startswith('0000')
-        return pose_transform.check_valid(kp_array) and not distractor
-    return df_keypoints[df_keypoints.apply(check_valid, axis=1)].copy()
+def filter_not_valid(df_keypoints, rules=annotation_filters.DEFAULT_RULES):
+    names = df_keypoints['name'].values
+    valid, report = annotation_filters.apply_rules(names, annotation_filters.parse_keypoints(df_keypoints),
+                                                   annotation_filters.parse_rules(rules))
+    annotation_filters.print_report(report, len(names))
+    return df_keypoints[valid].copy()
 
 
 # def make_pairs(df):
@@ -29,36 +30,77 @@ def filter_not_valid(df_keypoints):
 #     pair_df['to'] = to
 #     return pair_df
 
-def make_pairs(df):
-    persons = df.apply(lambda x: '_'.join(x['name'][x['name'].find('id'):(x['name'].find('id')+12)]), axis=1)
-    df['person'] = persons
-    fr, to = [], []
-    for person in pd.unique(persons):
-        # python 3.6
-        pairs = list(zip(*list(permutations(df[df['person'] == person]['name'], 2))))
-        # python 2.7
-        # pairs = zip(*list(permutations(df[df['person'] == person]['name'], 2)))
-        if len(pairs) != 0:
-            fr += list(pairs[0])
-            to += list(pairs[1])
-    pair_df = pd.DataFrame(index=range(len(fr)))
-    pair_df['from'] = fr
-    pair_df['to'] = to
-    return pair_df
+def person_pairs(names, max_pairs_per_person=0, random_state=0):
+    """
+        Index arrays (from, to) of the ordered pairs of different images of every person, persons in order of
+        first appearance. Images are grouped once by a stable sort on the person, pair k of a person with n images
+        is (k // (n - 1), k % (n - 1)) with the diagonal skipped. With max_pairs_per_person a seeded random subset
+        of the pairs of every person is kept.
+    """
+    codes, _ = pd.factorize(np.array([person_of(name) for name in names], dtype=object))
+    order = np.argsort(codes, kind='mergesort')
+    rng = np.random.RandomState(random_state)
+
+    for members in np.split(order, np.flatnonzero(np.diff(codes[order])) + 1):
+        n = len(members)
+        if n < 2:
+            continue
+        number_of_pairs = n * (n - 1)
+        if max_pairs_per_person and number_of_pairs > max_pairs_per_person:
+            k = np.sort(rng.choice(number_of_pairs, max_pairs_per_person, replace=False))
+        else:
+            k = np.arange(number_of_pairs)
+        first = k // (n - 1)
+        second = k % (n - 1)
+        second += second >= first
+        yield members[first], members[second]
+
+
+def pairs_frame(names, pairs):
+    fr = np.concatenate([pair[0] for pair in pairs]) if pairs else np.zeros(0, dtype=int)
+    to = np.concatenate([pair[1] for pair in pairs]) if pairs else np.zeros(0, dtype=int)
+    return pd.DataFrame({'from': names[fr], 'to': names[to]}, columns=['from', 'to'])
+
+
+def make_pairs(df, pairs_file=None, max_pairs_per_person=0, random_state=0, chunk_size=1000000):
+    """
+        Pairs of images of the same person. If pairs_file is given pairs are written to it every chunk_size pairs
+        and their number is returned, otherwise a dataframe with all pairs.
+    """
+    names = df['name'].values
+    pairs = person_pairs(names, max_pairs_per_person, random_state)
+    if pairs_file is None:
+        return pairs_frame(names, list(pairs))
+
+    number_of_pairs = 0
+    with open(pairs_file, 'w') as f:
+        f.write('from,to\n')
+        chunk = []
+        chunk_pairs = 0
+        for pair in pairs:
+            chunk.append(pair)
+            chunk_pairs += len(pair[0])
+            if chunk_pairs >= chunk_size:
+                pairs_frame(names, chunk).to_csv(f, index=False, header=False)
+                number_of_pairs += chunk_pairs
+                chunk = []
+                chunk_pairs = 0
+        pairs_frame(names, chunk).to_csv(f, index=False, header=False)
+        number_of_pairs += chunk_pairs
+    return number_of_pairs
 
 
 if __name__ == "__main__":
     df_keypoints = pd.read_csv(args.annotations_file_train, sep=':')
-    df = filter_not_valid(df_keypoints)
+    df = filter_not_valid(df_keypoints, args.validity_rules)
     print ('Compute pair dataset for train...')
-    pairs_df_train = make_pairs(df)
-    print ('Number of pairs: %s' % len(pairs_df_train))
-    pairs_df_train.to_csv(args.pairs_file_train, index=False)
+    number_of_pairs = make_pairs(df, args.pairs_file_train, args.max_pairs_per_person)
+    print ('Number of pairs: %s' % number_of_pairs)
 
     print ('Compute pair dataset for test...')
     df_keypoints = pd.read_csv(args.annotations_file_test, sep=':')
-    df = filter_not_valid(df_keypoints)
-    pairs_df_test = make_pairs(df)
+    df = filter_not_valid(df_keypoints, args.validity_rules)
+    pairs_df_test = make_pairs(df, max_pairs_per_person=args.max_pairs_per_person)
     pairs_df_test = pairs_df_test.sample(n=min(args.images_for_test, pairs_df_test.shape[0]), replace=False, random_state=0)
     print ('Number of pairs: %s' % len(pairs_df_test))
     pairs_df_test.to_csv(args.pairs_file_test, index=False)
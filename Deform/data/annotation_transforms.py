@@ -0,0 +1,133 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+MISSING_VALUE = -1
+
+## pairs of left and right joints in the order of pose_utils.LABELS
+FLIP_PAIRS = [(2, 5), (3, 6), (4, 7), (8, 11), (9, 12), (10, 13), (14, 15), (16, 17)]
+FLIP_ORDER = np.arange(18)
+for a, b in FLIP_PAIRS:
+    FLIP_ORDER[a], FLIP_ORDER[b] = b, a
+
+
+def parse_column(values):
+    """
+        Keypoint strings like '[12, -1, 30]' of a whole column to a (N, 18) int array.
+    """
+    values = pd.Series(values).str.strip(' []')
+    return np.array(','.join(values).split(','), dtype=int).reshape((len(values), -1))
+
+
+def format_column(values):
+    return ['[' + ', '.join(str(v) for v in row) + ']' for row in values]
+
+
+def load_annotations(file_name):
+    """
+        Names and keypoints (N, 18, 2) in [y, x] order, -1 if missing.
+    """
+    df = pd.read_csv(file_name, sep=':')
+    keypoints = np.stack([parse_column(df['keypoints_y']), parse_column(df['keypoints_x'])], axis=-1)
+    return df['name'].values, keypoints
+
+
+def save_annotations(file_name, names, keypoints):
+    keypoints = to_int(keypoints)
+    df = pd.DataFrame({'name': names, 'keypoints_y': format_column(keypoints[..., 0]),
+                       'keypoints_x': format_column(keypoints[..., 1])})
+    df.to_csv(file_name, sep=':', index=False, columns=['name', 'keypoints_y', 'keypoints_x'])
+
+
+def to_float(keypoints):
+    """
+        Float keypoints with nan for missing ones, so that transformed keypoints are never taken for missing.
+    """
+    missing = np.any(keypoints == MISSING_VALUE, axis=-1, keepdims=True)
+    return np.where(missing, np.nan, keypoints).astype('float64')
+
+
+def to_int(keypoints):
+    """
+        Integer keypoints with -1 for missing ones, truncated as in the resize of resize_fasion.py.
+    """
+    keypoints = np.asarray(keypoints, dtype='float64')
+    return np.where(np.isnan(keypoints), MISSING_VALUE, np.nan_to_num(keypoints)).astype(int)
+
+
+def crop(keypoints, top, left):
+    return keypoints - np.array([top, left], dtype='float64')
+
+
+def pad(keypoints, top, left):
+    return keypoints + np.array([top, left], dtype='float64')
+
+
+def resize(keypoints, old_size, new_size):
+    return keypoints * np.array([new_size[0] / float(old_size[0]), new_size[1] / float(old_size[1])])
+
+
+def flip(keypoints, width):
+    """
+        Keypoints of img[:, ::-1], x' = width - 1 - x. Left and right joints are swapped, so the right
+        shoulder is still the right shoulder of the mirrored person. width is a number or one per row.
+    """
+    width = np.asarray(width, dtype='float64').reshape((-1, 1))
+    result = keypoints[:, FLIP_ORDER].copy()
+    result[..., 1] = width - 1 - result[..., 1]
+    return result
+
+
+def flip_name(name):
+    return name.replace('.jpg', 'r.jpg')
+
+
+def remove_outside(keypoints, size):
+    """
+        Mark keypoints outside of an image of size (h, w) as missing.
+    """
+    with np.errstate(invalid='ignore'):
+        outside = np.any((keypoints < 0) | (keypoints >= np.array(size)), axis=-1, keepdims=True)
+    return np.where(outside, np.nan, keypoints)
+
+
+def apply_operations(names, keypoints, operations):
+    """
+        Apply operations given as strings 'crop:top,left', 'pad:top,left', 'resize:h,w,new_h,new_w',
+        'flip:width' and 'inside:h,w' in order. Returns float keypoints, nan if missing.
+    """
+    keypoints = to_float(keypoints)
+    for operation in operations:
+        op, _, params = operation.partition(':')
+        params = [float(p) for p in params.split(',')] if params else []
+        if op == 'crop':
+            keypoints = crop(keypoints, *params)
+        elif op == 'pad':
+            keypoints = pad(keypoints, *params)
+        elif op == 'resize':
+            keypoints = resize(keypoints, params[:2], params[2:])
+        elif op == 'flip':
+            keypoints = flip(keypoints, params[0])
+            names = np.array([flip_name(name) for name in names])
+        elif op == 'inside':
+            keypoints = remove_outside(keypoints, params)
+        else:
+            assert False, "Unknown operation %s" % op
+    return names, keypoints
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transform keypoint annotations of flipped, cropped, "
+                                                 "resized or padded images")
+    parser.add_argument("--annotations_file", required=True, help="Input annotation file")
+    parser.add_argument("--output_file", required=True, help="Output annotation file")
+    parser.add_argument("operations", nargs='+',
+                        help="Operations in order: crop:top,left pad:top,left resize:h,w,new_h,new_w "
+                             "flip:width inside:h,w")
+    args = parser.parse_args()
+
+    names, keypoints = load_annotations(args.annotations_file)
+    names, keypoints = apply_operations(names, keypoints, args.operations)
+    save_annotations(args.output_file, names, keypoints)
+    print ("Saved %s annotations to %s" % (len(names), args.output_file))
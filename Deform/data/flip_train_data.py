@@ -1,11 +1,25 @@
 from skimage.io import imread, imsave
 import os
 import sys
+import numpy as np
+from annotation_transforms import load_annotations, save_annotations, to_float, flip, flip_name
 
 dataset = 'market' if len(sys.argv) == 1 else sys.argv[1]
 
 dir = dataset + "-dataset/train"
+annotations_file = dataset + "-annotation-train.csv"
+widths = {}
 for img_name in os.listdir(dir):
     img = imread(os.path.join(dir, img_name))
+    widths[img_name] = img.shape[1]
     img = img[:, ::-1]
     imsave(os.path.join(dir, img_name.replace('.jpg', 'r.jpg')), img)
+
+## keypoints of the flipped images are derived from the annotations instead of estimated again
+if os.path.exists(annotations_file):
+    names, keypoints = load_annotations(annotations_file)
+    annotated = set(names)
+    index = [i for i, name in enumerate(names) if name in widths and flip_name(name) not in annotated]
+    flipped = flip(to_float(keypoints[index]), [widths[names[i]] for i in index])
+    save_annotations(annotations_file, np.concatenate([names, [flip_name(names[i]) for i in index]]),
+                     np.concatenate([to_float(keypoints), flipped]))
@@ -2,8 +2,7 @@ from skimage.io import imread, imsave
 from skimage.transform import resize
 import os
 import numpy as np
-import pandas as pd
-import json
+from annotation_transforms import load_annotations, save_annotations, to_float, crop, resize as resize_keypoints
 
 def resize_dataset(folder, new_folder, new_size = (128, 88), crop_bord=40):
     if not os.path.exists(new_folder):
@@ -20,22 +19,10 @@ def resize_dataset(folder, new_folder, new_size = (128, 88), crop_bord=40):
         imsave(new_name, img)
 
 def resize_annotations(name, new_name, new_size = (128, 88), old_size = (256, 256), crop_bord=40):
-    df = pd.read_csv(name, sep=':')
-
-    ratio_y = new_size[0] / float(old_size[0])
-    ratio_x = new_size[1] / float(old_size[1] - 2 * crop_bord)
-
-    def modify(values, ratio, crop):
-        val = np.array(json.loads(values))
-        mask = val == -1
-        val = ((val - crop) * ratio).astype(int)
-        val[mask] = -1
-        return str(list(val))
-
-    df['keypoints_y'] = df.apply(lambda row: modify(row['keypoints_y'], ratio_y, 0), axis=1)
-    df['keypoints_x'] = df.apply(lambda row: modify(row['keypoints_x'], ratio_x, crop_bord), axis=1)
-
-    df.to_csv(new_name, sep=':', index=False)
+    names, keypoints = load_annotations(name)
+    keypoints = crop(to_float(keypoints), 0, crop_bord)
+    keypoints = resize_keypoints(keypoints, (old_size[0], old_size[1] - 2 * crop_bord), new_size)
+    save_annotations(new_name, names, keypoints)
 
 resize_dataset('fasion-dataset/test', 'fasion128-dataset/test')
 resize_annotations('fasion-annotation-test.csv', 'fasion128-annotation-test.csv')
@@ -0,0 +1,130 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+from skimage.measure import compare_ssim
+
+import pose_utils
+from pose_utils import MISSING_VALUE
+
+
+def l1_scores(generated_images, reference_images):
+    score_list = []
+    for reference_image, generated_image in zip(reference_images, generated_images):
+        score = np.abs(2 * (reference_image/255.0 - 0.5) - 2 * (generated_image/255.0 - 0.5)).mean()
+        score_list.append(score)
+    return np.array(score_list)
+
+
+def ssim_scores(generated_images, reference_images):
+    ssim_score_list = []
+    for reference_image, generated_image in zip(reference_images, generated_images):
+        ssim = compare_ssim(reference_image, generated_image, gaussian_weights=True, sigma=1.5,
+                            use_sample_covariance=False, multichannel=True,
+                            data_range=generated_image.max() - generated_image.min())
+        ssim_score_list.append(ssim)
+    return np.array(ssim_score_list)
+
+
+def load_keypoints(names, annotations):
+    """
+        Keypoints of the given images as (N, 18, 2) int array. annotations is an annotation dataframe
+        (or annotation csv file) as in DATA/*-annotation-*.csv.
+    """
+    if not isinstance(annotations, pd.DataFrame):
+        annotations = pd.read_csv(annotations, sep=':')
+    if annotations.index.name != 'name':
+        annotations = annotations.set_index('name')
+    rows = annotations.loc[list(names)]
+    return np.array([pose_utils.load_pose_cords_from_strings(y, x)
+                     for y, x in zip(rows['keypoints_y'], rows['keypoints_x'])]).reshape((-1, 18, 2))
+
+
+def pose_statistics(names, annotations):
+    """
+        Pose statistics of (from, to) pairs: number of visible joints in each pose, number of joints
+        visible in both and the mean distance in pixels between the jointly visible joints.
+    """
+    names = np.array(names)
+    kp_from = load_keypoints(names[:, 0], annotations)
+    kp_to = load_keypoints(names[:, 1], annotations)
+
+    visible_from = np.all(kp_from != MISSING_VALUE, axis=-1)
+    visible_to = np.all(kp_to != MISSING_VALUE, axis=-1)
+    visible_common = np.logical_and(visible_from, visible_to)
+
+    distance = np.sqrt(np.sum((kp_from - kp_to).astype('float32') ** 2, axis=-1))
+    common_count = visible_common.sum(axis=-1)
+    pose_distance = np.where(common_count > 0,
+                             np.sum(distance * visible_common, axis=-1) / np.maximum(common_count, 1), np.nan)
+
+    return {'visible_from': visible_from.sum(axis=-1),
+            'visible_to': visible_to.sum(axis=-1),
+            'visible_common': common_count,
+            'pose_distance': pose_distance}
+
+
+def save_per_sample(file_name, names, **columns):
+    """
+        Save per pair values in columnar form. Parquet is used for *.parquet files, npz otherwise.
+    """
+    names = np.array(names)
+    table = pd.DataFrame({'from': names[:, 0], 'to': names[:, 1]})
+    for key, value in columns.items():
+        table[key] = np.asarray(value)
+
+    if file_name.endswith('.parquet'):
+        table.to_parquet(file_name, index=False)
+    else:
+        np.savez(file_name, **dict((key, table[key].values.astype(str) if table[key].dtype == object
+                                    else table[key].values) for key in table.columns))
+    return table
+
+
+def load_per_sample(file_name):
+    if file_name.endswith('.parquet'):
+        return pd.read_parquet(file_name)
+    data = np.load(file_name)
+    return pd.DataFrame(dict((key, data[key]) for key in data.files))
+
+
+def bucket_report(table, metric, bucket_column, number_of_buckets=4):
+    values = table[bucket_column]
+    if values.nunique() > number_of_buckets:
+        buckets = pd.qcut(values, number_of_buckets, duplicates='drop')
+    else:
+        buckets = values
+    return table.groupby(buckets)[metric].agg(['count', 'mean', 'std'])
+
+
+def report(table, metric='ssim', worst=20, higher_is_better=True, number_of_buckets=4):
+    table = table.dropna(subset=[metric])
+    worst_pairs = table.sort_values(metric, ascending=higher_is_better).head(worst)
+    print ("Mean %s over %s pairs: %s" % (metric, len(table), table[metric].mean()))
+    print ("Worst %s pairs by %s:" % (worst, metric))
+    print (worst_pairs.to_string(index=False))
+
+    for bucket_column in ['visible_to', 'visible_common', 'pose_distance']:
+        if bucket_column in table:
+            print ("Average %s per %s bucket:" % (metric, bucket_column))
+            print (bucket_report(table, metric, bucket_column, number_of_buckets).to_string())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report on per pair metrics saved by test.py or PG2/score.py")
+    parser.add_argument("--per_sample_file", required=True, help="File with per pair metrics (.npz or .parquet)")
+    parser.add_argument("--annotations_file", default=None,
+                        help="Annotation file used to add pose statistics if they are not in per_sample_file")
+    parser.add_argument("--metric", default='ssim', help="Metric to rank pairs with")
+    parser.add_argument("--lower_is_better", default=0, type=int, help="Worst pairs have the highest metric value")
+    parser.add_argument("--worst", default=20, type=int, help="Number of worst pairs to list")
+    parser.add_argument("--number_of_buckets", default=4, type=int, help="Number of buckets for continuous columns")
+    args = parser.parse_args()
+
+    table = load_per_sample(args.per_sample_file)
+    if 'pose_distance' not in table and args.annotations_file is not None:
+        stats = pose_statistics(table[['from', 'to']].values, args.annotations_file)
+        for key, value in stats.items():
+            table[key] = value
+
+    report(table, args.metric, args.worst, not args.lower_is_better, args.number_of_buckets)
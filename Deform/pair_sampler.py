@@ -0,0 +1,106 @@
+"""
+    Random pairs of images of the same person drawn for every epoch, instead of a file with all ordered pairs.
+    Only the images grouped by person are kept, an epoch costs O(images) time and memory.
+"""
+import numpy as np
+import pandas as pd
+
+from pose_utils import MISSING_VALUE
+
+
+def person_of(name):
+    """
+        Person of an image name, the 12 characters from 'id' for DeepFashion and the prefix before the first '_'
+        for Market-1501.
+    """
+    if 'id' in name:
+        return name[name.find('id'):(name.find('id')+12)]
+    return name.split('_')[0]
+
+
+def pose_distance(keypoints_from, keypoints_to):
+    """
+        Mean distance in pixels of the joints visible in both poses (float keypoints, nan if missing),
+        inf if no joint is visible in both.
+    """
+    distance = np.sqrt(np.sum((keypoints_from - keypoints_to) ** 2, axis=-1))
+    common = ~np.isnan(distance)
+    total = np.sum(np.where(common, distance, 0), axis=-1)
+    count = np.sum(common, axis=-1)
+    return np.where(count > 0, total / np.maximum(count, 1), np.inf)
+
+
+class PairSampler(object):
+    """
+        Draws the (from, to) pairs of an epoch. Every image of a person with at least two images is the 'from'
+        image of exactly one pair per epoch. The 'to' images are a random cyclic shift inside every shuffled
+        person, so without pose filtering every image is also the 'to' image of exactly one pair. With keypoints
+        ([y, x], -1 if missing), pairs whose pose distance is outside [min_pose_distance, max_pose_distance]
+        are redrawn up to max_rounds times and dropped if no pair is found.
+    """
+    def __init__(self, names, keypoints=None, min_pose_distance=0, max_pose_distance=0, random_state=0,
+                 max_rounds=10):
+        self.names = np.asarray(names)
+        codes, _ = pd.factorize(np.array([person_of(name) for name in self.names], dtype=object))
+        counts = np.bincount(codes, minlength=1)
+
+        ## images sorted by person, the images of person c are self._order[start[c]:start[c] + counts[c]]
+        self._codes = codes
+        self._counts = counts
+        self._start = np.cumsum(counts) - counts
+        self._order = np.argsort(codes, kind='mergesort')
+        self._rank = np.empty(len(codes), dtype=int)
+        self._rank[self._order] = np.arange(len(codes)) - self._start[codes[self._order]]
+
+        self._keypoints = None
+        if keypoints is not None and (min_pose_distance or max_pose_distance):
+            keypoints = np.asarray(keypoints, dtype='float64')
+            missing = np.any(keypoints == MISSING_VALUE, axis=-1, keepdims=True)
+            self._keypoints = np.where(missing, np.nan, keypoints)
+        self._min_pose_distance = min_pose_distance
+        self._max_pose_distance = max_pose_distance if max_pose_distance else np.inf
+        self._max_rounds = max_rounds
+        self._rng = np.random.RandomState(random_state)
+
+    def __len__(self):
+        """
+            Number of pairs of an epoch without pose filtering.
+        """
+        return int(np.sum(self._counts[self._counts >= 2]))
+
+    def _accepted(self, fr, to):
+        if self._keypoints is None:
+            return np.ones(len(fr), dtype=bool)
+        distance = pose_distance(self._keypoints[fr], self._keypoints[to])
+        return (distance >= self._min_pose_distance) & (distance <= self._max_pose_distance)
+
+    def _random_partner(self, fr):
+        n = self._counts[self._codes[fr]]
+        offset = self._rng.randint(0, n - 1)
+        offset += offset >= self._rank[fr]
+        return self._order[self._start[self._codes[fr]] + offset]
+
+    def epoch(self):
+        """
+            (P, 2) int array of the (from, to) indices into names of a new epoch, in random order.
+        """
+        codes = self._codes[self._order]
+        shuffled = self._order[np.lexsort((self._rng.random_sample(len(codes)), codes))]
+        n = self._counts[codes]
+        position = np.arange(len(codes)) - self._start[codes]
+        shift = self._rng.randint(1, np.maximum(self._counts, 2))[codes]
+
+        keep = n >= 2
+        fr = shuffled[keep]
+        to = shuffled[(self._start[codes] + (position + shift) % n)[keep]]
+
+        accepted = self._accepted(fr, to)
+        for _ in range(self._max_rounds):
+            if np.all(accepted):
+                break
+            redraw = np.flatnonzero(~accepted)
+            to[redraw] = self._random_partner(fr[redraw])
+            accepted[redraw] = self._accepted(fr[redraw], to[redraw])
+
+        pairs = np.stack([fr[accepted], to[accepted]], axis=1)
+        return pairs[self._rng.permutation(len(pairs))]
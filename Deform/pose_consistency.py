@@ -0,0 +1,100 @@
+import numpy as np
+
+import cmd
+from pose_utils import LABELS, MISSING_VALUE
+from pair_metrics import load_keypoints, save_per_sample
+
+## COCO keypoint sigmas in the order of pose_utils.LABELS, neck has the sigma of the shoulders
+OKS_SIGMAS = np.array([.026, .079, .079, .072, .062, .079, .072, .062, .107, .087, .089,
+                       .107, .087, .089, .025, .025, .035, .035])
+
+
+def head_size(kp):
+    """
+        Distance between nose and neck, nan if one of them is missing.
+    """
+    visible = np.all(kp[:, :2] != MISSING_VALUE, axis=-1).all(axis=-1)
+    size = np.sqrt(np.sum((kp[:, 0] - kp[:, 1]).astype('float32') ** 2, axis=-1))
+    return np.where(visible, size, np.nan)
+
+
+def pckh(predicted, target, alpha=0.5):
+    """
+        Per image and joint PCKh: predicted joint is within alpha * head size of the target joint.
+        nan where the target joint (or the head) is missing, 0 where only the predicted joint is missing.
+    """
+    visible_target = np.all(target != MISSING_VALUE, axis=-1)
+    visible_predicted = np.all(predicted != MISSING_VALUE, axis=-1)
+    distance = np.sqrt(np.sum((predicted - target).astype('float32') ** 2, axis=-1))
+
+    correct = (distance <= alpha * head_size(target)[:, np.newaxis]) & visible_predicted
+    result = correct.astype('float32')
+    result[~visible_target] = np.nan
+    result[np.isnan(head_size(target))] = np.nan
+    return result
+
+
+def oks(predicted, target):
+    """
+        Per image and joint keypoint similarity of COCO OKS, with the area of the bounding box of the visible
+        target keypoints as object scale. nan where the target joint is missing.
+    """
+    visible_target = np.all(target != MISSING_VALUE, axis=-1)
+    visible_predicted = np.all(predicted != MISSING_VALUE, axis=-1)
+    distance2 = np.sum((predicted - target).astype('float32') ** 2, axis=-1)
+
+    target_float = np.where(visible_target[..., np.newaxis], target, np.nan).astype('float32')
+    extent = np.nanmax(target_float, axis=1) - np.nanmin(target_float, axis=1)
+    area = np.maximum(extent[:, 0] * extent[:, 1], 1)
+
+    k2 = (2 * OKS_SIGMAS) ** 2
+    result = np.exp(-distance2 / (2 * area[:, np.newaxis] * k2[np.newaxis])) * visible_predicted
+    result[~visible_target] = np.nan
+    return result
+
+
+def report(pckh_values, oks_values):
+    print ("%-6s %8s %8s" % ('joint', 'PCKh', 'OKS'))
+    for i, label in enumerate(LABELS):
+        print ("%-6s %8.4f %8.4f" % (label, np.nanmean(pckh_values[:, i]), np.nanmean(oks_values[:, i])))
+    print ("%-6s %8.4f %8.4f" % ('all', np.nanmean(pckh_values), np.nanmean(oks_values)))
+
+
+def pose_consistency(generated_images_dir, annotations_file, pose_estimator, batch_size=4):
+    """
+        Per pair and joint PCKh and OKS of the keypoints re-estimated on the images in generated_images_dir
+        against the target keypoints in annotations_file. pose_estimator is a model file or 'stub'.
+        Returns the names of the pairs and (N, 18) PCKh and OKS arrays.
+    """
+    from test import load_generated_images
+    from compute_coordinates import load_estimator, build_stub_estimator, estimate_poses
+
+    print ("Loading images...")
+    _, _, generated_images, names = load_generated_images(generated_images_dir)
+
+    if pose_estimator == 'stub':
+        model = build_stub_estimator()
+    else:
+        model = load_estimator(pose_estimator)
+
+    print ("Estimate poses of generated images...")
+    predicted = estimate_poses(model, generated_images, batch_size=batch_size)
+    target = load_keypoints([name[1] for name in names], annotations_file)
+
+    return names, pckh(predicted, target), oks(predicted, target)
+
+
+def main():
+    args = cmd.args()
+    names, pckh_values, oks_values = pose_consistency(args.generated_images_dir, args.annotations_file_test,
+                                                      args.pose_estimator, args.batch_size)
+    report(pckh_values, oks_values)
+
+    if args.per_sample_file:
+        print ("Save per pair metrics to %s..." % args.per_sample_file)
+        save_per_sample(args.per_sample_file, names, pckh=np.nanmean(pckh_values, axis=1),
+                        oks=np.nanmean(oks_values, axis=1))
+
+
+if __name__ == "__main__":
+    main()
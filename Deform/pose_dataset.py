@@ -10,6 +10,9 @@ import pose_transform
 from skimage.io import imread
 import pandas as pd
 import os
+from pair_table import load_pair_index
+from pair_sampler import PairSampler
+import annotation_filters
 
 class PoseHMDataset(UGANDataset):
     def __init__(self, test_phase=False, **kwargs):
@@ -21,9 +24,6 @@ class PoseHMDataset(UGANDataset):
         self._images_dir_train = kwargs['images_dir_train']
         self._images_dir_test = kwargs['images_dir_test']
 
-        self._pairs_file_train = pd.read_csv(kwargs['pairs_file_train'])
-        self._pairs_file_test = pd.read_csv(kwargs['pairs_file_test'])
-
         self._annotations_file_test = pd.read_csv(kwargs['annotations_file_train'], sep=':')
         self._annotations_file_train = pd.read_csv(kwargs['annotations_file_test'], sep=':')
 
@@ -31,6 +31,22 @@ class PoseHMDataset(UGANDataset):
                                            axis=0, ignore_index=True)
 
         self._annotations_file = self._annotations_file.set_index('name')
+        ## names and keypoints of the annotation rows, pairs are arrays of rows
+        self._names = np.asarray(self._annotations_file.index, dtype=str)
+        self._keypoints = annotation_filters.parse_keypoints(self._annotations_file)
+
+        ## pairs index into a manifest, _*_rows maps the manifest to annotation rows once
+        self._pair_sampler = None
+        if not self._test_phase and kwargs.get('pair_sampling', 'file') == 'online':
+            self._pair_sampler = self._create_pair_sampler(**kwargs)
+            self._train_rows = self._annotation_rows(self._pair_sampler.names)
+            self._pairs_train = self._pair_sampler.epoch()
+        else:
+            manifest, self._pairs_train = load_pair_index(kwargs['pairs_file_train'])
+            self._train_rows = self._annotation_rows(manifest)
+        manifest, self._pairs_test = load_pair_index(kwargs['pairs_file_test'])
+        self._test_rows = self._annotation_rows(manifest)
+        self._train_order = np.arange(len(self._pairs_train))
 
         self._use_input_pose = kwargs['use_input_pose']
         self._warp_skip = kwargs['warp_skip']
@@ -43,54 +59,63 @@ class PoseHMDataset(UGANDataset):
             os.makedirs(self._tmp_pose)
 
         print ("Number of images: %s" % len(self._annotations_file))
-        print ("Number of pairs train: %s" % len(self._pairs_file_train))
-        print ("Number of pairs test: %s" % len(self._pairs_file_test))
+        print ("Number of pairs train: %s" % len(self._pairs_train))
+        print ("Number of pairs test: %s" % len(self._pairs_test))
+
+        self._batches_before_shuffle = int(self._pairs_train.shape[0] // self._batch_size)
+
+    def _annotation_rows(self, names):
+        rows = pd.Index(self._names).get_indexer(np.asarray(names).astype(str))
+        assert np.all(rows >= 0), "Images of the pairs are missing in the annotations"
+        return rows
 
-        self._batches_before_shuffle = int(self._pairs_file_train.shape[0] // self._batch_size)
+    def _create_pair_sampler(self, **kwargs):
+        ## _annotations_file_test holds the annotations of annotations_file_train
+        names = self._annotations_file_test['name'].values
+        keypoints = annotation_filters.parse_keypoints(self._annotations_file_test)
+        rules = annotation_filters.parse_rules(kwargs.get('validity_rules', annotation_filters.DEFAULT_RULES))
+        valid, _ = annotation_filters.apply_rules(names, keypoints, rules)
+        return PairSampler(names[valid], keypoints[valid], kwargs['min_pair_pose_distance'],
+                           kwargs['max_pair_pose_distance'])
 
     def number_of_batches_per_epoch(self):
         return 1000
 
     def number_of_batches_per_validation(self):
-        return len(self._pairs_file_test) // self._batch_size
+        return len(self._pairs_test) // self._batch_size
 
-    def compute_pose_map_batch(self, pair_df, direction):
-        assert direction in ['to', 'from']
+    def test_pair_names(self, index=slice(None)):
+        """
+            (P, 2) array of the (from, to) names of test pairs.
+        """
+        return self._names[self._test_rows[self._pairs_test[index]]]
+
+    def compute_pose_map_batch(self, rows):
         batch = np.empty([self._batch_size] + list(self._image_size) + [18])
-        i = 0
-        for _, p in pair_df.iterrows():
-            row = self._annotations_file.loc[p[direction]]
-            file_name = self._tmp_pose + p[direction] + '.npy'
+        for i, row in enumerate(rows):
+            file_name = self._tmp_pose + self._names[row] + '.npy'
             if os.path.exists(file_name):
                 pose = np.load(file_name)
             else:
-                kp_array = pose_utils.load_pose_cords_from_strings(row['keypoints_y'], row['keypoints_x'])
-                pose = pose_utils.cords_to_map(kp_array, self._image_size)
+                pose = pose_utils.cords_to_map(self._keypoints[row], self._image_size)
                 np.save(file_name, pose)
             batch[i] = pose
-            i += 1
         return batch
 
-    def compute_cord_warp_batch(self, pair_df):
+    def compute_cord_warp_batch(self, rows_from, rows_to):
         if self._warp_skip == 'full':
             batch = [np.empty([self._batch_size] + [1, 8])]
         else:
             batch = [np.empty([self._batch_size] + [10, 8]),
                      np.empty([self._batch_size, 10] + list(self._image_size))]
-        i = 0
-        for _, p in pair_df.iterrows():
-            fr = self._annotations_file.loc[p['from']]
-            to = self._annotations_file.loc[p['to']]
-            kp_array1 = pose_utils.load_pose_cords_from_strings(fr['keypoints_y'],
-                                                                fr['keypoints_x'])
-            kp_array2 = pose_utils.load_pose_cords_from_strings(to['keypoints_y'],
-                                                                to['keypoints_x'])
+        for i, (row_from, row_to) in enumerate(zip(rows_from, rows_to)):
+            kp_array1 = self._keypoints[row_from]
+            kp_array2 = self._keypoints[row_to]
             if self._warp_skip == 'mask':
                 batch[0][i] = pose_transform.affine_transforms(kp_array1, kp_array2)
                 batch[1][i] = pose_transform.pose_masks(kp_array2, self._image_size)
             else:
                 batch[0][i] = pose_transform.estimate_uniform_transform(kp_array1, kp_array2)
-            i += 1
         return batch
 
     def _preprocess_image(self, image):
@@ -99,31 +124,29 @@ class PoseHMDataset(UGANDataset):
     def _deprocess_image(self, image):
         return (255 * (image + 1) / 2).astype('uint8')
 
-    def load_image_batch(self, pair_df, direction='from'):
-        assert direction in ['to', 'from']
+    def load_image_batch(self, rows):
         batch = np.empty([self._batch_size] + list(self._image_size) + [3])
-        i = 0
-        for _, p in pair_df.iterrows():
-            if os.path.exists(os.path.join(self._images_dir_train, p[direction])):
-                batch[i] = imread(os.path.join(self._images_dir_train, p[direction]))
+        for i, row in enumerate(rows):
+            name = self._names[row]
+            if os.path.exists(os.path.join(self._images_dir_train, name)):
+                batch[i] = imread(os.path.join(self._images_dir_train, name))
             else:
-                batch[i] = imread(os.path.join(self._images_dir_test, p[direction]))
-            i += 1
+                batch[i] = imread(os.path.join(self._images_dir_test, name))
         return self._preprocess_image(batch)
 
     def load_batch(self, index, for_discriminator, validation=False):
         if validation:
-            pair_df = self._pairs_file_test.iloc[index]
+            rows = self._test_rows[self._pairs_test[index]]
         else:
-            pair_df = self._pairs_file_train.iloc[index]
-        result = [self.load_image_batch(pair_df, 'from')]
+            rows = self._train_rows[self._pairs_train[self._train_order[index]]]
+        result = [self.load_image_batch(rows[:, 0])]
         if self._use_input_pose:
-            result.append(self.compute_pose_map_batch(pair_df, 'from'))
-        result.append(self.load_image_batch(pair_df, 'to'))
-        result.append(self.compute_pose_map_batch(pair_df, 'to'))
+            result.append(self.compute_pose_map_batch(rows[:, 0]))
+        result.append(self.load_image_batch(rows[:, 1]))
+        result.append(self.compute_pose_map_batch(rows[:, 1]))
 
         if self._warp_skip != 'none' and (not for_discriminator or self._disc_type == 'warp'):
-            result += self.compute_cord_warp_batch(pair_df)
+            result += self.compute_cord_warp_batch(rows[:, 0], rows[:, 1])
         return result
 
     def next_generator_sample(self):
@@ -132,9 +155,9 @@ class PoseHMDataset(UGANDataset):
 
     def next_generator_sample_test(self, with_names=False):
         index = np.arange(self._test_data_index, self._test_data_index + self._batch_size)
-        index = index % self._pairs_file_test.shape[0]
+        index = index % self._pairs_test.shape[0]
         batch = self.load_batch(index, False, True)
-        names = self._pairs_file_test.iloc[index]
+        names = self.test_pair_names(index)
         self._test_data_index += self._batch_size
         if with_names:
             return batch, names
@@ -146,8 +169,13 @@ class PoseHMDataset(UGANDataset):
         return self.load_batch(index, True)
 
     def _shuffle_data(self):
-        self._pairs_file_train = self._pairs_file_train.sample(frac=1)
-        
+        if self._pair_sampler is not None:
+            self._pairs_train = self._pair_sampler.epoch()
+            self._train_order = np.arange(len(self._pairs_train))
+            self._batches_before_shuffle = int(self._pairs_train.shape[0] // self._batch_size)
+        else:
+            self._train_order = np.random.permutation(len(self._pairs_train))
+
     def display(self, output_batch, input_batch):
         row = self._batch_size
         col = 1
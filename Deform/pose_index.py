@@ -0,0 +1,145 @@
+"""
+    Nearest neighbour index of poses. A pose is described by its visible joints centered on their mean and divided
+    by their root mean square distance to it, missing joints are 0 and add missing_weight to the visibility
+    coordinates, so poses with different visible joints are far apart. Queries are batched k-NN and radius
+    searches in a scipy cKDTree.
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from annotation_filters import parse_keypoints, visible
+
+
+def pose_descriptors(keypoints, missing_weight=1.0):
+    """
+        (N, 54) descriptors of (N, 18, 2) keypoints ([y, x], -1 if missing): 36 normalized coordinates and
+        18 visibility coordinates.
+    """
+    keypoints = np.asarray(keypoints, dtype='float64').reshape((-1, 18, 2))
+    mask = visible(keypoints)[..., np.newaxis]
+    count = np.maximum(mask.sum(axis=1), 1)
+
+    center = np.sum(np.where(mask, keypoints, 0), axis=1) / count
+    centered = np.where(mask, keypoints - center[:, np.newaxis], 0)
+    scale = np.sqrt(np.sum(centered ** 2, axis=(1, 2)) / count[:, 0])
+    scale[scale == 0] = 1
+
+    coordinates = (centered / scale[:, np.newaxis, np.newaxis]).reshape((len(keypoints), -1))
+    return np.concatenate([coordinates, missing_weight * mask[..., 0]], axis=1)
+
+
+class PoseIndex(object):
+    """
+        k-NN and radius queries over the poses of named images.
+    """
+    def __init__(self, names, descriptors, missing_weight=1.0):
+        self.names = np.asarray(names)
+        self.descriptors = np.asarray(descriptors, dtype='float64')
+        self.missing_weight = missing_weight
+        self.tree = cKDTree(self.descriptors)
+
+    @classmethod
+    def from_keypoints(cls, names, keypoints, missing_weight=1.0):
+        return cls(names, pose_descriptors(keypoints, missing_weight), missing_weight)
+
+    @classmethod
+    def from_annotations(cls, annotation_files, missing_weight=1.0):
+        df = pd.concat([pd.read_csv(f, sep=':') for f in annotation_files], axis=0, ignore_index=True)
+        return cls.from_keypoints(df['name'].values, parse_keypoints(df), missing_weight)
+
+    def save(self, file_name):
+        """
+            Saves names and descriptors, the tree is rebuilt on load.
+        """
+        np.savez(file_name, names=self.names.astype(str), descriptors=self.descriptors,
+                 missing_weight=self.missing_weight)
+
+    @classmethod
+    def load(cls, file_name):
+        data = np.load(file_name)
+        return cls(data['names'], data['descriptors'], float(data['missing_weight']))
+
+    def __len__(self):
+        return len(self.names)
+
+    def query(self, keypoints, k=1):
+        """
+            Distances and indices (N, k) of the k nearest poses of every pose in keypoints (N, 18, 2).
+        """
+        distances, indices = self.tree.query(pose_descriptors(keypoints, self.missing_weight), k=k)
+        return distances.reshape((-1, k)), indices.reshape((-1, k))
+
+    def query_names(self, names, k=1, exclude_self=True):
+        """
+            Distances and indices (N, k) of the k nearest poses of indexed images given by name.
+        """
+        index = pd.Index(self.names).get_indexer(names)
+        assert np.all(index >= 0), "Some names are not in the index"
+        distances, indices = self.tree.query(self.descriptors[index], k=k + int(exclude_self))
+        distances, indices = distances.reshape((len(index), -1)), indices.reshape((len(index), -1))
+        if not exclude_self:
+            return distances, indices
+
+        ## drop the image itself, or the farthest neighbour if a duplicate pose came first
+        not_self = indices != index[:, np.newaxis]
+        not_self[np.all(not_self, axis=1), -1] = False
+        return distances[not_self].reshape((-1, k)), indices[not_self].reshape((-1, k))
+
+    def query_radius(self, keypoints, radius):
+        """
+            List with an index array of the poses within radius of every pose in keypoints.
+        """
+        neighbours = self.tree.query_ball_point(pose_descriptors(keypoints, self.missing_weight), radius)
+        return [np.array(sorted(n), dtype=int) for n in neighbours]
+
+    def sample_dissimilar(self, keypoints, radius, random_state=0, max_rounds=100):
+        """
+            Index of a random pose farther than radius from every pose in keypoints, -1 if none is found.
+        """
+        rng = np.random.RandomState(random_state)
+        descriptors = pose_descriptors(keypoints, self.missing_weight)
+        result = np.full(len(descriptors), -1, dtype=int)
+        for _ in range(max_rounds):
+            todo = np.flatnonzero(result < 0)
+            if len(todo) == 0:
+                break
+            candidates = rng.randint(0, len(self.names), len(todo))
+            distance = np.sqrt(np.sum((self.descriptors[candidates] - descriptors[todo]) ** 2, axis=1))
+            found = distance > radius
+            result[todo[found]] = candidates[found]
+        return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and query a nearest neighbour index of poses")
+    parser.add_argument("--annotations_files", nargs='+', default=[], help="Annotation files to index")
+    parser.add_argument("--index_file", required=True, help="Index file, created from annotations_files if given")
+    parser.add_argument("--missing_weight", default=1.0, type=float,
+                        help="Weight of the visibility coordinates, the distance between poses differing "
+                             "in the visibility of one joint")
+    parser.add_argument("--query", nargs='*', default=[], help="Image names to print the nearest poses of")
+    parser.add_argument("--k", default=5, type=int, help="Number of neighbours")
+    parser.add_argument("--pairs_file", default=None,
+                        help="Write from,to pairs of every indexed image and its k nearest poses")
+    args = parser.parse_args()
+
+    if args.annotations_files:
+        index = PoseIndex.from_annotations(args.annotations_files, args.missing_weight)
+        index.save(args.index_file)
+        print ("Indexed %s poses" % len(index))
+    else:
+        index = PoseIndex.load(args.index_file)
+
+    if args.query:
+        distances, indices = index.query_names(args.query, args.k)
+        for name, distance, neighbours in zip(args.query, distances, indices):
+            print ("%s: %s" % (name, ', '.join('%s (%.3f)' % pair for pair in zip(index.names[neighbours], distance))))
+
+    if args.pairs_file is not None:
+        _, indices = index.query_names(index.names, args.k)
+        pd.DataFrame({'from': np.repeat(index.names, args.k), 'to': index.names[indices.reshape(-1)]},
+                     columns=['from', 'to']).to_csv(args.pairs_file, index=False)
+        print ("Saved %s pairs to %s" % (len(indices.reshape(-1)), args.pairs_file))
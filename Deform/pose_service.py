@@ -0,0 +1,204 @@
+import argparse
+import os
+import threading
+import time
+from io import BytesIO
+
+import numpy as np
+from skimage.io import imread
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+    from urllib.request import urlopen, Request
+    from queue import Queue, Empty
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+    from urllib2 import urlopen, Request
+    from Queue import Queue, Empty
+
+from compute_coordinates import load_estimator, build_stub_estimator, estimate_maps, compute_cordinates, annotation_line
+
+
+class Batcher(object):
+    """
+        Keeps the pose estimator loaded and runs queued images in batches. A batch is started as soon as
+        batch_size images are waiting or latency_budget seconds after its first image arrived.
+    """
+    def __init__(self, pose_estimator, batch_size=16, latency_budget=0.05, downscale=1):
+        self.pose_estimator = pose_estimator
+        self.batch_size = batch_size
+        self.latency_budget = latency_budget
+        self.downscale = downscale
+        self.queue = Queue()
+        self.ready = threading.Event()
+        self.load_error = None
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        self.ready.wait()
+        if self.load_error is not None:
+            raise self.load_error
+
+    def run(self):
+        ## the model is created in the thread that uses it, tf graphs are per thread
+        try:
+            if self.pose_estimator == 'stub':
+                model = build_stub_estimator()
+            else:
+                model = load_estimator(self.pose_estimator)
+        except Exception as e:
+            self.load_error = e
+            return
+        finally:
+            self.ready.set()
+
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.latency_budget
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.time(), 0)))
+                except Empty:
+                    break
+
+            try:
+                heatmap_avg, paf_avg = estimate_maps(model, [image[:, :, ::-1] for image, _ in batch], self.downscale)
+                for (_, request), heatmap, paf in zip(batch, heatmap_avg, paf_avg):
+                    request['pose_cords'] = compute_cordinates(heatmap, paf, downscale=self.downscale)
+                    request['done'].set()
+            except Exception as e:
+                for _, request in batch:
+                    request['error'] = e
+                    request['done'].set()
+
+    def estimate(self, image):
+        """
+            Keypoints ([y, x], -1 if missing) of an R,G,B image, blocks until its batch is processed.
+        """
+        request = {'done': threading.Event()}
+        self.queue.put((image, request))
+        request['done'].wait()
+        if 'error' in request:
+            raise request['error']
+        return request['pose_cords']
+
+
+def to_rgb(image):
+    if image.ndim == 2:
+        image = np.stack([image] * 3, axis=-1)
+    return image[:, :, :3]
+
+
+def estimate_files(batcher, paths):
+    """
+        Keypoints of a list of image files. batch_size threads read and queue the images, so they are batched
+        together and at most batch_size decoded images are waiting. Raises an error naming every failed path.
+    """
+    results = [None] * len(paths)
+    errors = []
+    indices = Queue()
+    for i in range(len(paths)):
+        indices.put(i)
+
+    def worker():
+        while True:
+            try:
+                i = indices.get_nowait()
+            except Empty:
+                return
+            try:
+                results[i] = batcher.estimate(to_rgb(imread(paths[i])))
+            except Exception as e:
+                errors.append((i, '%s: %s' % (paths[i], e)))
+
+    threads = [threading.Thread(target=worker) for _ in range(min(batcher.batch_size, len(paths)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        messages = [message for _, message in sorted(errors)]
+        raise ValueError("Failed to annotate %s images:\n%s" % (len(messages), '\n'.join(messages)))
+    return results
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_handler(batcher):
+    class Handler(BaseHTTPRequestHandler):
+        """
+            POST /annotate?name=<image name> with the encoded image as body, or POST /annotate_files with one
+            image path per line. Responds with name:keypoints_y:keypoints_x lines as in the annotation files.
+        """
+        def reply(self, code, text):
+            body = text.encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if urlparse(self.path).path == '/health':
+                self.reply(200, 'ok\n')
+            else:
+                self.reply(404, 'unknown path\n')
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                if url.path == '/annotate':
+                    name = parse_qs(url.query).get('name', ['image'])[0]
+                    pose_cords = batcher.estimate(to_rgb(imread(BytesIO(body))))
+                    self.reply(200, annotation_line(name, pose_cords) + '\n')
+                elif url.path == '/annotate_files':
+                    paths = [path for path in body.decode('utf-8').splitlines() if path]
+                    results = estimate_files(batcher, paths)
+                    self.reply(200, ''.join(annotation_line(os.path.basename(path), pose_cords) + '\n'
+                                            for path, pose_cords in zip(paths, results)))
+                else:
+                    self.reply(404, 'unknown path\n')
+            except Exception as e:
+                self.reply(500, '%s\n' % e)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def annotate_files(paths, url='http://127.0.0.1:8008'):
+    """
+        Annotation lines of image files from a running service.
+    """
+    data = '\n'.join(os.path.abspath(path) for path in paths).encode('utf-8')
+    response = urlopen(Request(url + '/annotate_files', data=data))
+    return response.read().decode('utf-8').splitlines()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local keypoint estimation service")
+    parser.add_argument("--pose_estimator", default='pose_estimator.h5',
+                        help="Pretrained model for cao pose estimator, stub for a tiny random weight model")
+    parser.add_argument("--host", default='127.0.0.1', help="Address to listen on")
+    parser.add_argument("--port", default=8008, type=int, help="Port to listen on")
+    parser.add_argument("--batch_size", default=16, type=int, help="Maximal number of images in a batch")
+    parser.add_argument("--latency_budget", default=0.05, type=float,
+                        help="Seconds an image waits for other images before its batch is started")
+    parser.add_argument("--pose_map_downscale", default=1, type=int,
+                        help="Average heatmaps and PAFs at image size / pose_map_downscale")
+    args = parser.parse_args()
+
+    print ("Loading pose estimator...")
+    batcher = Batcher(args.pose_estimator, args.batch_size, args.latency_budget, args.pose_map_downscale)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(batcher))
+    print ("Serving on http://%s:%s" % (args.host, args.port))
+    server.serve_forever()
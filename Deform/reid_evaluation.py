@@ -0,0 +1,162 @@
+import argparse
+import os
+
+import numpy as np
+from skimage.io import imread
+from tqdm import tqdm
+
+
+def parse_market_name(name):
+    """
+        Person id and camera of Market-1501 image name, e.g. 0002_c1s1_000451_03.jpg -> (2, 1).
+        Junk images have id -1, distractors id 0.
+    """
+    parts = os.path.basename(name).split('_')
+    return int(parts[0]), int(parts[1][1])
+
+
+def load_image_list(folder):
+    names = sorted(name for name in os.listdir(folder) if name.endswith('.jpg'))
+    ids, cams = zip(*[parse_market_name(name) for name in names])
+    return names, np.array(ids), np.array(cams)
+
+
+def histogram_extractor(number_of_stripes=6, bins=8):
+    """
+        Baseline embedding without learned weights: RGB histograms of horizontal stripes.
+    """
+    def extract(images):
+        features = []
+        for image in images:
+            stripes = np.array_split(image, number_of_stripes, axis=0)
+            hist = [np.histogram(stripe[..., c], bins=bins, range=(0, 256))[0] for stripe in stripes for c in range(3)]
+            features.append(np.concatenate(hist).astype('float32') / (image.shape[0] * image.shape[1]))
+        return np.array(features)
+    return extract
+
+
+def keras_extractor(model_path, layer_name=None, batch_size=64):
+    """
+        Embedding from a keras model file, output of layer_name (or of the model). Images are scaled to [-1, 1]
+        and resized to the model input size.
+    """
+    from keras.models import load_model, Model
+    from skimage.transform import resize
+
+    model = load_model(model_path, compile=False)
+    if layer_name is not None:
+        model = Model(inputs=model.input, outputs=model.get_layer(layer_name).output)
+    input_size = model.input_shape[1:3]
+
+    def extract(images):
+        images = [image if image.shape[:2] == input_size else
+                  resize(image, input_size, preserve_range=True, mode='reflect') for image in images]
+        images = (np.array(images, dtype='float32') / 255 - 0.5) * 2
+        features = model.predict(images, batch_size=batch_size)
+        return features.reshape((features.shape[0], -1))
+    return extract
+
+
+def extract_features(extractor, folder, names, batch_size=256):
+    features = []
+    for start in tqdm(range(0, len(names), batch_size)):
+        images = [imread(os.path.join(folder, name)) for name in names[start:start + batch_size]]
+        features.append(extractor(images))
+    return np.concatenate(features, axis=0)
+
+
+def distance_block(query_features, gallery_features, gallery_norms, metric='euclidean'):
+    if metric == 'cosine':
+        return 1 - np.dot(query_features, gallery_features.T)
+    query_norms = np.sum(query_features ** 2, axis=1)[:, np.newaxis]
+    return query_norms + gallery_norms[np.newaxis] - 2 * np.dot(query_features, gallery_features.T)
+
+
+def rank_block(distances, query_ids, query_cams, gallery_ids, gallery_cams, max_rank):
+    """
+        CMC hits and average precision of a block of queries with the Market-1501 protocol: gallery images of the
+        same id from the same camera and junk images (id -1) are ignored.
+    """
+    order = np.argsort(distances, axis=1)
+    ranked_ids = gallery_ids[order]
+    ranked_cams = gallery_cams[order]
+
+    junk = ((ranked_ids == query_ids[:, np.newaxis]) & (ranked_cams == query_cams[:, np.newaxis])) | (ranked_ids == -1)
+    valid = ~junk
+    good = (ranked_ids == query_ids[:, np.newaxis]) & valid
+
+    ## rank of every gallery image after junk removal
+    rank = np.maximum(np.cumsum(valid, axis=1) - 1, 0)
+    number_of_good = good.sum(axis=1)
+    has_good = number_of_good > 0
+
+    first_good = np.where(has_good, np.argmax(good, axis=1), 0)
+    first_rank = rank[np.arange(len(rank)), first_good]
+    cmc = (first_rank[:, np.newaxis] <= np.arange(max_rank)[np.newaxis]) & has_good[:, np.newaxis]
+
+    ## ap as in the Market-1501 evaluation code: mean of precision before and at every good image
+    hit_number = np.cumsum(good, axis=1) - 1
+    precision = (hit_number + 1.0) / (rank + 1.0)
+    old_precision = np.where(rank == 0, 1.0, hit_number / np.maximum(rank, 1).astype('float64'))
+    ap = np.sum(np.where(good, (old_precision + precision) / 2, 0), axis=1) / np.maximum(number_of_good, 1)
+
+    return cmc[has_good], ap[has_good]
+
+
+def evaluate(query_features, query_ids, query_cams, gallery_features, gallery_ids, gallery_cams,
+             metric='euclidean', block_size=256, max_rank=50):
+    """
+        CMC curve and mAP. Distances are computed for block_size queries at a time, the full query x gallery
+        matrix is never stored.
+    """
+    query_features = np.asarray(query_features, dtype='float32')
+    gallery_features = np.asarray(gallery_features, dtype='float32')
+    if metric == 'cosine':
+        query_features = query_features / np.linalg.norm(query_features, axis=1, keepdims=True)
+        gallery_features = gallery_features / np.linalg.norm(gallery_features, axis=1, keepdims=True)
+    gallery_norms = np.sum(gallery_features ** 2, axis=1)
+    max_rank = min(max_rank, len(gallery_ids))
+
+    cmc_sum = np.zeros(max_rank)
+    ap_list = []
+    for start in range(0, len(query_ids), block_size):
+        end = start + block_size
+        distances = distance_block(query_features[start:end], gallery_features, gallery_norms, metric)
+        cmc, ap = rank_block(distances, query_ids[start:end], query_cams[start:end], gallery_ids, gallery_cams, max_rank)
+        cmc_sum += cmc.sum(axis=0)
+        ap_list.append(ap)
+
+    ap = np.concatenate(ap_list)
+    return cmc_sum / len(ap), np.mean(ap)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Market-1501 re-id evaluation (CMC, mAP)")
+    parser.add_argument("--query_dir", default='data/market-dataset/query', help="Folder with query images")
+    parser.add_argument("--gallery_dir", default='data/market-dataset/bounding_box_test', help="Folder with gallery images")
+    parser.add_argument("--extractor", default='keras', choices=['keras', 'histogram'], help="Embedding model")
+    parser.add_argument("--model_path", default=None, help="Keras model file for keras extractor")
+    parser.add_argument("--layer_name", default=None, help="Layer of keras model used as embedding")
+    parser.add_argument("--metric", default='euclidean', choices=['euclidean', 'cosine'], help="Distance")
+    parser.add_argument("--block_size", default=256, type=int, help="Number of queries per distance block")
+    parser.add_argument("--max_rank", default=50, type=int, help="Length of CMC curve")
+    args = parser.parse_args()
+
+    if args.extractor == 'keras':
+        assert args.model_path is not None, "keras extractor requires --model_path"
+        extractor = keras_extractor(args.model_path, args.layer_name)
+    else:
+        extractor = histogram_extractor()
+
+    query_names, query_ids, query_cams = load_image_list(args.query_dir)
+    gallery_names, gallery_ids, gallery_cams = load_image_list(args.gallery_dir)
+    print ("Number of queries %s, gallery size %s" % (len(query_names), len(gallery_names)))
+
+    print ("Extract features...")
+    query_features = extract_features(extractor, args.query_dir, query_names)
+    gallery_features = extract_features(extractor, args.gallery_dir, gallery_names)
+
+    print ("Compute CMC and mAP...")
+    cmc, mean_ap = evaluate(query_features, query_ids, query_cams, gallery_features, gallery_ids, gallery_cams,
+                            args.metric, args.block_size, args.max_rank)
+    print ("Rank-1 %s, Rank-5 %s, Rank-10 %s, mAP %s" % (cmc[0], cmc[min(4, len(cmc) - 1)], cmc[min(9, len(cmc) - 1)], mean_ap))
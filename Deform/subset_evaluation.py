@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+
+import cmd
+from pair_metrics import l1_scores, ssim_scores, pose_statistics, save_per_sample
+
+VISIBILITY_BINS = [0, 10, 14, 19]
+
+
+def pair_strata(names, annotations, number_of_pose_buckets=4, visibility_bins=VISIBILITY_BINS):
+    """
+        Stratum of every (from, to) pair: quantile bucket of the pose distance crossed with the bucket of the
+        number of jointly visible joints. Pairs without jointly visible joints get their own pose bucket.
+    """
+    stats = pose_statistics(names, annotations)
+    pose_bucket = pd.qcut(pd.Series(stats['pose_distance']), number_of_pose_buckets, labels=False, duplicates='drop')
+    pose_bucket = pose_bucket.fillna(-1).values.astype(int) + 1
+    visibility_bucket = np.digitize(stats['visible_common'], visibility_bins[1:-1])
+    return visibility_bucket * (number_of_pose_buckets + 1) + pose_bucket
+
+
+def stratified_subset(strata, subset_size, random_state=0):
+    """
+        Indices of a subset with proportional allocation over the strata, at least one pair per stratum.
+    """
+    rng = np.random.RandomState(random_state)
+    labels, counts = np.unique(strata, return_counts=True)
+    allocation = np.round(counts * float(subset_size) / len(strata)).astype(int)
+    allocation = np.minimum(np.maximum(allocation, 1), counts)
+    subset = []
+    for label, size in zip(labels, allocation):
+        members = np.where(strata == label)[0]
+        subset.append(rng.choice(members, size, replace=False))
+    return np.sort(np.concatenate(subset))
+
+
+def bootstrap(values, statistic=np.mean, strata=None, number_of_samples=1000, confidence=0.95, random_state=0):
+    """
+        Estimate and percentile bootstrap confidence interval of statistic(values). Resampling is done inside
+        of every stratum, so the stratum proportions of the subset are kept.
+    """
+    values = np.asarray(values)
+    rng = np.random.RandomState(random_state)
+    if strata is None:
+        strata = np.zeros(len(values), dtype=int)
+    groups = [np.where(strata == label)[0] for label in np.unique(strata)]
+
+    estimates = np.empty(number_of_samples)
+    for i in range(number_of_samples):
+        index = np.concatenate([group[rng.randint(0, len(group), len(group))] for group in groups])
+        estimates[i] = statistic(values[index])
+
+    alpha = 100 * (1 - confidence) / 2.0
+    low, high = np.percentile(estimates, [alpha, 100 - alpha])
+    return statistic(values), low, high
+
+
+def recommended_subset_size(subset_size, low, high, ci_width, population_size):
+    """
+        Subset size for a confidence interval of width ci_width, interval width shrinks as 1/sqrt(size).
+    """
+    size = int(np.ceil(subset_size * ((high - low) / float(ci_width)) ** 2))
+    return min(size, population_size)
+
+
+def evaluate():
+    args = cmd.args()
+    from test import generate_images, load_generated_images, create_masked_image
+    from gan.inception_score import get_inception_preds, get_inception_score_from_preds
+
+    pairs = pd.read_csv(args.pairs_file_test)
+    strata = pair_strata(pairs[['from', 'to']].values, args.annotations_file_test)
+    if args.eval_subset_size > 0:
+        subset = stratified_subset(strata, args.eval_subset_size)
+    else:
+        subset = np.arange(len(pairs))
+    print ("Number of strata %s, subset size %s from %s pairs" % (len(np.unique(strata)), len(subset), len(pairs)))
+
+    if args.load_generated_images:
+        print ("Loading images...")
+        input_images, target_images, generated_images, names = load_generated_images(args.generated_images_dir)
+        subset_names = set(zip(pairs['from'].values[subset], pairs['to'].values[subset]))
+        index = [i for i, name in enumerate(names) if tuple(name) in subset_names]
+        target_images = [target_images[i] for i in index]
+        generated_images = [generated_images[i] for i in index]
+        names = [names[i] for i in index]
+    else:
+        print ("Generate images...")
+        from conditional_gan import make_generator
+        from pose_dataset import PoseHMDataset
+        dataset = PoseHMDataset(test_phase=True, **vars(args))
+        dataset._pairs_test = dataset._pairs_test[subset]
+        generator = make_generator(args.image_size, args.use_input_pose, args.warp_skip, args.disc_type, args.warp_agg)
+        assert (args.generator_checkpoint is not None)
+        generator.load_weights(args.generator_checkpoint)
+        input_images, target_images, generated_images, names = generate_images(dataset, generator, args.use_input_pose)
+
+    stratum_of_pair = dict(zip(zip(pairs['from'], pairs['to']), strata))
+    subset_strata = np.array([stratum_of_pair[tuple(name)] for name in names])
+
+    print ("Compute metrics...")
+    generated_images_masked = create_masked_image(names, generated_images, args.annotations_file_test)
+    reference_images_masked = create_masked_image(names, target_images, args.annotations_file_test)
+    metrics = {'ssim': ssim_scores(generated_images, target_images),
+               'ssim_masked': ssim_scores(generated_images_masked, reference_images_masked),
+               'l1': l1_scores(generated_images, target_images)}
+    statistics = dict((key, np.mean) for key in metrics)
+
+    print ("Compute inception predictions...")
+    metrics['inception_score'] = get_inception_preds(generated_images)
+    metrics['inception_score_masked'] = get_inception_preds(generated_images_masked)
+    statistics['inception_score'] = lambda preds: get_inception_score_from_preds(preds)[0]
+    statistics['inception_score_masked'] = statistics['inception_score']
+
+    for key in sorted(metrics.keys()):
+        estimate, low, high = bootstrap(metrics[key], statistics[key], subset_strata,
+                                        args.bootstrap_samples, args.ci_confidence)
+        size = recommended_subset_size(len(names), low, high, args.ci_width * abs(estimate), len(pairs))
+        print ("%s = %s, %s%% CI [%s, %s]; subset size for CI width %s%%: %s" %
+               (key, estimate, 100 * args.ci_confidence, low, high, 100 * args.ci_width, size))
+
+    if args.per_sample_file:
+        print ("Save per pair metrics to %s..." % args.per_sample_file)
+        save_per_sample(args.per_sample_file, names, ssim=metrics['ssim'], ssim_masked=metrics['ssim_masked'],
+                        l1=metrics['l1'], stratum=subset_strata, **pose_statistics(names, args.annotations_file_test))
+
+
+if __name__ == "__main__":
+    evaluate()
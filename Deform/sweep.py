@@ -0,0 +1,76 @@
+import os
+from glob import glob
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import cmd
+from conditional_gan import make_generator
+from pose_dataset import PoseHMDataset
+from gan.inception_score import get_inception_score
+from pair_metrics import l1_scores, ssim_scores
+from subset_evaluation import pair_strata, stratified_subset
+from test import create_masked_image
+
+
+def deprocess_image(img):
+    return (255 * ((img + 1) / 2.0)).astype(np.uint8)
+
+
+def load_test_inputs(dataset):
+    """
+        All generator inputs of the test pairs, concatenated into one float32 array per generator input.
+    """
+    batches = []
+    names = []
+    for _ in tqdm(range(dataset._pairs_test.shape[0])):
+        batch, name = dataset.next_generator_sample_test(with_names=True)
+        batches.append([np.asarray(array, dtype='float32') for array in batch])
+        names.append([name[0, 0], name[0, 1]])
+    inputs = [np.concatenate(arrays, axis=0) for arrays in zip(*batches)]
+    return inputs, names
+
+
+def sweep():
+    args = cmd.args()
+    checkpoints = sorted(glob(args.sweep_checkpoints or os.path.join(args.checkpoints_dir, 'epoch_*_generator.h5')))
+    assert len(checkpoints) > 0, "No checkpoints to evaluate"
+    print ("Number of checkpoints: %s" % len(checkpoints))
+
+    dataset = PoseHMDataset(test_phase=True, **vars(args))
+    if args.eval_subset_size > 0:
+        strata = pair_strata(dataset.test_pair_names(), args.annotations_file_test)
+        dataset._pairs_test = dataset._pairs_test[stratified_subset(strata, args.eval_subset_size)]
+
+    print ("Load test pairs...")
+    inputs, names = load_test_inputs(dataset)
+    out_index = 2 if args.use_input_pose else 1
+    target_images = deprocess_image(inputs[out_index])
+    reference_images_masked = create_masked_image(names, target_images, args.annotations_file_test)
+
+    generator = make_generator(args.image_size, args.use_input_pose, args.warp_skip, args.disc_type, args.warp_agg)
+
+    table = []
+    for checkpoint in checkpoints:
+        print ("Evaluate %s..." % checkpoint)
+        generator.load_weights(checkpoint)
+        generated_images = deprocess_image(generator.predict(inputs, batch_size=args.batch_size)[out_index])
+        generated_images_masked = create_masked_image(names, generated_images, args.annotations_file_test)
+
+        row = {'checkpoint': os.path.basename(checkpoint),
+               'inception_score': get_inception_score(generated_images)[0],
+               'inception_score_masked': get_inception_score(generated_images_masked)[0],
+               'ssim': np.mean(ssim_scores(generated_images, target_images)),
+               'ssim_masked': np.mean(ssim_scores(generated_images_masked, reference_images_masked)),
+               'l1': np.mean(l1_scores(generated_images, target_images))}
+        print (row)
+        table.append(row)
+
+        pd.DataFrame(table, columns=['checkpoint', 'inception_score', 'inception_score_masked',
+                                     'ssim', 'ssim_masked', 'l1']).to_csv(args.sweep_table, index=False)
+    print ("Metrics table saved to %s" % args.sweep_table)
+
+
+if __name__ == "__main__":
+    sweep()
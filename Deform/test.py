@@ -6,8 +6,9 @@ from pose_dataset import PoseHMDataset
 
 from gan.inception_score import get_inception_score
 
+from pair_metrics import l1_scores, ssim_scores, pose_statistics, save_per_sample
+
 from skimage.io import imread, imsave
-from skimage.measure import compare_ssim
 
 import numpy as np
 import pandas as pd
@@ -19,21 +20,11 @@ from keras import backend as K
 import time
 
 def l1_score(generated_images, reference_images):
-    score_list = []
-    for reference_image, generated_image in zip(reference_images, generated_images):
-        score = np.abs(2 * (reference_image/255.0 - 0.5) - 2 * (generated_image/255.0 - 0.5)).mean()
-        score_list.append(score)
-    return np.mean(score_list)
+    return np.mean(l1_scores(generated_images, reference_images))
 
 
 def ssim_score(generated_images, reference_images):
-    ssim_score_list = []
-    for reference_image, generated_image in zip(reference_images, generated_images):
-        ssim = compare_ssim(reference_image, generated_image, gaussian_weights=True, sigma=1.5,
-                            use_sample_covariance=False, multichannel=True,
-                            data_range=generated_image.max() - generated_image.min())
-        ssim_score_list.append(ssim)
-    return np.mean(ssim_score_list)
+    return np.mean(ssim_scores(generated_images, reference_images))
 
 
 def save_images(input_images, target_images, generated_images, names, output_folder):
@@ -91,7 +82,7 @@ def generate_images(dataset, generator,  use_input_pose):
 
     all_time = 0.
     count = 0
-    for _ in tqdm(range(dataset._pairs_file_test.shape[0])):
+    for _ in tqdm(range(dataset._pairs_test.shape[0])):
         batch, name = dataset.next_generator_sample_test(with_names=True)
         starttime = time.time()
         out = generator.predict(batch)
@@ -103,7 +94,7 @@ def generate_images(dataset, generator,  use_input_pose):
         out_index = 2 if use_input_pose else 1
         target_images.append(deprocess_image(batch[out_index]))
         generated_images.append(deprocess_image(out[out_index]))
-        names.append([name.iloc[0]['from'], name.iloc[0]['to']])
+        names.append([name[0, 0], name[0, 1]])
 
     input_array = np.concatenate(input_images, axis=0)
     target_array = np.concatenate(target_images, axis=0)
@@ -140,11 +131,13 @@ def test():
     print ("Inception score %s" % inception_score[0])
 
     print ("Compute structured similarity score (SSIM)...")
-    structured_score = ssim_score(generated_images, target_images)
+    structured_scores = ssim_scores(generated_images, target_images)
+    structured_score = np.mean(structured_scores)
     print ("SSIM score %s" % structured_score)
 
     print ("Compute l1 score...")
-    norm_score = l1_score(generated_images, target_images)
+    norm_scores = l1_scores(generated_images, target_images)
+    norm_score = np.mean(norm_scores)
     print ("L1 score %s" % norm_score)
 
     print ("Compute masked inception score...")
@@ -154,12 +147,19 @@ def test():
 
     print ("Inception score masked %s" % inception_score_masked[0])
     print ("Compute masked SSIM...")
-    structured_score_masked = ssim_score(generated_images_masked, reference_images_masked)
+    structured_scores_masked = ssim_scores(generated_images_masked, reference_images_masked)
+    structured_score_masked = np.mean(structured_scores_masked)
     print ("SSIM score masked %s" % structured_score_masked)
 
     print ("Inception score = %s, masked = %s; SSIM score = %s, masked = %s; l1 score = %s" %
            (inception_score, inception_score_masked, structured_score, structured_score_masked, norm_score))
 
+    if args.per_sample_file:
+        print ("Save per pair metrics to %s..." % args.per_sample_file)
+        stats = pose_statistics(names, args.annotations_file_test)
+        save_per_sample(args.per_sample_file, names, ssim=structured_scores, ssim_masked=structured_scores_masked,
+                        l1=norm_scores, **stats)
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from compute_coordinates import build_stub_estimator, estimate_maps
+
+
+def test_batch_maps_match_single_images():
+    pytest.importorskip('keras')
+    model = build_stub_estimator()
+    rng = np.random.RandomState(0)
+    ## two images of the same size run as one batch, the others alone
+    sizes = [(128, 64), (96, 80), (128, 64), (176, 256)]
+    images = [rng.randint(0, 255, size=size + (3,)).astype('float64') for size in sizes]
+
+    for downscale in [1, 4]:
+        heatmaps, pafs = estimate_maps(model, images, downscale)
+        for image, heatmap, paf in zip(images, heatmaps, pafs):
+            single_heatmaps, single_pafs = estimate_maps(model, [image], downscale)
+            assert heatmap.shape == single_heatmaps[0].shape
+            np.testing.assert_allclose(heatmap, single_heatmaps[0], rtol=1e-5, atol=1e-6)
+            np.testing.assert_allclose(paf, single_pafs[0], rtol=1e-5, atol=1e-6)
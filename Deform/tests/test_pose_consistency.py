@@ -0,0 +1,77 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pose_consistency import pckh, oks, report, pose_consistency, OKS_SIGMAS
+from pose_utils import MISSING_VALUE
+
+
+def missing_pose():
+    return np.full((18, 2), MISSING_VALUE, dtype=int)
+
+
+def test_hand_computed_pckh_oks():
+    ## nose, neck and Rsho visible in the target, head size 10, bounding box 10 x 20
+    target = missing_pose()
+    target[0] = [0, 0]
+    target[1] = [10, 0]
+    target[2] = [10, 20]
+
+    ## exact nose, neck 5 px away (= 0.5 head size), Rsho missing, Relb without target
+    predicted = missing_pose()
+    predicted[0] = [0, 0]
+    predicted[1] = [13, 4]
+    predicted[3] = [30, 30]
+
+    pckh_values = pckh(predicted[np.newaxis], target[np.newaxis])
+    oks_values = oks(predicted[np.newaxis], target[np.newaxis])
+    assert pckh_values.shape == oks_values.shape == (1, 18)
+
+    np.testing.assert_allclose(pckh_values[0, :3], [1, 1, 0])
+    assert np.all(np.isnan(pckh_values[0, 3:]))
+
+    neck = np.exp(-25. / (2 * 200 * (2 * OKS_SIGMAS[1]) ** 2))
+    np.testing.assert_allclose(oks_values[0, :3], [1, neck, 0], rtol=1e-5)
+    assert np.all(np.isnan(oks_values[0, 3:]))
+
+    ## 6 px is beyond 0.5 head size
+    predicted[1] = [10, 6]
+    assert pckh(predicted[np.newaxis], target[np.newaxis])[0, 1] == 0
+
+
+def test_pckh_without_head():
+    target = missing_pose()
+    target[1] = [10, 0]
+    target[2] = [10, 20]
+    assert np.all(np.isnan(pckh(target[np.newaxis], target[np.newaxis])))
+
+
+def test_pose_consistency_with_stub(tmpdir, capsys):
+    pytest.importorskip('keras')
+    from skimage.io import imsave
+
+    names = [('from0.jpg', 'to0.jpg'), ('from1.jpg', 'to1.jpg')]
+    rng = np.random.RandomState(0)
+    generated_dir = tmpdir.mkdir('generated')
+    lines = ['name:keypoints_y:keypoints_x']
+    for fr, to in names:
+        ## input, target and generated image side by side
+        image = rng.randint(0, 255, size=(128, 64 * 3, 3)).astype(np.uint8)
+        imsave(str(generated_dir.join(fr + '_' + to + '.png')), image)
+        pose = rng.randint(0, 64, size=(18, 2))
+        lines.append('%s: %s: %s' % (to, list(pose[:, 0]), list(pose[:, 1])))
+    annotations_file = str(tmpdir.join('annotations.csv'))
+    with open(annotations_file, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    loaded_names, pckh_values, oks_values = pose_consistency(str(generated_dir), annotations_file, 'stub', batch_size=2)
+    assert sorted(tuple(name) for name in loaded_names) == names
+    assert pckh_values.shape == oks_values.shape == (2, 18)
+
+    capsys.readouterr()
+    report(pckh_values, oks_values)
+    assert len(capsys.readouterr().out.splitlines()) == 1 + 18 + 1
@@ -0,0 +1,207 @@
+"""
+    Regression check of the vectorized pose parser of compute_coordinates against the loop parser it replaced,
+    on saved heatmaps and PAFs (data/pose_parser_maps.npz: 3 synthetic people at 128x64, a noisy person at
+    128x64 and 3 people at 256x176 averaged at downscale 4).
+"""
+import os
+import sys
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from compute_coordinates import mapIdx, limbSeq, compute_cordinates
+
+MAPS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'pose_parser_maps.npz')
+
+
+def reference_refine_peak(map, x, y):
+    """
+        Sub-pixel position of a peak, vertex of the parabola through the peak and its neighbours along each axis.
+    """
+    dx = dy = 0.
+    if 0 < x < map.shape[1] - 1:
+        denominator = map[y, x-1] - 2 * map[y, x] + map[y, x+1]
+        if denominator < 0:
+            dx = np.clip(0.5 * (map[y, x-1] - map[y, x+1]) / denominator, -0.5, 0.5)
+    if 0 < y < map.shape[0] - 1:
+        denominator = map[y-1, x] - 2 * map[y, x] + map[y+1, x]
+        if denominator < 0:
+            dy = np.clip(0.5 * (map[y-1, x] - map[y+1, x]) / denominator, -0.5, 0.5)
+    return (x + dx, y + dy)
+
+
+def reference_compute_cordinates(heatmap_avg, paf_avg, th1=0.1, th2=0.05, downscale=1):
+    """
+        Keypoints of the best person. Maps of size image size / downscale are parsed with gaussian smoothing
+        scaled accordingly and sub-pixel peaks, the keypoints are returned in image coordinates.
+    """
+    all_peaks = []
+    peak_counter = 0
+
+    for part in range(18):
+        map_ori = heatmap_avg[:,:,part]
+        map = gaussian_filter(map_ori, sigma=3.0/downscale)
+
+        map_left = np.zeros(map.shape)
+        map_left[1:,:] = map[:-1,:]
+        map_right = np.zeros(map.shape)
+        map_right[:-1,:] = map[1:,:]
+        map_up = np.zeros(map.shape)
+        map_up[:,1:] = map[:,:-1]
+        map_down = np.zeros(map.shape)
+        map_down[:,:-1] = map[:,1:]
+
+        peaks_binary = np.logical_and.reduce((map>=map_left, map>=map_right, map>=map_up, map>=map_down, map > th1))
+        peaks = zip(np.nonzero(peaks_binary)[1], np.nonzero(peaks_binary)[0]) # note reverse
+
+        if downscale != 1:
+            peaks_with_score = [reference_refine_peak(map, x[0], x[1]) + (map_ori[x[1],x[0]],) for x in peaks]
+        else:
+            peaks_with_score = [x + (map_ori[x[1],x[0]],) for x in peaks]
+        id = range(peak_counter, peak_counter + len(peaks))
+        peaks_with_score_and_id = [peaks_with_score[i] + (id[i],) for i in range(len(id))]
+
+        all_peaks.append(peaks_with_score_and_id)
+        peak_counter += len(peaks)
+
+    connection_all = []
+    special_k = []
+    mid_num = 10
+
+    for k in range(len(mapIdx)):
+        score_mid = paf_avg[:,:,[x-19 for x in mapIdx[k]]]
+        candA = all_peaks[limbSeq[k][0]-1]
+        candB = all_peaks[limbSeq[k][1]-1]
+        nA = len(candA)
+        nB = len(candB)
+        indexA, indexB = limbSeq[k]
+        if(nA != 0 and nB != 0):
+            connection_candidate = []
+            for i in range(nA):
+                for j in range(nB):
+                    vec = np.subtract(candB[j][:2], candA[i][:2])
+                    norm = np.sqrt(vec[0]*vec[0] + vec[1]*vec[1])
+                    vec = np.divide(vec, norm)
+
+                    startend = zip(np.linspace(candA[i][0], candB[j][0], num=mid_num),
+                                   np.linspace(candA[i][1], candB[j][1], num=mid_num))
+
+                    vec_x = np.array([score_mid[int(round(startend[I][1])), int(round(startend[I][0])), 0]
+                                      for I in range(len(startend))])
+                    vec_y = np.array([score_mid[int(round(startend[I][1])), int(round(startend[I][0])), 1]
+                                      for I in range(len(startend))])
+
+                    score_midpts = np.multiply(vec_x, vec[0]) + np.multiply(vec_y, vec[1])
+                    score_with_dist_prior = sum(score_midpts)/len(score_midpts) + min(0.5*paf_avg.shape[0]/norm-1, 0)
+                    criterion1 = len(np.nonzero(score_midpts > th2)[0]) > 0.8 * len(score_midpts)
+                    criterion2 = score_with_dist_prior > 0
+                    if criterion1 and criterion2:
+                        connection_candidate.append([i, j, score_with_dist_prior, score_with_dist_prior+candA[i][2]+candB[j][2]])
+
+            connection_candidate = sorted(connection_candidate, key=lambda x: x[2], reverse=True)
+            connection = np.zeros((0,5))
+            for c in range(len(connection_candidate)):
+                i,j,s = connection_candidate[c][0:3]
+                if(i not in connection[:,3] and j not in connection[:,4]):
+                    connection = np.vstack([connection, [candA[i][3], candB[j][3], s, i, j]])
+                    if(len(connection) >= min(nA, nB)):
+                        break
+
+            connection_all.append(connection)
+        else:
+            special_k.append(k)
+            connection_all.append([])
+
+    # last number in each row is the total parts number of that person
+    # the second last number in each row is the score of the overall configuration
+    subset = -1 * np.ones((0, 20))
+    candidate = np.array([item for sublist in all_peaks for item in sublist])
+
+    for k in range(len(mapIdx)):
+        if k not in special_k:
+            partAs = connection_all[k][:,0]
+            partBs = connection_all[k][:,1]
+            indexA, indexB = np.array(limbSeq[k]) - 1
+
+            for i in range(len(connection_all[k])): #= 1:size(temp,1)
+                found = 0
+                subset_idx = [-1, -1]
+                for j in range(len(subset)): #1:size(subset,1):
+                    if subset[j][indexA] == partAs[i] or subset[j][indexB] == partBs[i]:
+                        subset_idx[found] = j
+                        found += 1
+
+                if found == 1:
+                    j = subset_idx[0]
+                    if(subset[j][indexB] != partBs[i]):
+                        subset[j][indexB] = partBs[i]
+                        subset[j][-1] += 1
+                        subset[j][-2] += candidate[partBs[i].astype(int), 2] + connection_all[k][i][2]
+                elif found == 2: # if found 2 and disjoint, merge them
+                    j1, j2 = subset_idx
+                    print "found = 2"
+                    membership = ((subset[j1]>=0).astype(int) + (subset[j2]>=0).astype(int))[:-2]
+                    if len(np.nonzero(membership == 2)[0]) == 0: #merge
+                        subset[j1][:-2] += (subset[j2][:-2] + 1)
+                        subset[j1][-2:] += subset[j2][-2:]
+                        subset[j1][-2] += connection_all[k][i][2]
+                        subset = np.delete(subset, j2, 0)
+                    else: # as like found == 1
+                        subset[j1][indexB] = partBs[i]
+                        subset[j1][-1] += 1
+                        subset[j1][-2] += candidate[partBs[i].astype(int), 2] + connection_all[k][i][2]
+
+                # if find no partA in the subset, create a new subset
+                elif not found and k < 17:
+                    row = -1 * np.ones(20)
+                    row[indexA] = partAs[i]
+                    row[indexB] = partBs[i]
+                    row[-1] = 2
+                    row[-2] = sum(candidate[connection_all[k][i,:2].astype(int), 2]) + connection_all[k][i][2]
+                    subset = np.vstack([subset, row])
+
+    # delete some rows of subset which has few parts occur
+    deleteIdx = [];
+    for i in range(len(subset)):
+        if subset[i][-1] < 4 or subset[i][-2]/subset[i][-1] < 0.4:
+            deleteIdx.append(i)
+    subset = np.delete(subset, deleteIdx, axis=0)
+
+    if len(subset) == 0:
+        return np.array([[-1, -1]] * 18).astype(int)
+
+    cordinates = []
+    result_image_index = np.argmax(subset[:, -2])
+
+    for part in subset[result_image_index, :18]:
+        if part == -1:
+            cordinates.append([-1, -1])
+        else:
+            Y = candidate[part.astype(int), 0]
+            X = candidate[part.astype(int), 1]
+            if downscale != 1:
+                X, Y = [np.round((c + 0.5) * downscale - 0.5) for c in (X, Y)]
+            cordinates.append([X, Y])
+    return np.array(cordinates).astype(int)
+
+
+
+def load_maps():
+    with np.load(MAPS_FILE) as data:
+        return [(data['heatmap_%d' % i].astype('float64'), data['paf_%d' % i].astype('float64'),
+                 int(data['downscale_%d' % i])) for i in range(len(data.files) // 3)]
+
+
+def test_parser_matches_reference():
+    for heatmap, paf, downscale in load_maps():
+        expected = reference_compute_cordinates(heatmap, paf, downscale=downscale)
+        assert np.any(expected != -1)
+        np.testing.assert_array_equal(compute_cordinates(heatmap, paf, downscale=downscale), expected)
+
+
+def test_parser_without_people():
+    heatmap, paf, _ = load_maps()[0]
+    np.testing.assert_array_equal(compute_cordinates(np.zeros_like(heatmap), paf), -np.ones((18, 2), dtype=int))
+
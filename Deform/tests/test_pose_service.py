@@ -0,0 +1,112 @@
+import os
+import re
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+from skimage.io import imsave
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pose_service import Batcher, ThreadingHTTPServer, make_handler, estimate_files, annotate_files
+
+try:
+    from urllib.request import urlopen, Request
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import urlopen, Request, HTTPError
+
+LINE = re.compile(r'^(.+): \[(.*)\]: \[(.*)\]$')
+
+
+def write_images(tmpdir, number_of_images):
+    rng = np.random.RandomState(0)
+    paths = []
+    for i in range(number_of_images):
+        path = str(tmpdir.join('image%s.png' % i))
+        imsave(path, rng.randint(0, 255, size=(128, 64, 3)).astype(np.uint8))
+        paths.append(path)
+    return paths
+
+
+def check_line(line, name):
+    match = LINE.match(line)
+    assert match is not None, line
+    assert match.group(1) == name
+    assert len(match.group(2).split(',')) == len(match.group(3).split(',')) == 18
+
+
+class CountingBatcher(object):
+    """
+        Returns missing keypoints and records how many images wait at the same time.
+    """
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.waiting = self.max_waiting = 0
+
+    def estimate(self, image):
+        with self.lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+        time.sleep(0.01)
+        with self.lock:
+            self.waiting -= 1
+        return -np.ones((18, 2), dtype=int)
+
+
+def test_estimate_files_is_bounded_and_names_failed_paths(tmpdir):
+    paths = write_images(tmpdir, 10)
+    batcher = CountingBatcher(batch_size=3)
+    assert len(estimate_files(batcher, paths)) == 10
+    assert batcher.max_waiting <= 3
+
+    missing = [str(tmpdir.join('missing%s.png' % i)) for i in range(2)]
+    with pytest.raises(ValueError) as error:
+        estimate_files(batcher, paths[:2] + missing)
+    message = str(error.value)
+    assert message.startswith('Failed to annotate 2 images')
+    assert all(path in message for path in missing)
+
+
+@pytest.fixture
+def service():
+    pytest.importorskip('keras')
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(Batcher('stub', batch_size=4)))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:%s' % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def test_missing_estimator_fails_at_startup(tmpdir):
+    pytest.importorskip('keras')
+    with pytest.raises(Exception):
+        Batcher(str(tmpdir.join('missing.h5')))
+
+
+def test_annotate(service, tmpdir):
+    path = write_images(tmpdir, 1)[0]
+    with open(path, 'rb') as f:
+        response = urlopen(Request(service + '/annotate?name=image0.jpg', data=f.read()))
+    lines = response.read().decode('utf-8').splitlines()
+    assert len(lines) == 1
+    check_line(lines[0], 'image0.jpg')
+
+
+def test_annotate_files(service, tmpdir):
+    paths = write_images(tmpdir, 6)
+    lines = annotate_files(paths, url=service)
+    assert len(lines) == len(paths)
+    for line, path in zip(lines, paths):
+        check_line(line, os.path.basename(path))
+
+    missing = str(tmpdir.join('missing.png'))
+    with pytest.raises(HTTPError) as error:
+        annotate_files(paths[:1] + [missing], url=service)
+    assert error.value.code == 500
+    assert missing in error.value.read().decode('utf-8')
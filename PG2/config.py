@@ -32,12 +32,22 @@ data_arg.add_argument('--dataset', type=str, default='CelebA')
 data_arg.add_argument('--split', type=str, default='train')
 data_arg.add_argument('--batch_size', type=int, default=16)
 data_arg.add_argument('--grayscale', type=str2bool, default=False)
-data_arg.add_argument('--num_worker', type=int, default=4)
+data_arg.add_argument('--num_worker', type=int, default=4,
+                      help='parallel calls of the input pipeline map')
+data_arg.add_argument('--prefetch_batches', type=int, default=2,
+                      help='number of batches the input pipeline prepares ahead')
+data_arg.add_argument('--shuffle_buffer', type=int, default=32,
+                      help='number of pair examples shuffled during training')
+data_arg.add_argument('--data_layout', type=str, default='pair', choices=['pair', 'image'],
+                      help='read the pair TFRecords, or the image TFRecords and pair index held in memory')
 
 # Training / test parameters
 train_arg = add_argument_group('Training')
 train_arg.add_argument('--is_train', type=str2bool, default=True)
 train_arg.add_argument('--test_one_by_one', type=str2bool, default=False)
+train_arg.add_argument('--sweep', type=str2bool, default=False,
+                       help='score all model.ckpt-* in model_dir instead of testing one checkpoint')
+train_arg.add_argument('--sweep_batch_num', type=int, default=400)
 train_arg.add_argument('--optimizer', type=str, default='adam')
 train_arg.add_argument('--start_step', type=int, default=0)
 data_arg.add_argument('--ckpt_path', type=str, default=None)
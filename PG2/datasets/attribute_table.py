@@ -0,0 +1,56 @@
+"""Attributes of the PG2 datasets, stored once per identity.
+
+The converters save the attribute vectors of all identities of a split as the
+rows of the arrays in 'attributes_<split>.npz'. A pair example only holds the
+rows of its images, 'attr_id_0' and 'attr_id_1'. get_split gives the arrays
+to the decoder, which looks the vectors up by row inside the graph, so
+'attrs_0', 'attrs_w2v25_0', ... are items of the dataset.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+import tensorflow as tf
+
+slim = tf.contrib.slim
+
+_FILE_PATTERN = 'attributes_%s.npz'
+
+
+def save_attribute_table(out_dir, split_name, tables):
+    """Saves a dict of (number of identities, dim) arrays of a split."""
+    np.savez(os.path.join(out_dir, _FILE_PATTERN % split_name), **tables)
+
+
+def load_attribute_table(dataset_dir, split_name):
+    """Returns the dict of attribute arrays of a split, None if it has none."""
+    path = os.path.join(dataset_dir, _FILE_PATTERN % split_name)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return dict((key, data[key]) for key in data.files)
+
+
+class AttributeLookup(slim.tfexample_decoder.ItemHandler):
+    """TFExampleDecoder handler of the row of an attribute array given by an id key."""
+
+    def __init__(self, id_key, table):
+        super(AttributeLookup, self).__init__([id_key])
+        self._id_key = id_key
+        self._table = table
+
+    def tensors_to_item(self, keys_to_tensors):
+        return tf.gather(tf.constant(self._table), keys_to_tensors[self._id_key])
+
+
+def use_attribute_table(keys_to_features, items_to_handlers, tables):
+    """Adds the attribute ids of both images and a lookup item per attribute array."""
+    for suffix in ['_0', '_1']:
+        keys_to_features['attr_id' + suffix] = tf.FixedLenFeature([], tf.int64)
+        items_to_handlers['attr_id' + suffix] = slim.tfexample_decoder.Tensor('attr_id' + suffix)
+        for name, table in tables.items():
+            items_to_handlers[name + suffix] = AttributeLookup('attr_id' + suffix, table)
@@ -22,8 +22,20 @@ import tensorflow as tf
 
 try:
     import dataset_utils
+    import pair_utils
+    import shard_writer
+    import image_cache
+    import image_store
+    import mask_codec
+    import attribute_table
 except:
     from datasets import dataset_utils
+    from datasets import pair_utils
+    from datasets import shard_writer
+    from datasets import image_cache
+    from datasets import image_store
+    from datasets import mask_codec
+    from datasets import attribute_table
 import numpy as np
 import pickle
 import pdb
@@ -45,26 +57,6 @@ _NUM_SHARDS = 1
 _IMG_PATTERN = '.jpg'
 
 
-class ImageReader(object):
-    """Helper class that provides TensorFlow image coding utilities."""
-
-    def __init__(self):
-        # Initializes function that decodes RGB JPEG data.
-        self._decode_jpeg_data = tf.placeholder(dtype=tf.string)
-        self._decode_jpeg = tf.image.decode_jpeg(self._decode_jpeg_data, channels=3)
-
-    def read_image_dims(self, sess, image_data):
-        image = self.decode_jpeg(sess, image_data)
-        return image.shape[0], image.shape[1]
-
-    def decode_jpeg(self, sess, image_data):
-        image = sess.run(self._decode_jpeg,
-                                         feed_dict={self._decode_jpeg_data: image_data})
-        assert len(image.shape) == 3
-        assert image.shape[2] == 3
-        return image
-
-
 def _get_folder_path(dataset_dir, split_name):
     if split_name == 'train':
         folder_path = os.path.join(dataset_dir, 'bounding_box_train')
@@ -105,13 +97,13 @@ def _get_image_file_list(dataset_dir, split_name):
     return valid_filelist
 
 
-def _get_dataset_filename(dataset_dir, out_dir, split_name, shard_id):
+def _get_dataset_filename(dataset_dir, out_dir, split_name, shard_id, num_shards=_NUM_SHARDS):
     output_filename = 'Market1501_%s_%05d-of-%05d.tfrecord' % (
-            split_name.split('_')[0], shard_id, _NUM_SHARDS)
+            split_name.split('_')[0], shard_id, num_shards)
     return os.path.join(out_dir, output_filename)
 
 
-def _get_train_all_pn_pairs(dataset_dir, out_dir, split_name='train', augment_ratio=1, mode='diff_cam',add_switch_pair=True):
+def _get_train_all_pn_pairs(dataset_dir, out_dir, split_name='train', augment_ratio=1, mode='diff_cam', negative_ratio=1,add_switch_pair=True):
     """Returns a list of pair image filenames.
 
     Args:
@@ -119,89 +111,31 @@ def _get_train_all_pn_pairs(dataset_dir, out_dir, split_name='train', augment_ra
 
     Returns:
         p_pairs: A list of positive pairs.
-        n_pairs: A list of negative pairs.
+        n_pairs: A list of negative pairs, negative_ratio times as many as positive pairs.
     """
     assert split_name in {'train', 'train_flip', 'test', 'test_samples', 'all'}
     if split_name=='train_flip':
-        p_pairs_path = os.path.join(out_dir, 'p_pairs_train_flip.p')
-        n_pairs_path = os.path.join(out_dir, 'n_pairs_train_flip.p')
+        pairs_path = os.path.join(out_dir, 'pn_pairs_train_flip')
     else:
-        p_pairs_path = os.path.join(out_dir, 'p_pairs_'+split_name.split('_')[0]+'.p')
-        n_pairs_path = os.path.join(out_dir, 'n_pairs_'+split_name.split('_')[0]+'.p')
-    if os.path.exists(p_pairs_path):
-        with open(p_pairs_path,'r') as f:
-            p_pairs = pickle.load(f)
-        with open(n_pairs_path,'r') as f:
-            n_pairs = pickle.load(f)
+        pairs_path = os.path.join(out_dir, 'pn_pairs_'+split_name.split('_')[0])
+    if os.path.exists(pairs_path + '.json'):
+        filelist, p_pairs, n_pairs = pair_utils.load_pairs(pairs_path)
     else:
         filelist = _get_image_file_list(dataset_dir, split_name)
-        filenames = []
-        p_pairs = []
-        n_pairs = []
-        if 'diff_cam'==mode:
-            for i in xrange(0, len(filelist)):
-                id_i = filelist[i][0:4]
-                cam_i = filelist[i][6]
-                for j in xrange(i+1, len(filelist)):
-                    id_j = filelist[j][0:4]
-                    cam_j = filelist[j][6]
-                    if id_j == id_i and cam_j != cam_i:
-                        p_pairs.append([filelist[i],filelist[j]])
-                        # p_pairs.append([filelist[j],filelist[i]])  # two streams share the same weights, no need switch
-                        if len(p_pairs)%100000==0:
-                                print(len(p_pairs))
-                    elif j%10==0 and id_j != id_i and cam_j != cam_i:  # limit the neg pairs to 1/10, otherwise it cost too much time
-                        n_pairs.append([filelist[i],filelist[j]])
-                        # n_pairs.append([filelist[j],filelist[i]])  # two streams share the same weights, no need switch
-                        if len(n_pairs)%100000==0:
-                                print(len(n_pairs))
-        elif 'same_cam'==mode:
-            for i in xrange(0, len(filelist)):
-                id_i = filelist[i][0:4]
-                cam_i = filelist[i][6]
-                for j in xrange(i+1, len(filelist)):
-                    id_j = filelist[j][0:4]
-                    cam_j = filelist[j][6]
-                    if id_j == id_i and cam_j == cam_i:
-                        p_pairs.append([filelist[i],filelist[j]])
-                        # p_pairs.append([filelist[j],filelist[i]])  # two streams share the same weights, no need switch
-                        if len(p_pairs)%100000==0:
-                                print(len(p_pairs))
-                    elif j%10==0 and id_j != id_i and cam_j == cam_i:  # limit the neg pairs to 1/10, otherwise it cost too much time
-                        n_pairs.append([filelist[i],filelist[j]])
-                        # n_pairs.append([filelist[j],filelist[i]])  # two streams share the same weights, no need switch
-                        if len(n_pairs)%100000==0:
-                                print(len(n_pairs))
-        elif 'same_diff_cam'==mode:
-            for i in xrange(0, len(filelist)):
-                id_i = filelist[i][0:4]
-                cam_i = filelist[i][6]
-                for j in xrange(i+1, len(filelist)):
-                    id_j = filelist[j][0:4]
-                    cam_j = filelist[j][6]
-                    if id_j == id_i:
-                        p_pairs.append([filelist[i],filelist[j]])
-                        if add_switch_pair:
-                            p_pairs.append([filelist[j],filelist[i]])  # if two streams share the same weights, no need switch
-                        if len(p_pairs)%100000==0:
-                                print(len(p_pairs))
-                    elif j%2000==0 and id_j != id_i:  # limit the neg pairs to 1/40, otherwise it cost too much time
-                        n_pairs.append([filelist[i],filelist[j]])
-                        # n_pairs.append([filelist[j],filelist[i]])  # two streams share the same weights, no need switch
-                        if len(n_pairs)%100000==0:
-                                print(len(n_pairs))
-
-        print('repeat positive pairs augment_ratio times and cut down negative pairs to balance data ......')
-        p_pairs = p_pairs * augment_ratio  
-        random.shuffle(n_pairs)
-        n_pairs = n_pairs[:len(p_pairs)]
+        ids = [name[0:4] for name in filelist]
+        cams = [name[6] for name in filelist]
+        p_pairs = pair_utils.positive_pairs(ids, cams, mode, add_switch_pair and 'same_diff_cam'==mode)
+        number_of_negatives = int(negative_ratio * len(p_pairs) * augment_ratio)
+
+        print('repeat positive pairs augment_ratio times and sample negative pairs to balance data ......')
+        p_pairs = np.tile(p_pairs, (augment_ratio, 1))
+        n_pairs = pair_utils.negative_pairs(ids, number_of_negatives, cams, mode)
         print('p_pairs length:%d' % len(p_pairs))
         print('n_pairs length:%d' % len(n_pairs))
         print('save p_pairs and n_pairs ......')
-        with open(p_pairs_path,'w') as f:
-            pickle.dump(p_pairs,f)
-        with open(n_pairs_path,'w') as f:
-            pickle.dump(n_pairs,f)
+        pair_utils.save_pairs(pairs_path, filelist, p_pairs, n_pairs)
+    p_pairs = pair_utils.to_names(filelist, p_pairs)
+    n_pairs = pair_utils.to_names(filelist, n_pairs)
 
     print('_get_train_all_pn_pairs finish ......')
     print('p_pairs length:%d' % len(p_pairs))
@@ -241,41 +175,27 @@ def _getPoseMask(peaks, height, width, radius=4, var=4, mode='Solid'):
     limbSeq = [[2,3], [2,6], [3,4], [4,5], [6,7], [7,8], [2,9], [9,10], \
                          [10,11], [2,12], [12,13], [13,14], [2,1], [1,15], [15,17], \
                          [1,16], [16,18], [2,17], [2,18], [9,12], [12,6], [9,3], [17,18]] #
-    indices = []
-    values = []
-    for limb in limbSeq:
-        p0 = peaks[limb[0] -1]
-        p1 = peaks[limb[1] -1]
-        if 0!=len(p0) and 0!=len(p1):
-            r0 = p0[0][1]
-            c0 = p0[0][0]
-            r1 = p1[0][1]
-            c1 = p1[0][0]
-            ind, val = _getSparseKeypoint(r0, c0, 0, height, width, radius, var, mode)
-            indices.extend(ind)
-            values.extend(val)
-            ind, val = _getSparseKeypoint(r1, c1, 0, height, width, radius, var, mode)
-            indices.extend(ind)
-            values.extend(val)
-        
-            distance = np.sqrt((r0-r1)**2 + (c0-c1)**2)
-            sampleN = int(distance/radius)
-            # sampleN = 0
-            if sampleN>1:
-                for i in xrange(1,sampleN):
-                    r = r0 + (r1-r0)*i/sampleN
-                    c = c0 + (c1-c0)*i/sampleN
-                    ind, val = _getSparseKeypoint(r, c, 0, height, width, radius, var, mode)
-                    indices.extend(ind)
-                    values.extend(val)
+    ## Both joints of every limb with two visible joints
+    limbs = [limb for limb in limbSeq if 0!=len(peaks[limb[0] -1]) and 0!=len(peaks[limb[1] -1])]
+    r0 = np.array([peaks[limb[0] -1][0][1] for limb in limbs])
+    c0 = np.array([peaks[limb[0] -1][0][0] for limb in limbs])
+    r1 = np.array([peaks[limb[1] -1][0][1] for limb in limbs])
+    c1 = np.array([peaks[limb[1] -1][0][0] for limb in limbs])
+
+    ## Points of every limb: both joints, then sampleN-1 points in between
+    distance = np.sqrt((r0-r1)**2 + (c0-c1)**2)
+    sampleN = (distance/radius).astype(int)
+    count = 2 + np.maximum(sampleN-1, 0)
+    limb = np.repeat(np.arange(len(limbs)), count)
+    i = np.arange(count.sum()) - np.repeat(np.cumsum(count)-count, count) - 1
+    n = np.maximum(sampleN[limb], 1)
+    r = np.where(i<0, r0[limb], np.where(i==0, r1[limb], r0[limb] + (r1[limb]-r0[limb])*i/n))
+    c = np.where(i<0, c0[limb], np.where(i==0, c1[limb], c0[limb] + (c1[limb]-c0[limb])*i/n))
+    indices, values = _getSparseKeypoints(r, c, np.zeros(len(r), dtype=int), height, width, radius, var, mode)
 
     shape = [height, width, 1]
     ## Fill body
     dense = np.squeeze(_sparse2dense(indices, values, shape))
-    ## TODO
-    # im = Image.fromarray((dense*255).astype(np.uint8))
-    # im.save('xxxxx.png')
-    # pdb.set_trace()
     dense = dilation(dense, square(5))
     dense = erosion(dense, square(5))
     return dense
@@ -283,57 +203,60 @@ def _getPoseMask(peaks, height, width, radius=4, var=4, mode='Solid'):
 
 Ratio_0_4 = 1.0/scipy.stats.norm(0, 4).pdf(0)
 Gaussian_0_4 = scipy.stats.norm(0, 4)
-def _getSparseKeypoint(r, c, k, height, width, radius=4, var=4, mode='Solid'):
-    r = int(r)
-    c = int(c)
-    k = int(k)
-    indices = []
-    values = []
-    for i in range(-radius, radius+1):
-        for j in range(-radius, radius+1):
-            distance = np.sqrt(float(i**2+j**2))
-            if r+i>=0 and r+i<height and c+j>=0 and c+j<width:
-                if 'Solid'==mode and distance<=radius:
-                    indices.append([r+i, c+j, k])
-                    values.append(1)
-                elif 'Gaussian'==mode and distance<=radius:
-                    indices.append([r+i, c+j, k])
-                    if 4==var:
-                        values.append( Gaussian_0_4.pdf(distance) * Ratio_0_4  )
-                    else:
-                        assert 'Only define Ratio_0_4  Gaussian_0_4 ...'
+## Offsets and distances of the pixels of a window within radius, in row-major order
+_Disk_offsets = {}
+def _getDiskOffsets(radius):
+    if radius not in _Disk_offsets:
+        i, j = np.mgrid[-radius:radius+1, -radius:radius+1]
+        distance = np.sqrt((i**2+j**2).astype(float))
+        inside = distance<=radius
+        _Disk_offsets[radius] = (i[inside], j[inside], distance[inside])
+    return _Disk_offsets[radius]
+
+def _getSparseKeypoints(rs, cs, ks, height, width, radius=4, var=4, mode='Solid'):
+    ## Indices (N, 3) and values (N,) of the windows of all keypoints, in the order of _getSparseKeypoint calls
+    di, dj, distance = _getDiskOffsets(radius)
+    rows = np.asarray(rs).astype(int).reshape((-1, 1)) + di
+    cols = np.asarray(cs).astype(int).reshape((-1, 1)) + dj
+    ks = np.broadcast_to(np.asarray(ks).astype(int).reshape((-1, 1)), rows.shape)
+    valid = (rows>=0) & (rows<height) & (cols>=0) & (cols<width)
+    indices = np.stack([rows[valid], cols[valid], ks[valid]], axis=1)
+    if 'Solid'==mode:
+        values = np.ones(len(indices), dtype=int)
+    elif 'Gaussian'==mode:
+        assert 4==var, 'Only define Ratio_0_4  Gaussian_0_4 ...'
+        values = (Gaussian_0_4.pdf(distance) * Ratio_0_4)[np.nonzero(valid)[1]]
+    else:
+        indices, values = indices[:0], np.zeros(0)
     return indices, values
 
+def _getSparseKeypoint(r, c, k, height, width, radius=4, var=4, mode='Solid'):
+    indices, values = _getSparseKeypoints([r], [c], [k], height, width, radius, var, mode)
+    return indices.tolist(), values.tolist()
+
 def _getSparsePose(peaks, height, width, channel, radius=4, var=4, mode='Solid'):
-    indices = []
-    values = []
-    for k in range(len(peaks)):
-        p = peaks[k]
-        if 0!=len(p):
-            r = p[0][1]
-            c = p[0][0]
-            ind, val = _getSparseKeypoint(r, c, k, height, width, radius, var, mode)
-            indices.extend(ind)
-            values.extend(val)
+    ks = [k for k in range(len(peaks)) if 0!=len(peaks[k])]
+    rs = [peaks[k][0][1] for k in ks]
+    cs = [peaks[k][0][0] for k in ks]
+    indices, values = _getSparseKeypoints(rs, cs, ks, height, width, radius, var, mode)
     shape = [height, width, channel]
-    return indices, values, shape
+    return indices.tolist(), values.tolist(), shape
 
 def _oneDimSparsePose(indices, shape):
-    ind_onedim = []
-    for ind in indices:
-        # idx = ind[2]*shape[0]*shape[1] + ind[1]*shape[0] + ind[0]
-        idx = ind[0]*shape[2]*shape[1] + ind[1]*shape[2] + ind[2]
-        ind_onedim.append(idx)
+    indices = np.asarray(indices, dtype=int).reshape((-1, 3))
+    # idx = ind[2]*shape[0]*shape[1] + ind[1]*shape[0] + ind[0]
+    ind_onedim = indices[:,0]*shape[2]*shape[1] + indices[:,1]*shape[2] + indices[:,2]
     shape = np.prod(shape)
-    return ind_onedim, shape
+    return ind_onedim.tolist(), shape
 
 def _sparse2dense(indices, values, shape):
     dense = np.zeros(shape)
-    for i in range(len(indices)):
-        r = indices[i][0]
-        c = indices[i][1]
-        k = indices[i][2]
-        dense[r,c,k] = values[i]
+    indices = np.asarray(indices, dtype=int).reshape((-1, 3))
+    ## The last value of a repeated index is kept, as with assignments in order
+    flat = np.ravel_multi_index(indices.T, dense.shape, mode='wrap')
+    _, last = np.unique(flat[::-1], return_index=True)
+    last = len(flat) - 1 - last
+    dense[indices[last,0], indices[last,1], indices[last,2]] = np.asarray(values)[last]
     return dense
 
 def _get_valid_peaks(all_peaks, subsets):
@@ -391,9 +314,69 @@ def _visualizePose(pose, img):
     plt.show()
 
 
-def _format_data(sess, image_reader, folder_path, pairs, idx, labels, id_map, attr_onehot_mat, attr_w2v25_mat, 
-                    attr_w2v50_mat, attr_w2v100_mat, attr_w2v150_mat, id_map_attr, all_peaks_dic, subsets_dic, 
-                    seg_data_dir, FiltOutMissRegion=False, FLIP=False):
+def _attribute_tables(attr_onehot_mat, attr_w2v_mats):
+    """Returns the attribute arrays with one row per identity, in the order of id_map_attr.
+
+    Args:
+        attr_onehot_mat: The one-hot attribute struct or None.
+        attr_w2v_mats: A list of (name, word2vec mat or None).
+    """
+    tables = {}
+    if attr_onehot_mat is not None:
+        tables['attrs'] = np.stack([attr_onehot_mat[(attr_name)][0][0][0] for attr_name in attr_onehot_mat.dtype.names],
+                                   axis=1).astype(np.int64)
+    for name, attr_w2v_mat in attr_w2v_mats:
+        if attr_w2v_mat is not None:
+            tables[name] = np.concatenate([attr_w2v_mat[0][i] for i in xrange(attr_w2v_mat[0].shape[0])],
+                                          axis=1).astype(np.float32)
+    return tables
+
+
+## Version of _image_features, bump it to recompute the cached features after changing it
+_IMAGE_FEATURES_VERSION = 1
+
+
+def _image_features(folder_path, name, all_peaks_dic, subsets_dic):
+    """Returns the features of one image shared by all of its pairs, None if it has no pose."""
+    if (all_peaks_dic is None) or (name not in all_peaks_dic):
+        return None
+    image_raw = tf.gfile.FastGFile(os.path.join(folder_path, name), 'r').read()
+    height, width = image_cache.read_image_dims(image_raw)
+
+    ########################## Pose 16x8 & Pose coodinate (for 128x64(Solid) 128x64(Gaussian))##########################
+    ## Pose 16x8
+    w_unit = width/8
+    h_unit = height/16
+    pose_peaks = np.zeros([16,8,18])
+    ## Pose coodinate
+    pose_peaks_rcv = np.zeros([18,3]) ## Row, Column, Visibility
+
+    peaks = _get_valid_peaks(all_peaks_dic[name], subsets_dic[name])
+    indices_r4, values_r4, shape = _getSparsePose(peaks, height, width, 18, radius=4, mode='Solid')
+    indices_r4, shape = _oneDimSparsePose(indices_r4, shape)
+    pose_mask_r4 = _getPoseMask(peaks, height, width, radius=4, mode='Solid')
+    pose_mask_r7 = _getPoseMask(peaks, height, width, radius=7, mode='Solid')
+    for ii in range(len(peaks)):
+        p = peaks[ii]
+        if 0!=len(p):
+            pose_peaks[int(p[0][1]/h_unit), int(p[0][0]/w_unit), ii] = 1
+            pose_peaks_rcv[ii][0] = p[0][1]
+            pose_peaks_rcv[ii][1] = p[0][0]
+            pose_peaks_rcv[ii][2] = 1
+    ## Generate body region proposals
+    part_bbox_list, visibility_list = get_part_bbox37(peaks, radius=6)
+
+    return {'height': height, 'width': width,
+            'pose_peaks': pose_peaks, 'pose_peaks_rcv': pose_peaks_rcv,
+            'pose_mask_r4': pose_mask_r4.astype(np.uint8), 'pose_mask_r7': pose_mask_r7.astype(np.uint8),
+            'shape': shape, 'indices_r4': np.array(indices_r4, dtype=np.int64),
+            'values_r4': np.array(values_r4, dtype=np.float),
+            'pose_subs': np.array(subsets_dic[name][0].tolist()),
+            'part_bbox': np.array(part_bbox_list, dtype=np.int64), 'part_vis': np.array(visibility_list, dtype=np.int64)}
+
+
+def _format_data(folder_path, pairs, idx, labels, id_map, id_map_attr, features_cache, seg_data_dir,
+                 FiltOutMissRegion=False, FLIP=False):
     # Read the filename:
     img_path_0 = os.path.join(folder_path, pairs[idx][0])
     img_path_1 = os.path.join(folder_path, pairs[idx][1])
@@ -403,45 +386,6 @@ def _format_data(sess, image_reader, folder_path, pairs, idx, labels, id_map, at
     cam_0 = pairs[idx][0][6]
     cam_1 = pairs[idx][1][6]
 
-    image_raw_0 = tf.gfile.FastGFile(img_path_0, 'r').read()
-    image_raw_1 = tf.gfile.FastGFile(img_path_1, 'r').read()
-    height, width = image_reader.read_image_dims(sess, image_raw_0)
-
-    ########################## Attribute ##########################
-    attrs_0 = []
-    attrs_1 = []
-    attrs_w2v25_0 = []
-    attrs_w2v25_1 = []
-    attrs_w2v50_0 = []
-    attrs_w2v50_1 = []
-    attrs_w2v100_0 = []
-    attrs_w2v100_1 = []
-    attrs_w2v150_0 = []
-    attrs_w2v150_1 = []
-    idx_0 = id_map_attr[id_0]
-    idx_1 = id_map_attr[id_1]
-    # pdb.set_trace()
-    if attr_onehot_mat is not None:
-        for name in attr_onehot_mat.dtype.names:
-            attrs_0.append(attr_onehot_mat[(name)][0][0][0][idx_0])
-            attrs_1.append(attr_onehot_mat[(name)][0][0][0][idx_1])
-    if attr_w2v25_mat is not None:
-        for i in xrange(attr_w2v25_mat[0].shape[0]):
-            attrs_w2v25_0 = attrs_w2v25_0 + attr_w2v25_mat[0][i][idx_0].tolist()
-            attrs_w2v25_1 = attrs_w2v25_1 + attr_w2v25_mat[0][i][idx_1].tolist()
-    if attr_w2v50_mat is not None:
-        for i in xrange(attr_w2v50_mat[0].shape[0]):
-            attrs_w2v50_0 = attrs_w2v50_0 + attr_w2v50_mat[0][i][idx_0].tolist()
-            attrs_w2v50_1 = attrs_w2v50_1 + attr_w2v50_mat[0][i][idx_1].tolist()
-    if attr_w2v100_mat is not None:
-        for i in xrange(attr_w2v100_mat[0].shape[0]):
-            attrs_w2v100_0 = attrs_w2v100_0 + attr_w2v100_mat[0][i][idx_0].tolist()
-            attrs_w2v100_1 = attrs_w2v100_1 + attr_w2v100_mat[0][i][idx_1].tolist()
-    if attr_w2v150_mat is not None:
-        for i in xrange(attr_w2v150_mat[0].shape[0]):
-            attrs_w2v150_0 = attrs_w2v150_0 + attr_w2v150_mat[0][i][idx_0].tolist()
-            attrs_w2v150_1 = attrs_w2v150_1 + attr_w2v150_mat[0][i][idx_1].tolist()
-
     ########################## Segment ##########################
     seg_0 = np.zeros([128,64])
     seg_1 = np.zeros([128,64])
@@ -458,69 +402,16 @@ def _format_data(sess, image_reader, folder_path, pairs, idx, labels, id_map, at
         else:
             return None
 
-    ########################## Pose 16x8 & Pose coodinate (for 128x64(Solid) 128x64(Gaussian))##########################
-    ## Pose 16x8
-    w_unit = width/8
-    h_unit = height/16
-    pose_peaks_0 = np.zeros([16,8,18])
-    pose_peaks_1 = np.zeros([16,8,18])
-    ## Pose coodinate
-    pose_peaks_0_rcv = np.zeros([18,3]) ## Row, Column, Visibility
-    pose_peaks_1_rcv = np.zeros([18,3])
-    #
-    pose_subs_0 = []
-    pose_subs_1 = []
-    # pdb.set_trace()
-    if (all_peaks_dic is not None) and (pairs[idx][0] in all_peaks_dic) and (pairs[idx][1] in all_peaks_dic):
-        ###### Pose 0 ######
-        peaks = _get_valid_peaks(all_peaks_dic[pairs[idx][0]], subsets_dic[pairs[idx][0]])
-        indices_r4_0, values_r4_0, shape = _getSparsePose(peaks, height, width, 18, radius=4, mode='Solid')
-        indices_r4_0, shape_0 = _oneDimSparsePose(indices_r4_0, shape)
-        pose_mask_r4_0 = _getPoseMask(peaks, height, width, radius=4, mode='Solid')
-        pose_mask_r7_0 = _getPoseMask(peaks, height, width, radius=7, mode='Solid')
-        for ii in range(len(peaks)):
-            p = peaks[ii]
-            if 0!=len(p):
-                pose_peaks_0[int(p[0][1]/h_unit), int(p[0][0]/w_unit), ii] = 1
-                pose_peaks_0_rcv[ii][0] = p[0][1]
-                pose_peaks_0_rcv[ii][1] = p[0][0]
-                pose_peaks_0_rcv[ii][2] = 1
-        ## Generate body region proposals
-        # part_bbox_list_0, visibility_list_0 = get_part_bbox7(peaks, img_path_0, radius=6, idx=idx)
-        part_bbox_list_0, visibility_list_0 = get_part_bbox37(peaks, img_path_0, radius=6)
-        if FiltOutMissRegion and (0 in visibility_list_0):
-            return None
-
-        ###### Pose 1 ######
-        peaks = _get_valid_peaks(all_peaks_dic[pairs[idx][1]], subsets_dic[pairs[idx][1]])
-        indices_r4_1, values_r4_1, shape = _getSparsePose(peaks, height, width, 18, radius=4, mode='Solid')
-        indices_r4_1, shape_1 = _oneDimSparsePose(indices_r4_1, shape)
-        pose_mask_r4_1 = _getPoseMask(peaks, height, width, radius=4, mode='Solid')
-        pose_mask_r7_1 = _getPoseMask(peaks, height, width, radius=7, mode='Solid')
-        ## Generate body region proposals
-        # part_bbox_list_1, visibility_list_1 = get_part_bbox7(peaks, img_path_1, radius=7)
-        part_bbox_list_1, visibility_list_1 = get_part_bbox37(peaks, img_path_0, radius=6)
-        if FiltOutMissRegion and (0 in visibility_list_1):
-            return None
-
-        ###### Visualize ######
-        # dense = _sparse2dense(indices_r4_0, values_r4_0, shape)
-        # _visualizePose(pose_mask_r4_0, scipy.misc.imread(img_path_0))
-        # _visualizePose(pose_mask_r7_0, scipy.misc.imread(img_path_0))
-        # pdb.set_trace()
-
-        for ii in range(len(peaks)):
-            p = peaks[ii]
-            if 0!=len(p):
-                pose_peaks_1[int(p[0][1]/h_unit), int(p[0][0]/w_unit), ii] = 1
-                pose_peaks_1_rcv[ii][0] = p[0][1]
-                pose_peaks_1_rcv[ii][1] = p[0][0]
-                pose_peaks_1_rcv[ii][2] = 1
-        pose_subs_0 = subsets_dic[pairs[idx][0]][0].tolist()
-        pose_subs_1 = subsets_dic[pairs[idx][1]][0].tolist()
-    else:
+    ########################## Pose and body region proposals of both images ##########################
+    features_0 = features_cache.get(pairs[idx][0])
+    features_1 = features_cache.get(pairs[idx][1])
+    if (features_0 is None) or (features_1 is None):
+        return None
+    if FiltOutMissRegion and ((0 in features_0['part_vis']) or (0 in features_1['part_vis'])):
         return None
 
+    image_raw_0 = tf.gfile.FastGFile(img_path_0, 'r').read()
+    image_raw_1 = tf.gfile.FastGFile(img_path_1, 'r').read()
 
     example = tf.train.Example(features=tf.train.Features(feature={
             'image_name_0': dataset_utils.bytes_feature(pairs[idx][0]),
@@ -533,44 +424,37 @@ def _format_data(sess, image_reader, folder_path, pairs, idx, labels, id_map, at
             'cam_0': dataset_utils.int64_feature(int(cam_0)),
             'cam_1': dataset_utils.int64_feature(int(cam_1)),
             'image_format': dataset_utils.bytes_feature('jpg'),
-            'image_height': dataset_utils.int64_feature(height),
-            'image_width': dataset_utils.int64_feature(width),
+            'image_height': dataset_utils.int64_feature(int(features_0['height'])),
+            'image_width': dataset_utils.int64_feature(int(features_0['width'])),
             'real_data': dataset_utils.int64_feature(1),
-            'attrs_0': dataset_utils.int64_feature(attrs_0),
-            'attrs_1': dataset_utils.int64_feature(attrs_1),
-            'attrs_w2v25_0': dataset_utils.float_feature(attrs_w2v25_0),
-            'attrs_w2v25_1': dataset_utils.float_feature(attrs_w2v25_1),
-            'attrs_w2v50_0': dataset_utils.float_feature(attrs_w2v50_0),
-            'attrs_w2v50_1': dataset_utils.float_feature(attrs_w2v50_1),
-            'attrs_w2v100_0': dataset_utils.float_feature(attrs_w2v100_0),
-            'attrs_w2v100_1': dataset_utils.float_feature(attrs_w2v100_1),
-            'attrs_w2v150_0': dataset_utils.float_feature(attrs_w2v150_0),
-            'attrs_w2v150_1': dataset_utils.float_feature(attrs_w2v150_1),
-            'pose_peaks_0': dataset_utils.float_feature(pose_peaks_0.flatten().tolist()),
-            'pose_peaks_1': dataset_utils.float_feature(pose_peaks_1.flatten().tolist()),
-            'pose_peaks_0_rcv': dataset_utils.float_feature(pose_peaks_0_rcv.flatten().tolist()),
-            'pose_peaks_1_rcv': dataset_utils.float_feature(pose_peaks_1_rcv.flatten().tolist()),
-            'pose_mask_r4_0': dataset_utils.int64_feature(pose_mask_r4_0.astype(np.int64).flatten().tolist()),
-            'pose_mask_r4_1': dataset_utils.int64_feature(pose_mask_r4_1.astype(np.int64).flatten().tolist()),
-            'pose_mask_r6_0': dataset_utils.int64_feature(pose_mask_r7_0.astype(np.int64).flatten().tolist()),
-            'pose_mask_r6_1': dataset_utils.int64_feature(pose_mask_r7_1.astype(np.int64).flatten().tolist()),
+            ## Rows of the attribute table of the split, see attribute_table
+            'attr_id_0': dataset_utils.int64_feature(id_map_attr[id_0] if id_map_attr else -1),
+            'attr_id_1': dataset_utils.int64_feature(id_map_attr[id_1] if id_map_attr else -1),
+            'pose_peaks_0': dataset_utils.float_feature(features_0['pose_peaks'].flatten().tolist()),
+            'pose_peaks_1': dataset_utils.float_feature(features_1['pose_peaks'].flatten().tolist()),
+            'pose_peaks_0_rcv': dataset_utils.float_feature(features_0['pose_peaks_rcv'].flatten().tolist()),
+            'pose_peaks_1_rcv': dataset_utils.float_feature(features_1['pose_peaks_rcv'].flatten().tolist()),
+            'pose_mask_r4_0_packed': dataset_utils.bytes_feature(mask_codec.pack_mask(features_0['pose_mask_r4'])),
+            'pose_mask_r4_1_packed': dataset_utils.bytes_feature(mask_codec.pack_mask(features_1['pose_mask_r4'])),
+            'pose_mask_r6_0_packed': dataset_utils.bytes_feature(mask_codec.pack_mask(features_0['pose_mask_r7'])),
+            'pose_mask_r6_1_packed': dataset_utils.bytes_feature(mask_codec.pack_mask(features_1['pose_mask_r7'])),
             'seg_0': dataset_utils.int64_feature(seg_0.astype(np.int64).flatten().tolist()),
             'seg_1': dataset_utils.int64_feature(seg_1.astype(np.int64).flatten().tolist()),
 
-            'shape': dataset_utils.int64_feature(shape_0),
+            'shape': dataset_utils.int64_feature(int(features_0['shape'])),
             
-            'indices_r4_0': dataset_utils.int64_feature(np.array(indices_r4_0).astype(np.int64).flatten().tolist()),
-            'values_r4_0': dataset_utils.float_feature(np.array(values_r4_0).astype(np.float).flatten().tolist()),
-            'indices_r4_1': dataset_utils.int64_feature(np.array(indices_r4_1).astype(np.int64).flatten().tolist()),
-            'values_r4_1': dataset_utils.float_feature(np.array(values_r4_1).astype(np.float).flatten().tolist()),
-
-            'pose_subs_0': dataset_utils.float_feature(pose_subs_0),
-            'pose_subs_1': dataset_utils.float_feature(pose_subs_1),
-
-            'part_bbox_0': dataset_utils.int64_feature(np.array(part_bbox_list_0).astype(np.int64).flatten().tolist()),
-            'part_bbox_1': dataset_utils.int64_feature(np.array(part_bbox_list_1).astype(np.int64).flatten().tolist()),
-            'part_vis_0': dataset_utils.int64_feature(np.array(visibility_list_0).astype(np.int64).flatten().tolist()),
-            'part_vis_1': dataset_utils.int64_feature(np.array(visibility_list_1).astype(np.int64).flatten().tolist()),
+            'indices_r4_0': dataset_utils.int64_feature(features_0['indices_r4'].flatten().tolist()),
+            'values_r4_0': dataset_utils.float_feature(features_0['values_r4'].flatten().tolist()),
+            'indices_r4_1': dataset_utils.int64_feature(features_1['indices_r4'].flatten().tolist()),
+            'values_r4_1': dataset_utils.float_feature(features_1['values_r4'].flatten().tolist()),
+
+            'pose_subs_0': dataset_utils.float_feature(features_0['pose_subs'].tolist()),
+            'pose_subs_1': dataset_utils.float_feature(features_1['pose_subs'].tolist()),
+
+            'part_bbox_0': dataset_utils.int64_feature(features_0['part_bbox'].flatten().tolist()),
+            'part_bbox_1': dataset_utils.int64_feature(features_1['part_bbox'].flatten().tolist()),
+            'part_vis_0': dataset_utils.int64_feature(features_0['part_vis'].flatten().tolist()),
+            'part_vis_1': dataset_utils.int64_feature(features_1['part_vis'].flatten().tolist()),
     }))
 
     return example
@@ -730,7 +614,8 @@ def get_part_bbox37(peaks, img_path=None, radius=7, idx=None):
 
 def _convert_dataset_one_pair_rec_withFlip(out_dir, split_name, split_name_flip, pairs, pairs_flip, labels, labels_flip, dataset_dir, 
             attr_onehot_mat_path=None, attr_w2v_dir=None, pose_peak_path=None, pose_sub_path=None, pose_peak_path_flip=None, 
-            pose_sub_path_flip=None, seg_dir=None, tf_record_pair_num=np.inf):
+            pose_sub_path_flip=None, seg_dir=None, tf_record_pair_num=np.inf,
+            num_shards=_NUM_SHARDS, num_workers=1, layout='pair'):
     """Converts the given pairs to a TFRecord dataset.
 
     Args:
@@ -738,23 +623,28 @@ def _convert_dataset_one_pair_rec_withFlip(out_dir, split_name, split_name_flip,
         pairs: A list of image name pairs.
         labels: label list to indicate positive(1) or negative(0)
         dataset_dir: The directory where the converted datasets are stored.
+        num_shards: The number of TFRecord files the pairs are split into.
+        num_workers: The number of processes converting shards in parallel.
+        layout: 'pair' for one example per pair, 'image' for one example per
+            image plus an int32 pair index, see image_store.
     """
     if split_name_flip is None:
         USE_FLIP = False
     else:
         USE_FLIP = True
 
-    # num_shards = _NUM_SHARDS
-    num_shards = 1
     assert split_name in ['train', 'test', 'test_samples', 'all']
-    num_per_shard = int(math.ceil(len(pairs) / float(num_shards)))
     folder_path = _get_folder_path(dataset_dir, split_name)
     if USE_FLIP:
         folder_path_flip = _get_folder_path(dataset_dir, split_name_flip)
 
     # Load attr mat file
     attr_onehot_mat = None
-    attr_w2v_mat = None
+    attr_w2v25_mat = None
+    attr_w2v50_mat = None
+    attr_w2v100_mat = None
+    attr_w2v150_mat = None
+    id_map_attr = None
     if attr_onehot_mat_path or attr_w2v_dir:
         assert split_name in ['train', 'test', 'test_samples']
         id_cnt = 0
@@ -842,48 +732,71 @@ def _convert_dataset_one_pair_rec_withFlip(out_dir, split_name, split_name_flip,
                 id_cnt += 1
         print('id_map_flip length:%d' % len(id_map_flip))
 
-    with tf.Graph().as_default():
-        image_reader = ImageReader()
-
-        with tf.Session('') as sess:
-
-            for shard_id in range(num_shards):
-                output_filename = _get_dataset_filename(
-                        dataset_dir, out_dir, split_name, shard_id)
-
-                with tf.python_io.TFRecordWriter(output_filename) as tfrecord_writer:
-                    cnt = 0
-
-                    if USE_FLIP:
-                        start_ndx = shard_id * num_per_shard
-                        end_ndx = min((shard_id+1) * num_per_shard, len(pairs_flip))
-                        for i in range(start_ndx, end_ndx):
-                            sys.stdout.write('\r>> Converting image %d/%d shard %d' % (
-                                    i+1, len(pairs_flip), shard_id))
-                            sys.stdout.flush()
-                            example = _format_data(sess, image_reader, folder_path_flip, pairs_flip, i, labels_flip, id_map_flip, attr_onehot_mat, 
-                                attr_w2v25_mat, attr_w2v50_mat, attr_w2v100_mat, attr_w2v150_mat, id_map_attr, all_peaks_dic_flip, subsets_dic_flip, seg_data_dir, FLIP=True)
-                            if None==example:
-                                continue
-                            tfrecord_writer.write(example.SerializeToString())
-                            cnt += 1
-                            if cnt==tf_record_pair_num:
-                                break
-
-                    start_ndx = shard_id * num_per_shard
-                    end_ndx = min((shard_id+1) * num_per_shard, len(pairs))
-                    for i in range(start_ndx, end_ndx):
-                        sys.stdout.write('\r>> Converting image %d/%d shard %d' % (
-                                i+1, len(pairs), shard_id))
-                        sys.stdout.flush()
-                        example = _format_data(sess, image_reader, folder_path, pairs, i, labels, id_map, attr_onehot_mat, 
-                            attr_w2v25_mat, attr_w2v50_mat, attr_w2v100_mat, attr_w2v150_mat, id_map_attr, all_peaks_dic, subsets_dic, seg_data_dir, FLIP=False)
-                        if None==example:
-                            continue
-                        tfrecord_writer.write(example.SerializeToString())
-                        cnt += 1
-                        if cnt==tf_record_pair_num:
-                            break
+    ## Attributes once per identity, the examples only hold their row
+    if id_map_attr is not None:
+        attribute_table.save_attribute_table(out_dir, split_name.split('_')[0], _attribute_tables(
+                attr_onehot_mat, [('attrs_w2v25', attr_w2v25_mat), ('attrs_w2v50', attr_w2v50_mat),
+                                  ('attrs_w2v100', attr_w2v100_mat), ('attrs_w2v150', attr_w2v150_mat)]))
+
+    ## Features of every image computed once, in parallel, then assembled per pair
+    features_cache = image_cache.ImageFeatureCache(
+            os.path.join(out_dir, 'image_cache_' + split_name),
+            image_cache.inputs_fingerprint([pose_peak_path, pose_sub_path],
+                                           [str(_IMAGE_FEATURES_VERSION), folder_path]))
+    features_cache.build([name for pair in pairs for name in pair],
+                         lambda name: _image_features(folder_path, name, all_peaks_dic, subsets_dic),
+                         num_workers)
+    if USE_FLIP:
+        features_cache_flip = image_cache.ImageFeatureCache(
+                os.path.join(out_dir, 'image_cache_' + split_name_flip),
+                image_cache.inputs_fingerprint([pose_peak_path_flip, pose_sub_path_flip],
+                                               [str(_IMAGE_FEATURES_VERSION), folder_path_flip]))
+        features_cache_flip.build([name for pair in pairs_flip for name in pair],
+                                  lambda name: _image_features(folder_path_flip, name, all_peaks_dic_flip,
+                                                               subsets_dic_flip),
+                                  num_workers)
+
+    def format_item(use_flip, idx):
+        if use_flip:
+            return _format_data(folder_path_flip, pairs_flip, idx, labels_flip, id_map_flip, id_map_attr,
+                                features_cache_flip, seg_data_dir, FLIP=True)
+        return _format_data(folder_path, pairs, idx, labels, id_map, id_map_attr, features_cache, seg_data_dir,
+                            FLIP=False)
+
+    def item_has_features(use_flip, idx):
+        cache, item_pairs = (features_cache_flip, pairs_flip) if use_flip else (features_cache, pairs)
+        return cache.has_features(item_pairs[idx][0]) and cache.has_features(item_pairs[idx][1])
+
+    def item_key(use_flip, idx):
+        if use_flip:
+            return 'flip %s %s %s' % (pairs_flip[idx][0], pairs_flip[idx][1], labels_flip[idx])
+        return '%s %s %s' % (pairs[idx][0], pairs[idx][1], labels[idx])
+
+    if 'image' == layout:
+        ## Every image once and an int32 pair index, flipped pairs first
+        sources = [(split_name, folder_path, features_cache, pairs, labels)]
+        if USE_FLIP:
+            sources = [(split_name_flip, folder_path_flip, features_cache_flip, pairs_flip, labels_flip)] + sources
+        cnt = image_store.write_image_store(out_dir, 'Market1501', split_name.split('_')[0], sources, tf_record_pair_num,
+                                            num_shards, num_workers)
+    else:
+        ## Flipped pairs first, then the pairs, split into shards converted in parallel
+        items = [(False, i) for i in range(len(pairs))]
+        if USE_FLIP:
+            items = [(True, i) for i in range(len(pairs_flip))] + items
+        ## The limit holds the first pairs with features, whatever the number of shards, as in the image layout
+        items = [item for item in items if item_has_features(*item)]
+        if len(items) > tf_record_pair_num:
+            items = items[:int(tf_record_pair_num)]
+        _SHARD_CONTEXT.clear()
+        _SHARD_CONTEXT.update(items=items, format_item=format_item)
+
+        output_filenames = [_get_dataset_filename(dataset_dir, out_dir, split_name, shard_id, num_shards)
+                            for shard_id in range(num_shards)]
+        shards = shard_writer.make_shards(output_filenames, [item_key(use_flip, i) for use_flip, i in items])
+        counts = shard_writer.run_shards(shards, _convert_shard, num_workers)
+        shard_writer.write_manifest(out_dir, split_name.split('_')[0], shards, counts)
+        cnt = sum(counts)
 
     sys.stdout.write('\n')
     sys.stdout.flush()
@@ -891,7 +804,30 @@ def _convert_dataset_one_pair_rec_withFlip(out_dir, split_name, split_name_flip,
     with open(os.path.join(out_dir,'tf_record_pair_num.txt'),'w') as f:
         f.write('cnt:%d' % cnt)
 
-def run_one_pair_rec(dataset_dir, out_dir, split_name):
+
+## Items and formatting function of the conversion, inherited by forked workers
+_SHARD_CONTEXT = {}
+
+
+def _convert_shard(shard):
+    """Converts the items of one shard."""
+    items = _SHARD_CONTEXT['items']
+    format_item = _SHARD_CONTEXT['format_item']
+
+    def serialized_examples():
+        for i in range(shard['start'], shard['end']):
+            sys.stdout.write('\r>> Converting image %d/%d shard %d' % (
+                    i+1, len(items), shard['shard_id']))
+            sys.stdout.flush()
+            example = format_item(items[i][0], items[i][1])
+            if None==example:
+                continue
+            yield example.SerializeToString()
+
+    return shard_writer.write_shard(shard, serialized_examples())
+
+
+def run_one_pair_rec(dataset_dir, out_dir, split_name, num_shards=_NUM_SHARDS, num_workers=1, layout='pair'):
     # if not tf.gfile.Exists(dataset_dir):
     #     tf.gfile.MakeDirs(dataset_dir)
     
@@ -934,7 +870,8 @@ def run_one_pair_rec(dataset_dir, out_dir, split_name):
         # os.remove(os.path.join(out_dir, 'pn_pairs_num_train_flip.p'))
         
         _convert_dataset_one_pair_rec_withFlip(out_dir, split_name, split_name_flip, pairs, pairs_flip, labels, labels_flip, dataset_dir, attr_onehot_mat_path=attr_onehot_mat_path,
-            attr_w2v_dir=attr_w2v_dir, pose_peak_path=pose_peak_path, pose_sub_path=pose_sub_path, pose_peak_path_flip=pose_peak_path_flip, pose_sub_path_flip=pose_sub_path_flip)
+            attr_w2v_dir=attr_w2v_dir, pose_peak_path=pose_peak_path, pose_sub_path=pose_sub_path, pose_peak_path_flip=pose_peak_path_flip, pose_sub_path_flip=pose_sub_path_flip,
+            num_shards=num_shards, num_workers=num_workers, layout=layout)
 
         print('\nTrain convert Finished !')
 
@@ -963,7 +900,8 @@ def run_one_pair_rec(dataset_dir, out_dir, split_name):
         pairs_flip = None
         labels_flip = None
         _convert_dataset_one_pair_rec_withFlip(out_dir, split_name, split_name_flip, pairs, pairs_flip, labels, labels_flip, dataset_dir, attr_onehot_mat_path=attr_onehot_mat_path,
-            attr_w2v_dir=attr_w2v_dir, pose_peak_path=pose_peak_path, pose_sub_path=pose_sub_path, tf_record_pair_num=12800)
+            attr_w2v_dir=attr_w2v_dir, pose_peak_path=pose_peak_path, pose_sub_path=pose_sub_path, tf_record_pair_num=12800,
+            num_shards=num_shards, num_workers=num_workers, layout=layout)
 
         print('\nTest convert Finished !')
 
@@ -989,7 +927,8 @@ def run_one_pair_rec(dataset_dir, out_dir, split_name):
         pairs_flip = None
         labels_flip = None        
         _convert_dataset_one_pair_rec_withFlip(out_dir, split_name, split_name_flip, pairs, pairs_flip, labels, labels_flip, dataset_dir, attr_onehot_mat_path=attr_onehot_mat_path,
-            attr_w2v_dir=attr_w2v_dir, pose_peak_path=pose_peak_path, pose_sub_path=pose_sub_path)
+            attr_w2v_dir=attr_w2v_dir, pose_peak_path=pose_peak_path, pose_sub_path=pose_sub_path,
+            num_shards=num_shards, num_workers=num_workers, layout=layout)
 
         print('\nTest_sample convert Finished !')
 
@@ -1001,4 +940,7 @@ if __name__ == '__main__':
     out_dir = os.path.join(dataset_dir, 'Market_%s_data'%split_name)
     if not os.path.exists(out_dir):
         os.mkdir(out_dir)
-    run_one_pair_rec(dataset_dir, out_dir, split_name)
+    num_shards = int(sys.argv[3]) if len(sys.argv) > 3 else _NUM_SHARDS  ## number of tfrecord files
+    num_workers = int(sys.argv[4]) if len(sys.argv) > 4 else 1  ## number of conversion processes
+    layout = sys.argv[5] if len(sys.argv) > 5 else 'pair'  ## 'pair' or 'image', see image_store
+    run_one_pair_rec(dataset_dir, out_dir, split_name, num_shards, num_workers, layout)
@@ -0,0 +1,151 @@
+"""Per-image feature cache of the PG2 dataset converters.
+
+Every image is in many pairs. Its pose maps, masks and part boxes are computed
+once, in a parallel pre-pass, and stored as one npz file per image in the
+cache directory. The per-pair conversion only loads and assembles them.
+The cache directory holds the fingerprint of the inputs of the features (the
+pose files and the version of the feature code). The cached images are
+removed when the cache is opened with another fingerprint.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import struct
+
+import numpy as np
+
+## JPEG start of frame markers, they hold the image size
+_SOF_MARKERS = set(range(0xc0, 0xd0)) - set([0xc4, 0xc8, 0xcc])
+
+
+def read_image_dims(image_data):
+    """Returns (height, width) of JPEG or PNG data, read from its header without decoding."""
+    if image_data[:8] == b'\x89PNG\r\n\x1a\n':
+        width, height = struct.unpack('>II', image_data[16:24])
+        return height, width
+    if image_data[:2] != b'\xff\xd8':
+        raise ValueError('Not a JPEG or PNG image')
+    pos = 2
+    while pos + 4 <= len(image_data):
+        if image_data[pos:pos + 1] != b'\xff':
+            raise ValueError('Corrupt JPEG header')
+        marker = ord(image_data[pos + 1:pos + 2])
+        if marker == 0xff:
+            pos += 1
+        elif marker == 0x01 or 0xd0 <= marker <= 0xd8:
+            pos += 2
+        elif marker in _SOF_MARKERS:
+            height, width = struct.unpack('>HH', image_data[pos + 5:pos + 9])
+            return height, width
+        else:
+            pos += 2 + struct.unpack('>H', image_data[pos + 2:pos + 4])[0]
+    raise ValueError('JPEG without frame header')
+
+
+def inputs_fingerprint(file_paths, keys):
+    """Returns the sha1 of the contents of the input files and a list of key strings."""
+    sha1 = hashlib.sha1('\n'.join(keys).encode('utf-8'))
+    for path in file_paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+## Cache and feature function of a build, inherited by forked workers
+_BUILD_CONTEXT = {}
+
+
+def _build_one(name):
+    cache = _BUILD_CONTEXT['cache']
+    cache.put(name, _BUILD_CONTEXT['compute_features'](name))
+
+
+class ImageFeatureCache(object):
+    """Features of images by name, one npz file per image in cache_dir.
+
+    An image without features (compute_features returned None) has an empty
+    '.none' file instead. If the fingerprint of the inputs differs from the
+    one of the cached images, they are removed.
+    """
+
+    def __init__(self, cache_dir, fingerprint):
+        self.cache_dir = cache_dir
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        fingerprint_path = os.path.join(cache_dir, 'fingerprint.json')
+        cached_fingerprint = None
+        if os.path.exists(fingerprint_path):
+            with open(fingerprint_path) as f:
+                cached_fingerprint = json.load(f)['fingerprint']
+        if cached_fingerprint != fingerprint:
+            stale = glob.glob(os.path.join(cache_dir, '*.npz')) + glob.glob(os.path.join(cache_dir, '*.none'))
+            if stale:
+                print('inputs of the feature cache %s changed, removing %d cached images' % (cache_dir, len(stale)))
+            for path in stale:
+                os.remove(path)
+            with open(fingerprint_path + '.tmp', 'w') as f:
+                json.dump({'fingerprint': fingerprint}, f)
+            os.rename(fingerprint_path + '.tmp', fingerprint_path)
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name + '.npz')
+
+    def _none_path(self, name):
+        return os.path.join(self.cache_dir, name + '.none')
+
+    def __contains__(self, name):
+        return os.path.exists(self._path(name)) or os.path.exists(self._none_path(name))
+
+    def has_features(self, name):
+        """Whether the image is cached with features."""
+        return os.path.exists(self._path(name))
+
+    def put(self, name, features):
+        """Stores a dict of arrays, or None, as the features of an image."""
+        if features is None:
+            open(self._none_path(name), 'w').close()
+            return
+        tmp_path = os.path.join(self.cache_dir, name + '.tmp.npz')
+        np.savez_compressed(tmp_path, **features)
+        os.rename(tmp_path, self._path(name))
+
+    def get(self, name):
+        """Returns the dict of arrays of an image, None if it has no features."""
+        if os.path.exists(self._none_path(name)):
+            return None
+        with np.load(self._path(name)) as data:
+            return dict((key, data[key]) for key in data.files)
+
+    def build(self, names, compute_features, num_workers=1):
+        """Computes the features of the images that are not cached yet.
+
+        Args:
+            names: Image names, duplicates are computed once.
+            compute_features: A function returning a dict of arrays or None for
+                an image name. With num_workers > 1 it runs in forked worker
+                processes.
+            num_workers: The number of worker processes.
+        """
+        todo = sorted(name for name in set(names) if name not in self)
+        print('computing features of %d images, %d are cached' % (len(todo), len(set(names)) - len(todo)))
+        _BUILD_CONTEXT.update(cache=self, compute_features=compute_features)
+        if num_workers > 1 and len(todo) > 1:
+            pool = multiprocessing.Pool(num_workers)
+            try:
+                for _ in pool.imap_unordered(_build_one, todo, chunksize=64):
+                    pass
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for name in todo:
+                _build_one(name)
@@ -0,0 +1,182 @@
+"""Image-level TFRecords plus a pair index, the 'image' layout of a converted split.
+
+A pair example stores the JPEG bytes, sparse poses and masks of both of its
+images, and every image is in many pairs. In the image layout every image is
+stored once, in the shards '<data_name>_<split>-images_*.tfrecord', and the
+pairs are an int32 pair table '<data_name>_<split>-pairs' (see pair_table.py)
+indexing into the image keys. Image keys are '<image split>/<name>', so the
+flipped copy of an image is a different image.
+
+With --data_layout image the trainer loads the image records of a split once
+into memory with ImageStore and joins them with the pairs at read time. The
+default --data_layout pair reads the pair TFRecords even if both layouts exist.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+
+import numpy as np
+import tensorflow as tf
+
+try:
+    import dataset_utils
+    import mask_codec
+    import pair_table
+    import shard_writer
+except:
+    from datasets import dataset_utils
+    from datasets import mask_codec
+    from datasets import pair_table
+    from datasets import shard_writer
+
+_IMAGES_FILE_PATTERN = '%s_%s-images_%05d-of-%05d.tfrecord'
+_PAIRS_PREFIX = '%s_%s-pairs'
+
+
+def image_key(image_split, name):
+    return image_split + '/' + name
+
+
+def pairs_prefix(dataset_dir, data_name, split_name):
+    return os.path.join(dataset_dir, _PAIRS_PREFIX % (data_name, split_name))
+
+
+def has_image_store(dataset_dir, data_name, split_name):
+    """Whether the split was converted with the image layout."""
+    return (pair_table.is_pair_table(pairs_prefix(dataset_dir, data_name, split_name)) and
+            shard_writer.read_manifest(dataset_dir, split_name + '-images') is not None)
+
+
+def image_example(key, image_raw, features):
+    """Returns the tf.train.Example of one image and its cached features."""
+    return tf.train.Example(features=tf.train.Features(feature={
+            'image_key': dataset_utils.bytes_feature(key),
+            'image_raw': dataset_utils.bytes_feature(image_raw),
+            'image_format': dataset_utils.bytes_feature('jpg'),
+            'image_height': dataset_utils.int64_feature(int(features['height'])),
+            'image_width': dataset_utils.int64_feature(int(features['width'])),
+            'shape': dataset_utils.int64_feature(int(features['shape'])),
+            'indices_r4': dataset_utils.int64_feature(features['indices_r4'].flatten().tolist()),
+            'values_r4': dataset_utils.float_feature(features['values_r4'].flatten().tolist()),
+            'pose_mask_r4_packed': dataset_utils.bytes_feature(mask_codec.pack_mask(features['pose_mask_r4'])),
+    }))
+
+
+## Images of the conversion, inherited by forked workers
+_STORE_CONTEXT = {}
+
+
+def _convert_images_shard(shard):
+    """Converts the images of one shard."""
+    images = _STORE_CONTEXT['images']
+
+    def serialized_examples():
+        for i in range(shard['start'], shard['end']):
+            sys.stdout.write('\r>> Converting image %d/%d shard %d' % (
+                    i+1, len(images), shard['shard_id']))
+            sys.stdout.flush()
+            key, folder_path, features_cache, name = images[i]
+            image_raw = tf.gfile.FastGFile(os.path.join(folder_path, name), 'r').read()
+            yield image_example(key, image_raw, features_cache.get(name)).SerializeToString()
+
+    return shard_writer.write_shard(shard, serialized_examples())
+
+
+def write_image_store(out_dir, data_name, split_name, sources, tf_record_pair_num=np.inf, num_shards=1,
+                      num_workers=1):
+    """Writes the image shards and the pair index of a split.
+
+    Args:
+        out_dir: The directory of the converted split.
+        data_name: 'Market1501' or 'DeepFashion'.
+        split_name: The split name used by get_split, e.g. 'train'.
+        sources: A list of (image_split, folder_path, features_cache, pairs,
+            labels), the pairs of the sources are indexed in this order.
+            Pairs with an image without features are left out.
+        tf_record_pair_num: The maximum number of pairs.
+        num_shards: The number of image TFRecord files.
+        num_workers: The number of processes converting shards in parallel.
+
+    Returns:
+        The number of pairs.
+    """
+    images = []
+    index = {}
+    pairs_index = []
+    flags = []
+    for image_split, folder_path, features_cache, pairs, labels in sources:
+        for pair, label in zip(pairs, labels):
+            if len(pairs_index) >= tf_record_pair_num:
+                break
+            if not (features_cache.has_features(pair[0]) and features_cache.has_features(pair[1])):
+                continue
+            pair_index = []
+            for name in pair:
+                key = image_key(image_split, name)
+                if key not in index:
+                    index[key] = len(images)
+                    images.append((key, folder_path, features_cache, name))
+                pair_index.append(index[key])
+            pairs_index.append(pair_index)
+            flags.append(pair_table.FLAG_POSITIVE if 1 == label else 0)
+
+    _STORE_CONTEXT.clear()
+    _STORE_CONTEXT.update(images=images)
+    output_filenames = [os.path.join(out_dir, _IMAGES_FILE_PATTERN % (data_name, split_name, shard_id, num_shards))
+                        for shard_id in range(num_shards)]
+    shards = shard_writer.make_shards(output_filenames, [image[0] for image in images])
+    counts = shard_writer.run_shards(shards, _convert_images_shard, num_workers)
+    shard_writer.write_manifest(out_dir, split_name + '-images', shards, counts)
+
+    pair_table.save_pair_table(pairs_prefix(out_dir, data_name, split_name), [image[0] for image in images],
+                               np.array(pairs_index, dtype=np.int32).reshape((-1, 2)), flags)
+    print('\n%d images, %d pairs' % (len(images), len(pairs_index)))
+    return len(pairs_index)
+
+
+class ImageStore(object):
+    """The image records of a split in memory, in the order of its pair index.
+
+    lookup(index_0, index_1) returns the JPEG bytes, sparse pose indices and
+    values, packed masks and names of both images of a pair, it is called from
+    the input pipeline through tf.py_func.
+    """
+
+    def __init__(self, dataset_dir, data_name, split_name):
+        self.pairs = pair_table.PairTable(pairs_prefix(dataset_dir, data_name, split_name))
+        files, num_images = shard_writer.read_manifest(dataset_dir, split_name + '-images')
+        position = dict((key, i) for i, key in enumerate(self.pairs.names))
+        self.images = [None] * len(self.pairs.names)
+        for filename in files:
+            for record in tf.python_io.tf_record_iterator(filename):
+                feature = tf.train.Example.FromString(record).features.feature
+                key = feature['image_key'].bytes_list.value[0]
+                self.images[position[key]] = (
+                    feature['image_raw'].bytes_list.value[0],
+                    np.array(feature['indices_r4'].int64_list.value, dtype=np.int64),
+                    np.array(feature['values_r4'].float_list.value, dtype=np.float32),
+                    feature['pose_mask_r4_packed'].bytes_list.value[0],
+                    key.split('/', 1)[1])
+        assert num_images == len(self.images) and all(image is not None for image in self.images), \
+            'The image shards do not match the pair index in %s' % dataset_dir
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def lookup(self, index_0, index_1):
+        image_0, image_1 = self.images[index_0], self.images[index_1]
+        return (image_0[0], image_1[0], image_0[1], image_0[2], image_1[1], image_1[2], image_0[3], image_1[3],
+                image_0[4], image_1[4])
+
+    def lookup_tensors(self, index_0, index_1):
+        """Returns the tensors of lookup for the scalar int32 tensors index_0 and index_1."""
+        tensors = tf.py_func(self.lookup, [index_0, index_1],
+                             [tf.string, tf.string, tf.int64, tf.float32, tf.int64, tf.float32, tf.string, tf.string,
+                              tf.string, tf.string], stateful=False)
+        for tensor, shape in zip(tensors, [[], [], [None], [None], [None], [None], [], [], [], []]):
+            tensor.set_shape(shape)
+        return tensors
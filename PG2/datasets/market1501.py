@@ -26,6 +26,9 @@ import os
 import tensorflow as tf
 
 from datasets import dataset_utils
+from datasets import shard_writer
+from datasets import mask_codec
+from datasets import attribute_table
 import pickle
 import pdb
 
@@ -40,6 +43,8 @@ _NUM_CLASSES = 2
 _ITEMS_TO_DESCRIPTIONS = {
     'image_raw_0': 'A color image of varying size.',
     'image_raw_1': 'A color image of varying size.',
+    'image_name_0': 'File name of the first image of the pair.',
+    'image_name_1': 'File name of the second image of the pair.',
     'label': 'A single integer between 0 and 1',
     'id_0': 'A single integer',
     'id_1': 'A single integer',
@@ -79,6 +84,8 @@ def get_split(split_name, dataset_dir, data_name='Market1501', file_pattern=None
   keys_to_features = {
      'image_raw_0' : tf.FixedLenFeature([], tf.string),
      'image_raw_1' : tf.FixedLenFeature([], tf.string),
+     'image_name_0' : tf.FixedLenFeature([], tf.string, default_value=''),
+     'image_name_1' : tf.FixedLenFeature([], tf.string, default_value=''),
      'label': tf.FixedLenFeature([], tf.int64), # For FixedLenFeature, [] means scalar
      'id_0': tf.FixedLenFeature([], tf.int64),
      'id_1': tf.FixedLenFeature([], tf.int64),
@@ -106,6 +113,8 @@ def get_split(split_name, dataset_dir, data_name='Market1501', file_pattern=None
       'image_raw_0': slim.tfexample_decoder.Image(image_key='image_raw_0', format_key='image_format'),
       'image_raw_1': slim.tfexample_decoder.Image(image_key='image_raw_1', format_key='image_format'),
       'label': slim.tfexample_decoder.Tensor('label'),
+      'image_name_0': slim.tfexample_decoder.Tensor('image_name_0'),
+      'image_name_1': slim.tfexample_decoder.Tensor('image_name_1'),
       'id_0': slim.tfexample_decoder.Tensor('id_0'),
       'id_1': slim.tfexample_decoder.Tensor('id_1'),
       'pose_peaks_0': slim.tfexample_decoder.Tensor('pose_peaks_0',shape=[16*8*18]),
@@ -120,17 +129,27 @@ def get_split(split_name, dataset_dir, data_name='Market1501', file_pattern=None
       'pose_subs_1': slim.tfexample_decoder.Tensor('pose_subs_1',shape=[20]),
   }
 
-  decoder = slim.tfexample_decoder.TFExampleDecoder(
-      keys_to_features, items_to_handlers)
-
   labels_to_names = None
   if dataset_utils.has_labels(dataset_dir):
     labels_to_names = dataset_utils.read_label_file(dataset_dir)
 
-  print('load pn_pairs_num ......')
-  fpath = os.path.join(dataset_dir, 'pn_pairs_num_'+split_name+'.p')
-  with open(fpath,'r') as f:
-    pn_pairs_num = pickle.load(f)
+  manifest = shard_writer.read_manifest(dataset_dir, split_name)
+  if manifest is not None:
+    ## Shards and number of written examples of a sharded conversion
+    file_pattern, pn_pairs_num = manifest
+  else:
+    print('load pn_pairs_num ......')
+    fpath = os.path.join(dataset_dir, 'pn_pairs_num_'+split_name+'.p')
+    with open(fpath,'r') as f:
+      pn_pairs_num = pickle.load(f)
+
+  if mask_codec.has_packed_masks(file_pattern):
+    mask_codec.use_packed_masks(keys_to_features, items_to_handlers, ['pose_mask_r4_0', 'pose_mask_r4_1'], 128*64*1)
+  attribute_tables = attribute_table.load_attribute_table(dataset_dir, split_name)
+  if attribute_tables is not None:
+    attribute_table.use_attribute_table(keys_to_features, items_to_handlers, attribute_tables)
+  decoder = slim.tfexample_decoder.TFExampleDecoder(
+      keys_to_features, items_to_handlers)
 
   return slim.dataset.Dataset(
       data_sources=file_pattern,
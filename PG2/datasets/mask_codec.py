@@ -0,0 +1,74 @@
+"""Bit-packed binary masks of the PG2 records.
+
+A mask of 0 and 1 values is stored as the bytes of np.packbits of its
+flattened values under '<key>_packed', 1 bit per pixel instead of the 8 bytes
+of an int64_list. decode_mask unpacks it inside the graph to the same flat
+int64 tensor that the FixedLenFeature of the int64 list gives.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+slim = tf.contrib.slim
+
+PACKED_SUFFIX = '_packed'
+
+## Values of the bits of a byte in np.packbits order, most significant first
+_BIT_VALUES = [128, 64, 32, 16, 8, 4, 2, 1]
+
+
+def pack_mask(mask):
+    """Returns the bytes of a binary mask of any shape, flattened in C order."""
+    mask = np.asarray(mask).flatten()
+    assert np.all((mask == 0) | (mask == 1)), 'Only masks of 0 and 1 can be packed'
+    return np.packbits(mask.astype(np.uint8)).tobytes()
+
+
+def unpack_mask(data, size):
+    """Returns the flat uint8 mask of size values packed in data."""
+    return np.unpackbits(np.frombuffer(data, dtype=np.uint8))[:size]
+
+
+def decode_mask(packed, size, dtype=tf.int64):
+    """In-graph unpack_mask of a scalar string tensor, a flat tensor of size values."""
+    data = tf.cast(tf.decode_raw(packed, tf.uint8), tf.int32)
+    bits = tf.floormod(tf.floordiv(tf.expand_dims(data, 1), _BIT_VALUES), 2)
+    mask = tf.cast(tf.reshape(bits, [-1])[:size], dtype)
+    mask.set_shape([size])
+    return mask
+
+
+class PackedMask(slim.tfexample_decoder.ItemHandler):
+    """TFExampleDecoder handler of a packed mask, the decoded item equals
+    Tensor(key, shape=[size]) of the int64 list mask."""
+
+    def __init__(self, key, size):
+        super(PackedMask, self).__init__([key + PACKED_SUFFIX])
+        self._packed_key = key + PACKED_SUFFIX
+        self._size = size
+
+    def tensors_to_item(self, keys_to_tensors):
+        return decode_mask(keys_to_tensors[self._packed_key], self._size)
+
+
+def has_packed_masks(data_sources, key='pose_mask_r4_0'):
+    """Whether the first record of the data sources (a file pattern or a list
+    of files) stores the mask key packed."""
+    if not isinstance(data_sources, (tuple, list)):
+        data_sources = tf.gfile.Glob(data_sources)
+    for filename in data_sources:
+        for record in tf.python_io.tf_record_iterator(filename):
+            return key + PACKED_SUFFIX in tf.train.Example.FromString(record).features.feature
+    return False
+
+
+def use_packed_masks(keys_to_features, items_to_handlers, keys, size):
+    """Replaces the int64 list features and handlers of the mask keys by packed ones."""
+    for key in keys:
+        del keys_to_features[key]
+        keys_to_features[key + PACKED_SUFFIX] = tf.FixedLenFeature([], tf.string)
+        items_to_handlers[key] = PackedMask(key, size)
@@ -0,0 +1,27 @@
+"""
+    The pair table of common/pair_table.py, shared by Deform, PG2 and VUNet. It is loaded from its file, so no
+    other directory is put on the import path.
+"""
+import os
+
+_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common', 'pair_table.py')
+
+try:
+    from importlib.util import spec_from_file_location, module_from_spec
+    _spec = spec_from_file_location('common_pair_table', _PATH)
+    _module = module_from_spec(_spec)
+    _spec.loader.exec_module(_module)
+except ImportError:
+    import imp
+    _module = imp.load_source('common_pair_table', _PATH)
+
+FLAG_POSITIVE = _module.FLAG_POSITIVE
+FLAG_TEST = _module.FLAG_TEST
+manifest_fingerprint = _module.manifest_fingerprint
+table_prefix = _module.table_prefix
+is_pair_table = _module.is_pair_table
+save_pair_table = _module.save_pair_table
+PairTable = _module.PairTable
+pairs_from_csv = _module.pairs_from_csv
+load_pair_index = _module.load_pair_index
+load_pairs_frame = _module.load_pairs_frame
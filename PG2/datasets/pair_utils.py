@@ -0,0 +1,106 @@
+"""Positive and negative pair sampling with images bucketed by identity.
+
+Images are grouped by identity once. Positive pairs are the pairs inside every
+bucket, negative pairs are drawn with a fixed seed from pairs of different
+identities. Pairs are int32 arrays of indices into the image file list, saved
+as a pair table (see pair_table.py).
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+try:
+    import pair_table
+except:
+    from datasets import pair_table
+
+_RANDOM_SEED = 0
+
+
+def identity_buckets(ids):
+    """Returns a list of index arrays, one per identity, indices in increasing order."""
+    _, codes = np.unique(np.asarray(ids), return_inverse=True)
+    order = np.argsort(codes, kind='mergesort')
+    return np.split(order, np.flatnonzero(np.diff(codes[order])) + 1)
+
+
+def _camera_condition(cams, first, second, mode):
+    if cams is None or mode == 'same_diff_cam':
+        return np.ones(len(first), dtype=bool)
+    cams = np.asarray(cams)
+    if mode == 'diff_cam':
+        return cams[first] != cams[second]
+    elif mode == 'same_cam':
+        return cams[first] == cams[second]
+    raise ValueError('Unknown mode %s' % mode)
+
+
+def positive_pairs(ids, cams=None, mode='same_diff_cam', add_switch_pair=False):
+    """Returns pairs (i, j), i < j, of images with the same identity.
+
+    Pairs are ordered by i and then by j, as in a double loop over the file
+    list. mode selects pairs from different cameras ('diff_cam'), the same
+    camera ('same_cam') or both ('same_diff_cam'). With add_switch_pair every
+    pair (i, j) is followed by (j, i).
+    """
+    first, second = [], []
+    for members in identity_buckets(ids):
+        a, b = np.triu_indices(len(members), 1)
+        first.append(members[a])
+        second.append(members[b])
+    first = np.concatenate(first) if first else np.zeros(0, dtype=int)
+    second = np.concatenate(second) if second else np.zeros(0, dtype=int)
+
+    keep = _camera_condition(cams, first, second, mode)
+    first, second = first[keep], second[keep]
+    order = np.lexsort((second, first))
+    pairs = np.stack([first[order], second[order]], axis=1)
+    if add_switch_pair:
+        pairs = np.stack([pairs, pairs[:, ::-1]], axis=1).reshape((-1, 2))
+    return pairs.astype(np.int32)
+
+
+def negative_pairs(ids, number_of_pairs, cams=None, mode='same_diff_cam', random_state=_RANDOM_SEED,
+                   max_rounds=100):
+    """Returns number_of_pairs random pairs (i, j), i < j, of images with different identities.
+
+    Pairs are drawn uniformly with a fixed seed, pairs with the same identity or
+    not matching the camera mode are rejected. Fewer pairs are returned if not
+    enough are found in max_rounds rounds of sampling.
+    """
+    ids = np.asarray(ids)
+    rng = np.random.RandomState(random_state)
+    pairs = np.zeros((0, 2), dtype=np.int32)
+    for _ in range(max_rounds):
+        if len(pairs) >= number_of_pairs or len(ids) < 2:
+            break
+        size = 2 * (number_of_pairs - len(pairs))
+        first = rng.randint(0, len(ids), size)
+        second = rng.randint(0, len(ids), size)
+        keep = (ids[first] != ids[second]) & _camera_condition(cams, first, second, mode)
+        found = np.sort(np.stack([first[keep], second[keep]], axis=1), axis=1)
+        pairs = np.concatenate([pairs, found.astype(np.int32)])
+    return pairs[:number_of_pairs]
+
+
+def save_pairs(path, filelist, p_pairs, n_pairs):
+    """Saves the pairs as a pair table with prefix path, positive pairs first."""
+    flags = np.concatenate([np.full(len(p_pairs), pair_table.FLAG_POSITIVE, dtype=np.uint8),
+                            np.zeros(len(n_pairs), dtype=np.uint8)])
+    pair_table.save_pair_table(path, filelist, np.concatenate([p_pairs, n_pairs]), flags)
+
+
+def load_pairs(path):
+    """Returns the file list and the positive and negative pair arrays of a pair table."""
+    table = pair_table.PairTable(path)
+    positive = (table.flags & pair_table.FLAG_POSITIVE) > 0
+    return list(table.names), np.asarray(table.pairs[positive]), np.asarray(table.pairs[~positive])
+
+
+def to_names(filelist, pairs):
+    """Returns pairs as a list of [name_i, name_j] lists."""
+    filelist = np.asarray(filelist)
+    return filelist[pairs].tolist()
@@ -0,0 +1,147 @@
+"""Parallel, resumable conversion of a list of items into TFRecord shards.
+
+The items are split into contiguous shards. Every shard is written to a
+temporary file that is renamed when it is complete, then a '.done' marker with
+its example count is written next to it. The marker also records the item
+range and a fingerprint of the keys of the shard's items. A re-run skips the
+shards whose marker matches both, so a changed pair list, flip set or limit
+converts the shard again. The caller applies the pair limit to the item list
+before sharding, so the converted pairs do not depend on the number of shards.
+Shards are converted by a pool of worker processes. A manifest lists the shard files and their example counts, it is
+read by get_split instead of the number of pairs.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+
+import tensorflow as tf
+
+_MANIFEST_PATTERN = 'shards_%s.json'
+
+
+def shard_ranges(number_of_items, num_shards):
+    """Returns num_shards (start, end) ranges covering range(number_of_items)."""
+    num_per_shard = int(math.ceil(number_of_items / float(num_shards)))
+    return [(min(shard_id * num_per_shard, number_of_items), min((shard_id + 1) * num_per_shard, number_of_items))
+            for shard_id in range(num_shards)]
+
+
+def items_fingerprint(item_keys):
+    """Returns the sha1 of a list of item key strings."""
+    return hashlib.sha1('\n'.join(item_keys).encode('utf-8')).hexdigest()
+
+
+def _done_marker(shard):
+    return {'start': shard['start'], 'end': shard['end'], 'fingerprint': shard['fingerprint']}
+
+
+def _write_json(path, data):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.rename(path + '.tmp', path)
+
+
+def read_done(shard):
+    """Returns the example count of a completed shard, None if it has to be converted.
+
+    A shard is completed if its marker has the item range and item fingerprint
+    of the shard.
+    """
+    path = shard['output_filename'] + '.done'
+    if not (os.path.exists(path) and os.path.exists(shard['output_filename'])):
+        return None
+    with open(path) as f:
+        done = json.load(f)
+    count = done.pop('count')
+    if done != _done_marker(shard):
+        return None
+    return count
+
+
+def write_shard(shard, serialized_examples):
+    """Writes serialized examples to the shard file and commits it.
+
+    Args:
+        shard: A dict with 'output_filename', 'start', 'end' and 'fingerprint'.
+        serialized_examples: An iterable of serialized tf.train.Example.
+
+    Returns:
+        The number of written examples.
+    """
+    count = 0
+    with tf.python_io.TFRecordWriter(shard['output_filename'] + '.tmp') as tfrecord_writer:
+        for example in serialized_examples:
+            tfrecord_writer.write(example)
+            count += 1
+    os.rename(shard['output_filename'] + '.tmp', shard['output_filename'])
+    done = _done_marker(shard)
+    done['count'] = count
+    _write_json(shard['output_filename'] + '.done', done)
+    return count
+
+
+def make_shards(output_filenames, item_keys):
+    """Returns the shard dicts of the items, one per output file.
+
+    item_keys is a list of strings identifying the content of every item, e.g.
+    the names and label of a pair.
+    """
+    num_shards = len(output_filenames)
+    return [{'shard_id': shard_id, 'output_filename': output_filename, 'start': start, 'end': end,
+             'fingerprint': items_fingerprint(item_keys[start:end])}
+            for shard_id, (output_filename, (start, end))
+            in enumerate(zip(output_filenames, shard_ranges(len(item_keys), num_shards)))]
+
+
+def run_shards(shards, convert_shard, num_workers=1):
+    """Converts the shards that are not completed yet.
+
+    Args:
+        shards: A list of shard dicts from make_shards.
+        convert_shard: A picklable function converting one shard dict, it has
+            to call write_shard. With num_workers > 1 it runs in forked worker
+            processes, so it must not rely on a tf.Session of the parent.
+        num_workers: The number of worker processes.
+
+    Returns:
+        The list of example counts of all shards.
+    """
+    todo = [shard for shard in shards if read_done(shard) is None]
+    print('%d of %d shards are already converted' % (len(shards) - len(todo), len(shards)))
+    if num_workers > 1 and len(todo) > 1:
+        pool = multiprocessing.Pool(min(num_workers, len(todo)))
+        try:
+            for _ in pool.imap_unordered(convert_shard, todo):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for shard in todo:
+            convert_shard(shard)
+    return [read_done(shard) for shard in shards]
+
+
+def write_manifest(out_dir, split_name, shards, counts):
+    """Writes the manifest with the shard files and example counts of a split."""
+    _write_json(os.path.join(out_dir, _MANIFEST_PATTERN % split_name),
+                {'num_samples': sum(counts),
+                 'shards': [{'file': os.path.basename(shard['output_filename']), 'count': count}
+                            for shard, count in zip(shards, counts)]})
+
+
+def read_manifest(dataset_dir, split_name):
+    """Returns the shard file paths and the total example count of a split, None if there is no manifest."""
+    path = os.path.join(dataset_dir, _MANIFEST_PATTERN % split_name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    return [os.path.join(dataset_dir, shard['file']) for shard in manifest['shards']], manifest['num_samples']
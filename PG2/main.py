@@ -30,7 +30,10 @@ def main(config):
     else:
         # if not config.load_path:
         #     raise Exception("[!] You should specify `load_path` to load a pretrained model")
-        trainer.test()
+        if config.sweep:
+            trainer.sweep()
+        else:
+            trainer.test()
 
 if __name__ == "__main__":
     config, unparsed = get_config()
@@ -20,6 +20,26 @@ def l2_mean_dist(x,y):
     diff = x.astype(float)-y.astype(float)
     return np.sqrt(np.sum(diff**2))/np.product(x.shape)
 
+def load_pair_names(pairs_path, files):
+    ## (from, to) names of the saved images from trainer.test pairs.csv, file names if it is not there
+    names = {}
+    if os.path.exists(pairs_path):
+        with open(pairs_path, 'r') as f:
+            f.readline()
+            for line in f:
+                idx, name_0, name_1 = line.strip().split(',')
+                names[idx] = (name_0, name_1)
+    keys = [os.path.splitext(os.path.basename(path))[0] for path in files]
+    return [names.get(key, (key, key)) for key in keys]
+
+def save_per_sample(per_sample_path, pair_names, **columns):
+    columns['from'] = np.array([name[0] for name in pair_names])
+    columns['to'] = np.array([name[1] for name in pair_names])
+    for key in columns:
+        columns[key] = np.array(columns[key])
+    np.savez(per_sample_path, **columns)
+    print('per pair metrics saved to %s\n' % per_sample_path)
+
 # we need to set GPUno first, otherwise may out of memory
 stage_num = int(sys.argv[1])
 gpuNO = sys.argv[2]
@@ -33,6 +53,8 @@ if 1==stage_num:
     # test_result_dir_x = os.path.join(model_dir, test_mode, 'x')
     test_result_dir_G = os.path.join(model_dir, test_mode, 'G')
     score_path = os.path.join(model_dir, test_mode, 'score_rgb.txt')
+    pairs_path = os.path.join(model_dir, test_mode, 'pairs.csv')
+    per_sample_path = os.path.join(model_dir, test_mode, 'score_rgb_per_sample.npz')
 
     types = ('*.jpg', '*.png') # the tuple of file types
     x_files = []
@@ -41,6 +63,9 @@ if 1==stage_num:
     for files in types:
         x_files.extend(glob.glob(os.path.join(test_result_dir_x, files)))
         G_files.extend(glob.glob(os.path.join(test_result_dir_G, files)))
+    ## sorted, so that the i-th target and generated image belong to the same pair
+    x_files.sort()
+    G_files.sort()
 
     x_target_list = []
     for path in x_files:
@@ -102,11 +127,16 @@ if 1==stage_num:
         f.write('psnr: %.5f +- %.5f   ' % (psnr_G_x_mean, psnr_G_x_std))
         f.write('L1: %.5f +- %.5f   ' % (L1_G_x_mean, L1_G_x_std))
         f.write('L2: %.5f +- %.5f' % (L2_G_x_mean, L2_G_x_std))
+
+    save_per_sample(per_sample_path, load_pair_names(pairs_path, x_files),
+                    ssim=ssim_G_x, psnr=psnr_G_x, l1=L1_mean_G_x, l2=L2_mean_G_x)
 elif 2==stage_num:
     test_result_dir_x = os.path.join(model_dir, test_mode, 'x_target')
     test_result_dir_G1 = os.path.join(model_dir, test_mode, 'G1')
     test_result_dir_G2 = os.path.join(model_dir, test_mode, 'G2')
     score_path = os.path.join(model_dir, test_mode, 'score_rgb.txt') #
+    pairs_path = os.path.join(model_dir, test_mode, 'pairs.csv')
+    per_sample_path = os.path.join(model_dir, test_mode, 'score_rgb_per_sample.npz')
 
     types = ('*.jpg', '*.png') # the tuple of file types
     x_files = []
@@ -116,6 +146,10 @@ elif 2==stage_num:
         x_files.extend(glob.glob(os.path.join(test_result_dir_x, files)))
         G1_files.extend(glob.glob(os.path.join(test_result_dir_G1, files)))
         G2_files.extend(glob.glob(os.path.join(test_result_dir_G2, files)))
+    ## sorted, so that the i-th target and generated images belong to the same pair
+    x_files.sort()
+    G1_files.sort()
+    G2_files.sort()
     x_target_list = []
     for path in x_files:
         x_target_list.append(scipy.misc.imread(path))
@@ -164,6 +198,7 @@ elif 2==stage_num:
     print('L1_G1_x_std: %f\n' % L1_G1_x_std)
     print('L2_G1_x_mean: %f\n' % L2_G1_x_mean)
     print('L2_G1_x_std: %f\n' % L2_G1_x_std)
+    per_sample = dict(ssim_G1=ssim_G_x, psnr_G1=psnr_G_x, l1_G1=L1_mean_G_x, l2_G1=L2_mean_G_x)
     ##################### SSIM G2 ##################
     N = len(x_files)
     ssim_G_x = []
@@ -226,4 +261,7 @@ elif 2==stage_num:
         f.write('L1G2: %.5f +- %.5f   ' % (L1_G2_x_mean, L1_G2_x_std))
         f.write('L2G2: %.5f +- %.5f' % (L2_G2_x_mean, L2_G2_x_std))
 
+    per_sample.update(ssim=ssim_G_x, psnr=psnr_G_x, l1=L1_mean_G_x, l2=L2_mean_G_x)
+    save_per_sample(per_sample_path, load_pair_names(pairs_path, x_files), **per_sample)
+
 
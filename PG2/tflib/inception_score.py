@@ -35,7 +35,7 @@ def get_inception_score(images, splits=10):
   bs = 100
   gpu_options = tf.GPUOptions(allow_growth=True)
   sess_config = tf.ConfigProto(allow_soft_placement=True, gpu_options=gpu_options)
-  with tf.Session(config=sess_config) as sess:
+  with tf.Session(graph=softmax.graph, config=sess_config) as sess:
     preds = []
     n_batches = int(math.ceil(float(len(inps)) / float(bs)))
     for i in range(n_batches):
@@ -71,31 +71,34 @@ def _init_inception():
     statinfo = os.stat(filepath)
     print('Succesfully downloaded', filename, statinfo.st_size, 'bytes.')
   tarfile.open(filepath, 'r:gz').extractall(MODEL_DIR)
-  with tf.gfile.FastGFile(os.path.join(
-      MODEL_DIR, 'classify_image_graph_def.pb'), 'rb') as f:
-    graph_def = tf.GraphDef()
-    graph_def.ParseFromString(f.read())
-    _ = tf.import_graph_def(graph_def, name='')
-  # Works with an arbitrary minibatch size.
-  gpu_options = tf.GPUOptions(allow_growth=True)
-  sess_config = tf.ConfigProto(allow_soft_placement=True, gpu_options=gpu_options)
-  with tf.Session(config=sess_config) as sess:
-    pool3 = sess.graph.get_tensor_by_name('pool_3:0')
-    ops = pool3.graph.get_operations()
-    for op_idx, op in enumerate(ops):
-        for o in op.outputs:
-            shape = o.get_shape()
-            shape = [s.value for s in shape]
-            new_shape = []
-            for j, s in enumerate(shape):
-                if s == 1 and j == 0:
-                    new_shape.append(None)
-                else:
-                    new_shape.append(s)
-            o._shape = tf.TensorShape(new_shape)
-    w = sess.graph.get_operation_by_name("softmax/logits/MatMul").inputs[1]
-    logits = tf.matmul(tf.squeeze(pool3), w)
-    softmax = tf.nn.softmax(logits)
+  ## Own graph, so that it can be used next to an already finalized model graph
+  graph = tf.Graph()
+  with graph.as_default():
+    with tf.gfile.FastGFile(os.path.join(
+        MODEL_DIR, 'classify_image_graph_def.pb'), 'rb') as f:
+      graph_def = tf.GraphDef()
+      graph_def.ParseFromString(f.read())
+      _ = tf.import_graph_def(graph_def, name='')
+    # Works with an arbitrary minibatch size.
+    gpu_options = tf.GPUOptions(allow_growth=True)
+    sess_config = tf.ConfigProto(allow_soft_placement=True, gpu_options=gpu_options)
+    with tf.Session(config=sess_config) as sess:
+      pool3 = sess.graph.get_tensor_by_name('pool_3:0')
+      ops = pool3.graph.get_operations()
+      for op_idx, op in enumerate(ops):
+          for o in op.outputs:
+              shape = o.get_shape()
+              shape = [s.value for s in shape]
+              new_shape = []
+              for j, s in enumerate(shape):
+                  if s == 1 and j == 0:
+                      new_shape.append(None)
+                  else:
+                      new_shape.append(s)
+              o._shape = tf.TensorShape(new_shape)
+      w = sess.graph.get_operation_by_name("softmax/logits/MatMul").inputs[1]
+      logits = tf.matmul(tf.squeeze(pool3), w)
+      softmax = tf.nn.softmax(logits)
 
 if softmax is None:
   _init_inception()
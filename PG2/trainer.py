@@ -52,9 +52,10 @@ def slerp(val, low, high):
         return (1.0-val) * low + val * high # L'Hopital's rule/LERP
     return np.sin((1.0-val)*omega) / so * low + np.sin(val*omega) / so * high
 
-from datasets import market1501, dataset_utils
+from datasets import market1501, dataset_utils, image_store, mask_codec
 import utils_wgan
 from skimage.measure import compare_ssim as ssim
+from skimage.measure import compare_psnr as psnr
 from skimage.color import rgb2gray
 from PIL import Image
 from tensorflow.python.ops import sparse_ops
@@ -104,12 +105,11 @@ class PG2(object):
         self.lr_update_step = config.lr_update_step
 
         self.is_train = config.is_train
-        if self.is_train:
-            self.num_threads = 4
-            self.capacityCoff = 2
-        else: # during testing to keep the order of the input data
-            self.num_threads = 1
-            self.capacityCoff = 1
+        self.sweep_batch_num = config.sweep_batch_num
+        ## tf.data input pipeline, the parallel map keeps the order of the input data during testing
+        self.num_parallel_calls = config.num_worker
+        self.prefetch_batches = config.prefetch_batches
+        self.shuffle_buffer = config.shuffle_buffer
 
     def __init__(self, config):
         # Trainer.__init__(self, config, data_loader=None)
@@ -118,10 +118,13 @@ class PG2(object):
         self.keypoint_num = 18
         self.D_arch = config.D_arch
         if 'market' in config.dataset.lower():
-            if config.is_train:
-                self.dataset_obj = market1501.get_split('train', config.data_path)
+            split_name = 'train' if config.is_train else 'test'
+            if 'image' == config.data_layout:
+                assert image_store.has_image_store(config.data_path, 'Market1501', split_name), \
+                    'No image layout in %s, convert the split with layout image' % config.data_path
+                self.dataset_obj = image_store.ImageStore(config.data_path, 'Market1501', split_name)
             else:
-                self.dataset_obj = market1501.get_split('test', config.data_path)
+                self.dataset_obj = market1501.get_split(split_name, config.data_path)
 
         if config.test_one_by_one:
             self.x = tf.placeholder(tf.float32, shape=(None, self.img_H, self.img_W, 3))
@@ -377,8 +380,11 @@ class PG2(object):
         if not os.path.exists(test_result_dir_mask_target):
             os.makedirs(test_result_dir_mask_target)
 
+        ## pairs.csv maps the saved %05d.png index to the names of the pair, used by score.py for per pair metrics
+        pairs_file = open(os.path.join(test_result_dir, 'pairs.csv'), 'w')
+        pairs_file.write('idx,from,to\n')
         for i in xrange(400):
-            x_fixed, x_target_fixed, pose_fixed, pose_target_fixed, mask_fixed, mask_target_fixed = self.get_image_from_loader()
+            x_fixed, x_target_fixed, pose_fixed, pose_target_fixed, mask_fixed, mask_target_fixed, names_0, names_1 = self.get_image_from_loader(with_names=True)
             x = utils_wgan.process_image(x_fixed, 127.5, 127.5)
             x_target = utils_wgan.process_image(x_target_fixed, 127.5, 127.5)
             if 0==i:
@@ -403,6 +409,8 @@ class PG2(object):
                 im.save('%s/%05d.png'%(test_result_dir_mask, idx))
                 im = Image.fromarray(mask_target_fixed[j,:].squeeze().astype(np.uint8))
                 im.save('%s/%05d.png'%(test_result_dir_mask_target, idx))
+                pairs_file.write('%05d,%s,%s\n' % (idx, names_0[j], names_1[j]))
+            pairs_file.flush()
             if 0==i:
                 save_image(x_fixed, '{}/x_fixed.png'.format(test_result_dir))
                 save_image(x_target_fixed, '{}/x_target_fixed.png'.format(test_result_dir))
@@ -410,6 +418,57 @@ class PG2(object):
                 save_image(mask_target_fixed, '{}/mask_target_fixed.png'.format(test_result_dir))
                 save_image((np.amax(pose_fixed, axis=-1, keepdims=True)+1.0)*127.5, '{}/pose_fixed.png'.format(test_result_dir))
                 save_image((np.amax(pose_target_fixed, axis=-1, keepdims=True)+1.0)*127.5, '{}/pose_target_fixed.png'.format(test_result_dir))
+        pairs_file.close()
+
+    def sweep(self, ckpt_paths=None):
+        ## Score several checkpoints with one graph, one session and one set of test batches
+        import tflib.inception_score
+        if ckpt_paths is None:
+            ckpt_paths = [path[:-len('.index')] for path in glob.glob(os.path.join(self.model_dir, 'model.ckpt-*.index'))]
+            ckpt_paths.sort(key=lambda path: int(path.split('-')[-1]))
+        print('sweep over %d checkpoints' % len(ckpt_paths))
+
+        x_list = []
+        x_target_list = []
+        pose_target_list = []
+        for i in trange(self.sweep_batch_num):
+            x_fixed, x_target_fixed, pose_fixed, pose_target_fixed, mask_fixed, mask_target_fixed = self.get_image_from_loader()
+            x_list.append(x_fixed.astype(np.uint8))
+            x_target_list.append(x_target_fixed.astype(np.uint8))
+            ## binary pose maps in {-1,1} are exact in float16
+            pose_target_list.append(pose_target_fixed.astype(np.float16))
+        x_target_all = np.concatenate(x_target_list, 0)
+
+        sweep_path = os.path.join(self.model_dir, 'sweep.csv')
+        with open(sweep_path, 'w') as f:
+            f.write('ckpt,ssim,psnr,L1,L2,IS\n')
+        for ckpt_path in ckpt_paths:
+            self.saver.restore(self.sess, ckpt_path)
+            G_list = []
+            for x_fixed, pose_target_fixed in zip(x_list, pose_target_list):
+                x = utils_wgan.process_image(x_fixed.astype(np.float32), 127.5, 127.5)
+                G = self.sess.run(self.G, {self.x: x, self.pose_target: pose_target_fixed.astype(np.float32)})
+                G_list.append(G.astype(np.uint8))
+            G_all = np.concatenate(G_list, 0)
+
+            ssim_G_x = []
+            psnr_G_x = []
+            L1_mean_G_x = []
+            L2_mean_G_x = []
+            for i in xrange(G_all.shape[0]):
+                diff = G_all[i].astype(float) - x_target_all[i].astype(float)
+                ssim_G_x.append(ssim(G_all[i], x_target_all[i], multichannel=True))
+                psnr_G_x.append(psnr(im_true=x_target_all[i], im_test=G_all[i]))
+                L1_mean_G_x.append(np.sum(np.abs(diff))/np.product(diff.shape))
+                L2_mean_G_x.append(np.sqrt(np.sum(diff**2))/np.product(diff.shape))
+            IS_G_mean, IS_G_std = tflib.inception_score.get_inception_score(list(G_all))
+
+            line = '%s,%.5f,%.5f,%.5f,%.5f,%.5f' % (os.path.basename(ckpt_path), np.mean(ssim_G_x), np.mean(psnr_G_x),
+                        np.mean(L1_mean_G_x), np.mean(L2_mean_G_x), IS_G_mean)
+            print(line)
+            with open(sweep_path, 'a') as f:
+                f.write(line + '\n')
+        print('[*] Sweep table saved: {}'.format(sweep_path))
 
     def generate(self, x_fixed, x_target_fixed, pose_target_fixed, root_path=None, path=None, idx=None, save=True):
         G = self.sess.run(self.G, {self.x: x_fixed, self.pose_target: pose_target_fixed})
@@ -428,33 +487,94 @@ class PG2(object):
             print("[*] Samples saved: {}".format(path))
         return G
 
-    def _load_batch_pair_pose(self, dataset):
-        data_provider = slim.dataset_data_provider.DatasetDataProvider(dataset, common_queue_capacity=32, common_queue_min=8)
-        image_raw_0, image_raw_1, label, pose_0, pose_1, mask_0, mask_1  = data_provider.get([
-            'image_raw_0', 'image_raw_1', 'label', 'pose_sparse_r4_0', 'pose_sparse_r4_1', 'pose_mask_r4_0', 'pose_mask_r4_1'])
+    def _read_image_store_pair(self, store, index_0, index_1, height, width):
+        """Looks a pair up in an ImageStore, returns the decoded images, dense poses, masks and names of the pair."""
+        image_raw_0, image_raw_1, indices_0, values_0, indices_1, values_1, mask_0, mask_1, name_0, name_1 = \
+            store.lookup_tensors(index_0, index_1)
+        image_raw_0 = tf.image.decode_jpeg(image_raw_0, channels=3)
+        image_raw_1 = tf.image.decode_jpeg(image_raw_1, channels=3)
+        pose_0 = tf.sparse_to_dense(indices_0, [height * width * self.keypoint_num], values_0, validate_indices=False)
+        pose_1 = tf.sparse_to_dense(indices_1, [height * width * self.keypoint_num], values_1, validate_indices=False)
+        mask_0 = mask_codec.decode_mask(mask_0, height * width)
+        mask_1 = mask_codec.decode_mask(mask_1, height * width)
+        return image_raw_0, image_raw_1, pose_0, pose_1, mask_0, mask_1, name_0, name_1
+
+    def _read_record_pair(self, dataset, serialized):
+        """Decodes a pair example with the decoder of a slim dataset, returns the same as _read_image_store_pair."""
+        image_raw_0, image_raw_1, pose_0, pose_1, mask_0, mask_1, name_0, name_1 = dataset.decoder.decode(serialized, [
+            'image_raw_0', 'image_raw_1', 'pose_sparse_r4_0', 'pose_sparse_r4_1', 'pose_mask_r4_0', 'pose_mask_r4_1',
+            'image_name_0', 'image_name_1'])
         pose_0 = sparse_ops.sparse_tensor_to_dense(pose_0, default_value=0, validate_indices=False)
         pose_1 = sparse_ops.sparse_tensor_to_dense(pose_1, default_value=0, validate_indices=False)
-
-        image_raw_0 = tf.reshape(image_raw_0, [128, 64, 3])        
-        image_raw_1 = tf.reshape(image_raw_1, [128, 64, 3]) 
-        pose_0 = tf.cast(tf.reshape(pose_0, [128, 64, self.keypoint_num]), tf.float32)
-        pose_1 = tf.cast(tf.reshape(pose_1, [128, 64, self.keypoint_num]), tf.float32)
-        mask_0 = tf.cast(tf.reshape(mask_0, [128, 64, 1]), tf.float32)
-        mask_1 = tf.cast(tf.reshape(mask_1, [128, 64, 1]), tf.float32)
-
-        images_0, images_1, poses_0, poses_1, masks_0, masks_1 = tf.train.batch([image_raw_0, image_raw_1, pose_0, pose_1, mask_0, mask_1], 
-                    batch_size=self.batch_size, num_threads=self.num_threads, capacity=self.capacityCoff * self.batch_size)
-
-        images_0 = utils_wgan.process_image(tf.to_float(images_0), 127.5, 127.5)
-        images_1 = utils_wgan.process_image(tf.to_float(images_1), 127.5, 127.5)
-        poses_0 = poses_0*2-1
-        poses_1 = poses_1*2-1
+        return image_raw_0, image_raw_1, pose_0, pose_1, mask_0, mask_1, name_0, name_1
+
+    def _preprocess_pair(self, height, width, image_raw_0, image_raw_1, pose_0, pose_1, mask_0, mask_1, name_0, name_1):
+        image_raw_0 = tf.reshape(image_raw_0, [height, width, 3])
+        image_raw_1 = tf.reshape(image_raw_1, [height, width, 3])
+        pose_0 = tf.cast(tf.reshape(pose_0, [height, width, self.keypoint_num]), tf.float32)
+        pose_1 = tf.cast(tf.reshape(pose_1, [height, width, self.keypoint_num]), tf.float32)
+        mask_0 = tf.cast(tf.reshape(mask_0, [height, width, 1]), tf.float32)
+        mask_1 = tf.cast(tf.reshape(mask_1, [height, width, 1]), tf.float32)
+
+        image_0 = utils_wgan.process_image(tf.to_float(image_raw_0), 127.5, 127.5)
+        image_1 = utils_wgan.process_image(tf.to_float(image_raw_1), 127.5, 127.5)
+        pose_0 = pose_0*2-1
+        pose_1 = pose_1*2-1
+        return image_0, image_1, pose_0, pose_1, mask_0, mask_1, name_0, name_1
+
+    def _pair_dataset(self, dataset, height, width):
+        """Returns a tf.data.Dataset of the preprocessed pairs of a slim dataset or an ImageStore, repeated forever.
+
+        Training shuffles the shards and pairs. Testing reads them in order and the
+        parallel map keeps the order, so the test batches do not depend on num_worker.
+        """
+        if isinstance(dataset, image_store.ImageStore):
+            pairs = np.array(dataset.pairs.pairs, dtype=np.int32)
+            indices = tf.data.Dataset.from_tensor_slices((pairs[:, 0], pairs[:, 1]))
+            if self.is_train:
+                indices = indices.shuffle(len(pairs))
+            read_pair = lambda index_0, index_1: self._read_image_store_pair(dataset, index_0, index_1, height, width)
+            return indices.repeat().map(lambda index_0, index_1: self._preprocess_pair(height, width, *read_pair(index_0, index_1)),
+                                        num_parallel_calls=self.num_parallel_calls)
+
+        files = dataset.data_sources
+        if not isinstance(files, (tuple, list)):
+            files = sorted(tf.gfile.Glob(files))
+        filenames = tf.data.Dataset.from_tensor_slices(files)
+        if self.is_train:
+            filenames = filenames.shuffle(len(files))
+        filenames = filenames.repeat()
+        if hasattr(tf.contrib.data, 'parallel_interleave'):
+            records = filenames.apply(tf.contrib.data.parallel_interleave(
+                    tf.data.TFRecordDataset, cycle_length=len(files), sloppy=self.is_train))
+        else:
+            records = filenames.interleave(tf.data.TFRecordDataset, cycle_length=len(files))
+        if self.is_train:
+            records = records.shuffle(self.shuffle_buffer)
+        return records.map(lambda serialized: self._preprocess_pair(height, width, *self._read_record_pair(dataset, serialized)),
+                           num_parallel_calls=self.num_parallel_calls)
+
+    def _batch_pair_pose(self, dataset, height, width):
+        batches = self._pair_dataset(dataset, height, width).batch(self.batch_size).prefetch(self.prefetch_batches)
+        images_0, images_1, poses_0, poses_1, masks_0, masks_1, self.names_0, self.names_1 = \
+            batches.make_one_shot_iterator().get_next()
+        ## The pairs are repeated forever, every batch is full
+        for tensor in [images_0, images_1, poses_0, poses_1, masks_0, masks_1, self.names_0, self.names_1]:
+            tensor.set_shape([self.batch_size] + tensor.get_shape().as_list()[1:])
         return images_0, images_1, poses_0, poses_1, masks_0, masks_1
 
-    def get_image_from_loader(self):
-        x, x_target, pose, pose_target, mask, mask_target = self.sess.run([self.x, self.x_target, self.pose, self.pose_target, self.mask, self.mask_target])
+    def _load_batch_pair_pose(self, dataset):
+        return self._batch_pair_pose(dataset, 128, 64)
+
+    def get_image_from_loader(self, with_names=False):
+        if with_names:
+            x, x_target, pose, pose_target, mask, mask_target, names_0, names_1 = self.sess.run([self.x, self.x_target, self.pose, self.pose_target, self.mask, self.mask_target, self.names_0, self.names_1])
+        else:
+            x, x_target, pose, pose_target, mask, mask_target = self.sess.run([self.x, self.x_target, self.pose, self.pose_target, self.mask, self.mask_target])
         x = utils_wgan.unprocess_image(x, 127.5, 127.5)
         x_target = utils_wgan.unprocess_image(x_target, 127.5, 127.5)
         mask = mask*255
         mask_target = mask_target*255
+        if with_names:
+            return x, x_target, pose, pose_target, mask, mask_target, names_0, names_1
         return x, x_target, pose, pose_target, mask, mask_target
\ No newline at end of file
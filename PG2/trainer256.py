@@ -1,6 +1,6 @@
 from trainer import *
 from models256 import *
-from datasets import deepfashion
+from datasets import deepfashion, image_store
 
 class PG2_256(PG2):
     def __init__(self, config):
@@ -9,10 +9,13 @@ class PG2_256(PG2):
         self.D_arch = config.D_arch
 
         if ('deepfashion' in config.dataset.lower()) or ('df' in config.dataset.lower()):
-            if config.is_train:
-                self.dataset_obj = deepfashion.get_split('train', config.data_path, data_name='DeepFashion')
+            split_name = 'train' if config.is_train else 'test'
+            if 'image' == config.data_layout:
+                assert image_store.has_image_store(config.data_path, 'DeepFashion', split_name), \
+                    'No image layout in %s, convert the split with layout image' % config.data_path
+                self.dataset_obj = image_store.ImageStore(config.data_path, 'DeepFashion', split_name)
             else:
-                self.dataset_obj = deepfashion.get_split('test', config.data_path, data_name='DeepFashion')
+                self.dataset_obj = deepfashion.get_split(split_name, config.data_path, data_name='DeepFashion')
 
         self.x, self.x_target, self.pose, self.pose_target, self.mask, self.mask_target = self._load_batch_pair_pose(self.dataset_obj)
 
@@ -88,28 +91,6 @@ class PG2_256(PG2):
         ])
 
     def _load_batch_pair_pose(self, dataset, mode='coordSolid'):
-        data_provider = slim.dataset_data_provider.DatasetDataProvider(dataset, common_queue_capacity=32, common_queue_min=8)
-
-        image_raw_0, image_raw_1, label, pose_0, pose_1, mask_0, mask_1 = data_provider.get([
-            'image_raw_0', 'image_raw_1', 'label', 'pose_sparse_r4_0', 'pose_sparse_r4_1', 'pose_mask_r4_0', 'pose_mask_r4_1'])
-
-        pose_0 = sparse_ops.sparse_tensor_to_dense(pose_0, default_value=0, validate_indices=False)
-        pose_1 = sparse_ops.sparse_tensor_to_dense(pose_1, default_value=0, validate_indices=False)
-
-        image_raw_0 = tf.reshape(image_raw_0, [256, 256, 3])        
-        image_raw_1 = tf.reshape(image_raw_1, [256, 256, 3]) 
-        pose_0 = tf.cast(tf.reshape(pose_0, [256, 256, self.keypoint_num]), tf.float32)
-        pose_1 = tf.cast(tf.reshape(pose_1, [256, 256, self.keypoint_num]), tf.float32)
-        mask_0 = tf.cast(tf.reshape(mask_0, [256, 256, 1]), tf.float32)
-        mask_1 = tf.cast(tf.reshape(mask_1, [256, 256, 1]), tf.float32)
-
-        images_0, images_1, poses_0, poses_1, masks_0, masks_1 = tf.train.batch([image_raw_0, image_raw_1, pose_0, pose_1, mask_0, mask_1], 
-                    batch_size=self.batch_size, num_threads=self.num_threads, capacity=self.capacityCoff * self.batch_size)
-
-        images_0 = utils_wgan.process_image(tf.to_float(images_0), 127.5, 127.5)
-        images_1 = utils_wgan.process_image(tf.to_float(images_1), 127.5, 127.5)
-        poses_0 = poses_0*2-1
-        poses_1 = poses_1*2-1
-        return images_0, images_1, poses_0, poses_1, masks_0, masks_1
+        return self._batch_pair_pose(dataset, 256, 256)
 
 
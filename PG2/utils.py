@@ -102,41 +102,27 @@ def _getPoseMask(peaks, height, width, radius=4, var=4, mode='Solid'):
     limbSeq = [[2,3], [2,6], [3,4], [4,5], [6,7], [7,8], [2,9], [9,10], \
                          [10,11], [2,12], [12,13], [13,14], [2,1], [1,15], [15,17], \
                          [1,16], [16,18], [2,17], [2,18], [9,12], [12,6], [9,3], [17,18]] #
-    indices = []
-    values = []
-    for limb in limbSeq:
-        p0 = peaks[limb[0] -1]
-        p1 = peaks[limb[1] -1]
-        if 0!=len(p0) and 0!=len(p1):
-            r0 = p0[0][1]
-            c0 = p0[0][0]
-            r1 = p1[0][1]
-            c1 = p1[0][0]
-            ind, val = _getSparseKeypoint(r0, c0, 0, height, width, radius, var, mode)
-            indices.extend(ind)
-            values.extend(val)
-            ind, val = _getSparseKeypoint(r1, c1, 0, height, width, radius, var, mode)
-            indices.extend(ind)
-            values.extend(val)
-        
-            distance = np.sqrt((r0-r1)**2 + (c0-c1)**2)
-            sampleN = int(distance/radius)
-            # sampleN = 0
-            if sampleN>1:
-                for i in xrange(1,sampleN):
-                    r = r0 + (r1-r0)*i/sampleN
-                    c = c0 + (c1-c0)*i/sampleN
-                    ind, val = _getSparseKeypoint(r, c, 0, height, width, radius, var, mode)
-                    indices.extend(ind)
-                    values.extend(val)
+    ## Both joints of every limb with two visible joints
+    limbs = [limb for limb in limbSeq if 0!=len(peaks[limb[0] -1]) and 0!=len(peaks[limb[1] -1])]
+    r0 = np.array([peaks[limb[0] -1][0][1] for limb in limbs])
+    c0 = np.array([peaks[limb[0] -1][0][0] for limb in limbs])
+    r1 = np.array([peaks[limb[1] -1][0][1] for limb in limbs])
+    c1 = np.array([peaks[limb[1] -1][0][0] for limb in limbs])
+
+    ## Points of every limb: both joints, then sampleN-1 points in between
+    distance = np.sqrt((r0-r1)**2 + (c0-c1)**2)
+    sampleN = (distance/radius).astype(int)
+    count = 2 + np.maximum(sampleN-1, 0)
+    limb = np.repeat(np.arange(len(limbs)), count)
+    i = np.arange(count.sum()) - np.repeat(np.cumsum(count)-count, count) - 1
+    n = np.maximum(sampleN[limb], 1)
+    r = np.where(i<0, r0[limb], np.where(i==0, r1[limb], r0[limb] + (r1[limb]-r0[limb])*i/n))
+    c = np.where(i<0, c0[limb], np.where(i==0, c1[limb], c0[limb] + (c1[limb]-c0[limb])*i/n))
+    indices, values = _getSparseKeypoints(r, c, np.zeros(len(r), dtype=int), height, width, radius, var, mode)
 
     shape = [height, width, 1]
     ## Fill body
     dense = np.squeeze(_sparse2dense(indices, values, shape))
-    ## TODO
-    # im = Image.fromarray((dense*255).astype(np.uint8))
-    # im.save('xxxxx.png')
-    # pdb.set_trace()
     dense = dilation(dense, square(5))
     dense = erosion(dense, square(5))
     return dense
@@ -144,57 +130,60 @@ def _getPoseMask(peaks, height, width, radius=4, var=4, mode='Solid'):
 
 Ratio_0_4 = 1.0/scipy.stats.norm(0, 4).pdf(0)
 Gaussian_0_4 = scipy.stats.norm(0, 4)
-def _getSparseKeypoint(r, c, k, height, width, radius=4, var=4, mode='Solid'):
-    r = int(r)
-    c = int(c)
-    k = int(k)
-    indices = []
-    values = []
-    for i in range(-radius, radius+1):
-        for j in range(-radius, radius+1):
-            distance = np.sqrt(float(i**2+j**2))
-            if r+i>=0 and r+i<height and c+j>=0 and c+j<width:
-                if 'Solid'==mode and distance<=radius:
-                    indices.append([r+i, c+j, k])
-                    values.append(1)
-                elif 'Gaussian'==mode and distance<=radius:
-                    indices.append([r+i, c+j, k])
-                    if 4==var:
-                        values.append( Gaussian_0_4.pdf(distance) * Ratio_0_4  )
-                    else:
-                        assert 'Only define Ratio_0_4  Gaussian_0_4 ...'
+## Offsets and distances of the pixels of a window within radius, in row-major order
+_Disk_offsets = {}
+def _getDiskOffsets(radius):
+    if radius not in _Disk_offsets:
+        i, j = np.mgrid[-radius:radius+1, -radius:radius+1]
+        distance = np.sqrt((i**2+j**2).astype(float))
+        inside = distance<=radius
+        _Disk_offsets[radius] = (i[inside], j[inside], distance[inside])
+    return _Disk_offsets[radius]
+
+def _getSparseKeypoints(rs, cs, ks, height, width, radius=4, var=4, mode='Solid'):
+    ## Indices (N, 3) and values (N,) of the windows of all keypoints, in the order of _getSparseKeypoint calls
+    di, dj, distance = _getDiskOffsets(radius)
+    rows = np.asarray(rs).astype(int).reshape((-1, 1)) + di
+    cols = np.asarray(cs).astype(int).reshape((-1, 1)) + dj
+    ks = np.broadcast_to(np.asarray(ks).astype(int).reshape((-1, 1)), rows.shape)
+    valid = (rows>=0) & (rows<height) & (cols>=0) & (cols<width)
+    indices = np.stack([rows[valid], cols[valid], ks[valid]], axis=1)
+    if 'Solid'==mode:
+        values = np.ones(len(indices), dtype=int)
+    elif 'Gaussian'==mode:
+        assert 4==var, 'Only define Ratio_0_4  Gaussian_0_4 ...'
+        values = (Gaussian_0_4.pdf(distance) * Ratio_0_4)[np.nonzero(valid)[1]]
+    else:
+        indices, values = indices[:0], np.zeros(0)
     return indices, values
 
+def _getSparseKeypoint(r, c, k, height, width, radius=4, var=4, mode='Solid'):
+    indices, values = _getSparseKeypoints([r], [c], [k], height, width, radius, var, mode)
+    return indices.tolist(), values.tolist()
+
 def _getSparsePose(peaks, height, width, channel, radius=4, var=4, mode='Solid'):
-    indices = []
-    values = []
-    for k in range(len(peaks)):
-        p = peaks[k]
-        if 0!=len(p):
-            r = p[0][1]
-            c = p[0][0]
-            ind, val = _getSparseKeypoint(r, c, k, height, width, radius, var, mode)
-            indices.extend(ind)
-            values.extend(val)
+    ks = [k for k in range(len(peaks)) if 0!=len(peaks[k])]
+    rs = [peaks[k][0][1] for k in ks]
+    cs = [peaks[k][0][0] for k in ks]
+    indices, values = _getSparseKeypoints(rs, cs, ks, height, width, radius, var, mode)
     shape = [height, width, channel]
-    return indices, values, shape
+    return indices.tolist(), values.tolist(), shape
 
 def _oneDimSparsePose(indices, shape):
-    ind_onedim = []
-    for ind in indices:
-        # idx = ind[2]*shape[0]*shape[1] + ind[1]*shape[0] + ind[0]
-        idx = ind[0]*shape[2]*shape[1] + ind[1]*shape[2] + ind[2]
-        ind_onedim.append(idx)
+    indices = np.asarray(indices, dtype=int).reshape((-1, 3))
+    # idx = ind[2]*shape[0]*shape[1] + ind[1]*shape[0] + ind[0]
+    ind_onedim = indices[:,0]*shape[2]*shape[1] + indices[:,1]*shape[2] + indices[:,2]
     shape = np.prod(shape)
-    return ind_onedim, shape
+    return ind_onedim.tolist(), shape
 
 def _sparse2dense(indices, values, shape):
     dense = np.zeros(shape)
-    for i in range(len(indices)):
-        r = indices[i][0]
-        c = indices[i][1]
-        k = indices[i][2]
-        dense[r,c,k] = values[i]
+    indices = np.asarray(indices, dtype=int).reshape((-1, 3))
+    ## The last value of a repeated index is kept, as with assignments in order
+    flat = np.ravel_multi_index(indices.T, dense.shape, mode='wrap')
+    _, last = np.unique(flat[::-1], return_index=True)
+    last = len(flat) - 1 - last
+    dense[indices[last,0], indices[last,1], indices[last,2]] = np.asarray(values)[last]
     return dense
 
 def _get_valid_peaks(all_peaks, subsets):
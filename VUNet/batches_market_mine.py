@@ -6,6 +6,7 @@ import os
 import cv2
 import math
 import pandas as pd
+from pair_table import PairTable, is_pair_table
 
 
 N_BPARTS = 10
@@ -605,13 +606,12 @@ class IndexFlow(object):
             self.pair_list_path = pairs_path
         else:
             self.pair_list_path = os.path.join(self.basepath, '{}_pairs.csv'.format(traintest))
-        pairs_file = pd.read_csv(self.pair_list_path)
-        self.size = len(pairs_file)
-        self.pairs = []
         print('Loading data pairs ...')
-        for i in range(self.size):
-            pair = [pairs_file.iloc[i]['from'], pairs_file.iloc[i]['to']]
-            self.pairs.append(pair)
+        if is_pair_table(self.pair_list_path):
+            self.pairs = PairTable(self.pair_list_path)
+        else:
+            self.pairs = pd.read_csv(self.pair_list_path)[['from', 'to']].values
+        self.size = len(self.pairs)
         print('Loading data pairs finished ...')
         self.mask = mask
         self.fill_batches = fill_batches
@@ -301,10 +301,13 @@ class Model(object):
 
 
     def restore_graph(self, restore_path):
-        self.writer = tf.summary.FileWriter(
-                self.out_dir,
-                session.graph)
-        self.saver = tf.train.Saver(self.variables)
+        # saver is created once, so that restoring several checkpoints
+        # (sweep mode) does not add new ops to the graph every time
+        if not hasattr(self, "saver"):
+            self.writer = tf.summary.FileWriter(
+                    self.out_dir,
+                    session.graph)
+            self.saver = tf.train.Saver(self.variables)
         self.saver.restore(session, restore_path)
         self.logger.info("Restored model from {}".format(restore_path))
 
@@ -477,7 +480,7 @@ if __name__ == "__main__":
     parser.add_argument("--data_index", required = True, help = "path to training or testing data index")
     parser.add_argument("--test_data_index", required = True, help = "path to training or testing data index")
     parser.add_argument("--mode", default = "train",
-            choices=["train", "test", "mcmc", "add_reconstructions", "transfer"])
+            choices=["train", "test", "mcmc", "add_reconstructions", "transfer", "sweep"])
     parser.add_argument("--log_dir", default = default_log_dir, help = "path to log into")
     parser.add_argument("--batch_size", default = 16, type = int, help = "batch size")
     parser.add_argument("--init_batches", default = 4, type = int, help = "number of batches for initialization")
@@ -492,7 +495,9 @@ if __name__ == "__main__":
     parser.add_argument("--drop_prob", default = 0.1, type = float, help = "Dropout probability")
     parser.add_argument("--mask", dest = "mask", action = "store_true", help = "Use masked data")
     parser.add_argument("--no-mask", dest = "mask", action = "store_false", help = "Do not use mask")
-    parser.add_argument("--pairs_path", default='./test_pairs.csv', type=str, help = "pairs file path")
+    parser.add_argument("--pairs_path", default='./test_pairs.csv', type=str, help = "pairs file path, csv or pair table")
+    parser.add_argument("--sweep_dir", help = "directory with model.ckpt-* to evaluate in sweep mode, default is directory of --checkpoint")
+    parser.add_argument("--sweep_batches", default = 0, type = int, help = "number of test batches in sweep mode, 0 for all")
     parser.set_defaults(mask = True)
     opt = parser.parse_args()
 
@@ -654,6 +659,47 @@ if __name__ == "__main__":
             final_results = np.stack(final_results, axis=0)
             bm.plot_batch_mine_resize(condition_imgs, target_imgs, final_results, output_img_dir, from_image, to_image)
 
+    elif opt.mode == "sweep":
+        from skimage.measure import compare_ssim
+        sweep_dir = opt.sweep_dir
+        if sweep_dir is None and opt.checkpoint:
+            sweep_dir = os.path.dirname(opt.checkpoint)
+        if not sweep_dir:
+            raise Exception("Sweep requires --sweep_dir or --checkpoint")
+        checkpoints = [path[:-len(".index")] for path in glob.glob(os.path.join(sweep_dir, "model.ckpt-*.index"))]
+        checkpoints.sort(key = lambda path: int(path.rsplit("-", 1)[1]))
+        logger.info("Number of checkpoints: {}".format(len(checkpoints)))
+        batch_size = opt.batch_size
+        img_shape = 2*[opt.spatial_size] + [3]
+        data_shape = [batch_size] + img_shape
+        valid_batches = bm.get_batches(data_shape, opt.data_index,
+                mask = opt.mask, train = False, shuffle = False, return_keys=["source_norm_imgs", "source_norm_joints", "target_joints", "target_imgs"], pairs_path=opt.pairs_path)
+        n_batches = valid_batches.n // batch_size
+        if opt.sweep_batches > 0:
+            n_batches = min(n_batches, opt.sweep_batches)
+
+        # test batches and target images are loaded once for all checkpoints
+        test_batches = [next(valid_batches) for i in trange(n_batches)]
+        target_imgs = np.concatenate([postprocess(batch[3]) for batch in test_batches])
+
+        model = Model(opt, out_dir, logger)
+        sweep_path = os.path.join(out_dir, "sweep.csv")
+        with open(sweep_path, "w") as f:
+            f.write("checkpoint,ssim,l1\n")
+        for checkpoint in checkpoints:
+            model.restore_graph(checkpoint)
+            results = np.concatenate([postprocess(model.transfer(SXN_batch, SCN_batch, TC_batch))
+                for SXN_batch, SCN_batch, TC_batch, _ in tqdm(test_batches)])
+            ssim = [compare_ssim(target, result, gaussian_weights=True, sigma=1.5,
+                use_sample_covariance=False, multichannel=True, data_range=result.max() - result.min())
+                for target, result in zip(target_imgs, results)]
+            l1 = [np.abs(2 * (target/255.0 - 0.5) - 2 * (result/255.0 - 0.5)).mean()
+                for target, result in zip(target_imgs, results)]
+            logger.info("{}: ssim {}, l1 {}".format(checkpoint, np.mean(ssim), np.mean(l1)))
+            with open(sweep_path, "a") as f:
+                f.write("{},{},{}\n".format(os.path.basename(checkpoint), np.mean(ssim), np.mean(l1)))
+        logger.info("Wrote {}".format(sweep_path))
+
     elif opt.mode == "mcmc":
         if not opt.checkpoint:
             raise Exception("Testing requires --checkpoint")
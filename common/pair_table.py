@@ -0,0 +1,127 @@
+"""
+    Binary pair table shared by Deform, PG2 and VUNet, every method imports it through the pair_table.py next
+    to its own code. A table with prefix p consists of
+        p.manifest.txt  image names, one per line
+        p.pairs.npy     int32 (P, 2) indices of (from, to) images into the manifest
+        p.flags.npy     optional uint8 (P,) flags of every pair (FLAG_POSITIVE, FLAG_TEST)
+        p.json          number of pairs and images and the sha1 fingerprint of the manifest
+    Arrays are memory-mapped, the pair lookup of a sample is an array index.
+"""
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+FLAG_POSITIVE = 1
+FLAG_TEST = 2
+
+
+def manifest_fingerprint(names):
+    return hashlib.sha1('\n'.join(names).encode('utf-8')).hexdigest()
+
+
+def table_prefix(path):
+    return path[:-len('.json')] if path.endswith('.json') else path
+
+
+def is_pair_table(path):
+    return os.path.exists(table_prefix(path) + '.json')
+
+
+def save_pair_table(prefix, names, pairs, flags=None):
+    names = [str(name) for name in names]
+    pairs = np.asarray(pairs, dtype=np.int32).reshape((-1, 2))
+    assert len(pairs) == 0 or (pairs.min() >= 0 and pairs.max() < len(names)), "Pair index outside of manifest"
+
+    with open(prefix + '.manifest.txt', 'w') as f:
+        f.write('\n'.join(names) + '\n')
+    np.save(prefix + '.pairs.npy', pairs)
+    if flags is not None:
+        np.save(prefix + '.flags.npy', np.asarray(flags, dtype=np.uint8))
+    with open(prefix + '.json', 'w') as f:
+        json.dump({'fingerprint': manifest_fingerprint(names), 'number_of_pairs': len(pairs),
+                   'number_of_images': len(names), 'flags': flags is not None}, f)
+
+
+class PairTable(object):
+    """
+        Memory-mapped pair table. table[i] is the (from, to) names of pair i, i can be an index array.
+    """
+    def __init__(self, path, mmap_mode='r'):
+        prefix = table_prefix(path)
+        with open(prefix + '.json') as f:
+            self.meta = json.load(f)
+        with open(prefix + '.manifest.txt') as f:
+            self.names = np.array(f.read().splitlines())
+        assert manifest_fingerprint(self.names) == self.meta['fingerprint'], \
+            "Manifest of %s does not match its fingerprint" % prefix
+
+        self.pairs = np.load(prefix + '.pairs.npy', mmap_mode=mmap_mode)
+        self.flags = np.load(prefix + '.flags.npy', mmap_mode=mmap_mode) if self.meta['flags'] else None
+        assert len(self.pairs) == self.meta['number_of_pairs']
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def __getitem__(self, index):
+        pair = self.pairs[index]
+        return self.names[pair[..., 0]], self.names[pair[..., 1]]
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.DataFrame({'from': self.names[self.pairs[:, 0]], 'to': self.names[self.pairs[:, 1]]},
+                            columns=['from', 'to'])
+
+
+def pairs_from_csv(pairs_file, names=None):
+    """
+        Manifest (sorted names of the pairs if not given) and (P, 2) index array of a from,to pairs csv.
+    """
+    import pandas as pd
+    df = pd.read_csv(pairs_file)
+    if names is None:
+        names = np.unique(np.concatenate([df['from'].values, df['to'].values]).astype(str))
+    index = dict((name, i) for i, name in enumerate(names))
+    pairs = np.array([[index[fr], index[to]] for fr, to in zip(df['from'], df['to'])], dtype=np.int32)
+    return list(names), pairs.reshape((-1, 2))
+
+
+def load_pair_index(path):
+    """
+        Manifest and (P, 2) int32 index array of a pair table (memory-mapped) or of a from,to pairs csv.
+    """
+    if is_pair_table(path):
+        table = PairTable(path)
+        return table.names, table.pairs
+    names, pairs = pairs_from_csv(path)
+    return np.array(names), pairs
+
+
+def load_pairs_frame(path):
+    """
+        from,to dataframe of a pairs csv or a pair table.
+    """
+    if is_pair_table(path):
+        return PairTable(path).to_frame()
+    import pandas as pd
+    return pd.read_csv(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a from,to pairs csv to a pair table")
+    parser.add_argument("pairs_file", help="Pairs csv with from,to columns")
+    parser.add_argument("output_prefix", help="Prefix of the pair table files")
+    parser.add_argument("--manifest", default=None, help="Existing manifest to index into, one name per line")
+    parser.add_argument("--test", default=0, type=int, help="Flag all pairs as test pairs")
+    args = parser.parse_args()
+
+    names = None
+    if args.manifest is not None:
+        with open(args.manifest) as f:
+            names = f.read().splitlines()
+    names, pairs = pairs_from_csv(args.pairs_file, names)
+    flags = np.full(len(pairs), FLAG_TEST if args.test else 0, dtype=np.uint8)
+    save_pair_table(args.output_prefix, names, pairs, flags)
+    print ("Saved %s pairs of %s images to %s" % (len(pairs), len(names), args.output_prefix))